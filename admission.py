@@ -0,0 +1,206 @@
+# admission.py
+
+# ======= Admission control and load shedding =======
+# When results or admission forms go live, a surge of parents arrives at once.
+# Left alone, every request waits its turn (in gunicorn's backlog or thread
+# pool) and everyone's latency grows together. Instead each request is admitted,
+# queued briefly, or turned away at once with a Retry-After:
+#
+#   429  the client spent its token bucket (`rate` requests/s, `burst` at once)
+#   503  `max_concurrent` requests are running and the wait queue (`max_queue`
+#        deep, `queue_timeout` seconds) is full or timed out, or the request
+#        already sat in the proxy/gunicorn backlog longer than `max_wait`
+#
+# Cheap requests (pre-rendered pages, cached /chat replies) may use
+# `cheap_reserve` slots above max_concurrent and are woken first, so they keep
+# flowing while expensive ones are shed. A limit of 0 turns that check off.
+#
+# Parents behind one school or carrier NAT share an address, so keep the
+# per-client rate generous; it is there to stop a runaway script, not a family.
+#
+# AdmissionMiddleware applies it in front of the WSGI app, so a refusal never
+# reaches the framework: it costs about half an answer under gunicorn (most of
+# the rest is gunicorn's own per-connection work). Shedding keeps the answered
+# requests' latency bounded, but once refusals alone fill a worker nothing in
+# the process can drain the backlog; floods that size belong to the proxy
+# (nginx limit_req / limit_conn). See bench/overload.py.
+
+import io
+import math
+import threading
+import time
+from collections import OrderedDict
+
+
+def backlog_age(header, now=None):
+    # Seconds since a proxy saw the request, from X-Request-Start ("t=<time>",
+    # seconds / ms / us since the epoch, as nginx or Heroku send it); None if unknown.
+    if not header:
+        return None
+    try:
+        start = float(header.strip().lstrip("t="))
+    except ValueError:
+        return None
+    if start > 1e14:
+        start /= 1e6
+    elif start > 1e11:
+        start /= 1e3
+    return (time.time() if now is None else now) - start
+
+
+class AdmissionController:
+    def __init__(self, rate=10.0, burst=30, max_concurrent=16, max_queue=64, queue_timeout=0.25,
+                 cheap_reserve=8, max_wait=0.0, retry_after=1, max_clients=100000,
+                 clock=time.monotonic):
+        self.rate = rate
+        self.burst = burst
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.cheap_reserve = cheap_reserve
+        self.max_wait = max_wait
+        self.retry_after = retry_after
+        self.max_clients = max_clients
+        self.clock = clock
+
+        self._buckets = OrderedDict()  # client -> [tokens, last refill], least recent first
+        self._bucket_lock = threading.Lock()
+        lock = threading.Lock()
+        self._normal = threading.Condition(lock)
+        self._cheap = threading.Condition(lock)
+        self.active = 0
+        self.waiting = {False: 0, True: 0}
+        self.rejected = {"rate": 0, "busy": 0, "stale": 0}
+
+    def check_rate(self, client):
+        # -> 0 if the client may go ahead, else seconds until its next token;
+        # client None is never charged (e.g. the page and its static files)
+        if self.rate <= 0 or client is None:
+            return 0
+        now = self.clock()
+        buckets = self._buckets
+        with self._bucket_lock:
+            bucket = buckets.get(client)
+            if bucket is None:
+                while len(buckets) >= self.max_clients:
+                    buckets.popitem(last=False)
+                bucket = buckets[client] = [float(self.burst), now]
+            else:
+                buckets.move_to_end(client)
+                bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+                bucket[1] = now
+            if bucket[0] >= 1:
+                bucket[0] -= 1
+                return 0
+            return (1 - bucket[0]) / self.rate
+
+    def acquire(self, cheap=False, block=True):
+        # Take a slot, waiting up to queue_timeout; False when shed. Waiting
+        # blocks the calling thread, so an event loop passes block=False: it
+        # would wait for a release() only the loop itself can run.
+        if self.max_concurrent <= 0:
+            return True
+        limit = self.max_concurrent + (self.cheap_reserve if cheap else 0)
+        cond = self._cheap if cheap else self._normal
+        with cond:
+            if self.active < limit:
+                self.active += 1
+                return True
+            if not block or self.waiting[cheap] >= self.max_queue:
+                return False
+            self.waiting[cheap] += 1
+            deadline = self.clock() + self.queue_timeout
+            try:
+                while self.active >= limit:
+                    remaining = deadline - self.clock()
+                    if remaining <= 0:
+                        return False
+                    cond.wait(remaining)
+                self.active += 1
+                return True
+            finally:
+                self.waiting[cheap] -= 1
+
+    def release(self):
+        if self.max_concurrent <= 0:
+            return
+        with self._normal:
+            self.active -= 1
+            # one waiter of each kind: whichever can use the freed slot takes it
+            if self.waiting[True]:
+                self._cheap.notify()
+            if self.waiting[False]:
+                self._normal.notify()
+
+    def admit(self, client, cheap=False, request_start=None, block=True):
+        # -> None when admitted (call release() when done), else (status, reason, retry_after)
+        if self.max_wait > 0:
+            age = backlog_age(request_start)
+            if age is not None and age > self.max_wait:
+                return self._reject(503, "stale", self.retry_after)
+        wait = self.check_rate(client)
+        if wait:
+            return self._reject(429, "rate", max(1, math.ceil(wait)))
+        if not self.acquire(cheap, block):
+            return self._reject(503, "busy", self.retry_after)
+        return None
+
+    def _reject(self, status, reason, retry_after):
+        self.rejected[reason] += 1
+        return status, reason, retry_after
+
+    def stats(self):
+        return {
+            "active": self.active,
+            "waiting": self.waiting[False] + self.waiting[True],
+            "clients": len(self._buckets),
+            "rejected": dict(self.rejected),
+        }
+
+
+REASONS = {429: "429 Too Many Requests", 503: "503 Service Unavailable"}
+
+
+def read_body(environ, limit=64 * 1024):
+    # The request body (up to `limit` bytes), leaving it readable for the app;
+    # None if larger or of unknown length (chunked), which stays unread for the app.
+    try:
+        length = int(environ.get("CONTENT_LENGTH") or -1)
+    except ValueError:
+        return None
+    if length < 0 or length > limit:
+        return None
+    if length == 0:
+        return b""
+    body = environ["wsgi.input"].read(length)
+    environ["wsgi.input"] = io.BytesIO(body)
+    return body
+
+
+class AdmissionMiddleware:
+    def __init__(self, app, controller, classify, reject_body):
+        # classify(environ) -> (client key, cheap), or None to let the request
+        # through unchecked; reject_body(status) -> bytes
+        self.app = app
+        self.controller = controller
+        self.classify = classify
+        self.reject_body = reject_body
+
+    def __call__(self, environ, start_response):
+        found = self.classify(environ)
+        if found is None:
+            return self.app(environ, start_response)
+        client, cheap = found
+        decision = self.controller.admit(client, cheap, environ.get("HTTP_X_REQUEST_START"))
+        if decision is not None:
+            status, _, retry_after = decision
+            body = self.reject_body(status)
+            start_response(REASONS[status], [
+                ("Content-Type", "application/json"), ("Content-Length", str(len(body))),
+                ("Retry-After", str(retry_after))])
+            return [body]
+        # the view has run by the time the app returns (streams return at once)
+        try:
+            return self.app(environ, start_response)
+        finally:
+            self.controller.release()
@@ -0,0 +1,454 @@
+# aserver.py
+
+# ======= asyncio serving mode =======
+# A small HTTP/1.1 server on one event loop, for when many parents sit on slow
+# or idle mobile connections: a waiting connection costs a few KB here instead
+# of a whole sync worker. It serves the same routes with the same KB, matcher,
+# caches and metrics as the Flask app (see "Request handling" in test.py).
+#
+#   python aserver.py --host 0.0.0.0 --port 8000
+#
+# GET /chat/stream turns its connection into a Server-Sent Events stream for the
+# rest of the visit (see channels.py).
+#
+# Requests on a connection are read and answered strictly one at a time, so
+# pipelined requests get their responses in order. Backpressure: the reader's
+# buffer is capped (the transport stops reading when it fills), every response
+# waits for drain() before the next request is read, and connections beyond
+# --max-connections are refused with 503.
+#
+# With TENANTS_DIR set, other schools are served under /t/<name>/ or by host as
+# in the Flask app (see tenants.py). A tenant's first request compiles it on a
+# worker thread before admission; everything else carries on meanwhile.
+#
+# Admission control (admission.py) applies per client as in the Flask app.
+# Handlers run one at a time on the loop and nothing is awaited while a slot is
+# held, so at most one slot is ever in use here. Slots are still taken without
+# waiting (block=False): a wait would stall the loop that has to release the
+# slot. --max-connections is the limit that matters.
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import time
+from urllib.parse import urlsplit
+
+from channels import HEARTBEAT, SSE_HEADERS, SSE_HEARTBEAT, ChannelHub
+from profiling import PROFILE_ID_HEADER
+from tenants import route
+
+# one event loop holds every open stream for next to nothing (see STREAMING in test.py)
+os.environ.setdefault("STREAMING", "1")
+
+from test import (ADMISSION, ADMISSION_CLIENT_HEADER, ADMISSION_EXEMPT, ASSETS, BUNDLE_HEADER, COMPACT,
+                  FORMAT_HEADER, METRICS, METRICS_EXPORTER, PROFILER, TENANT_DOMAIN, TENANTS,
+                  client_key, current_bundle, current_suggestions, find_tenant, handle_batch, handle_chat,
+                  handle_rank, handle_send, is_cheap, is_static, rejection_body, resident_tenant, to_json_bytes)
+
+log = logging.getLogger("aserver")
+
+MAX_HEADER_BYTES = 16 * 1024
+MAX_BODY_BYTES = 4 * 1024 * 1024
+# idle time allowed before a request's headers arrive (and between keep-alive requests)
+IDLE_TIMEOUT = 75.0
+
+REASONS = {
+    200: "OK", 202: "Accepted", 304: "Not Modified", 400: "Bad Request", 404: "Not Found",
+    405: "Method Not Allowed", 411: "Length Required", 413: "Payload Too Large",
+    429: "Too Many Requests",
+    431: "Request Header Fields Too Large", 500: "Internal Server Error",
+    501: "Not Implemented", 503: "Service Unavailable",
+}
+
+JSON = "application/json"
+
+
+class HTTPError(Exception):
+    def __init__(self, status):
+        super().__init__(status)
+        self.status = status
+
+
+_UNPARSED = object()
+
+
+class Request:
+    __slots__ = ("method", "path", "query", "version", "headers", "body", "client", "tenant",
+                 "_json", "parse_ns")
+
+    def __init__(self, method, target, version, headers, body):
+        url = urlsplit(target)
+        self.client = None
+        self.tenant = None
+        self.method = method
+        self.path = url.path
+        self.query = url.query
+        self.version = version
+        self.headers = headers
+        self.body = body
+        self._json = _UNPARSED
+        self.parse_ns = 0
+
+    def json(self):
+        # parsed once, whether admission (see dispatch) or the handler asks first
+        if self._json is _UNPARSED:
+            t0 = time.perf_counter_ns()
+            try:
+                self._json = json.loads(self.body) if self.body else {}
+            except ValueError:
+                raise HTTPError(400)
+            finally:
+                self.parse_ns = time.perf_counter_ns() - t0
+        return self._json
+
+    @property
+    def keep_alive(self):
+        conn = self.headers.get("connection", "").lower()
+        if self.version == "HTTP/1.0":
+            return conn == "keep-alive"
+        return conn != "close"
+
+
+async def read_request(reader):
+    try:
+        head = await reader.readuntil(b"\r\n\r\n")
+    except asyncio.LimitOverrunError:
+        raise HTTPError(431)
+    lines = head.decode("latin-1").split("\r\n")
+    try:
+        method, target, version = lines[0].split(" ", 2)
+    except ValueError:
+        raise HTTPError(400)
+    headers = {}
+    for line in lines[1:]:
+        if line:
+            name, _, value = line.partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+    if "chunked" in headers.get("transfer-encoding", "").lower():
+        raise HTTPError(501)
+    length = headers.get("content-length")
+    body = b""
+    if length is not None:
+        # digits only: int() would also take "-5", "+5", " 5" or "5_0"
+        if not (length.isascii() and length.isdigit()):
+            raise HTTPError(400)
+        length = int(length)
+        if length > MAX_BODY_BYTES:
+            raise HTTPError(413)
+        body = await reader.readexactly(length)
+    elif method == "POST":
+        raise HTTPError(411)
+    return Request(method, target, version, headers, body)
+
+
+# ======= Routes =======
+# handler(request) -> (status, [(header, value)], body, intent, stages)
+# body is bytes, or an async iterator of bytes for a stream that ends the connection
+
+# SSE streams live on this event loop, so asyncio queues are enough
+STREAMS = ChannelHub(asyncio.Queue)
+
+
+def tenant_of(req):
+    # dispatch() has compiled a cold tenant off the loop already (unless it was
+    # evicted again in between)
+    tenant = find_tenant(req.tenant)
+    if tenant is None:
+        raise HTTPError(404)
+    return tenant
+
+
+def route_index(req):
+    status, headers, body = tenant_of(req).index_page.negotiate(
+        req.headers.get("accept-encoding", ""), req.headers.get("if-none-match", ""))
+    return status, headers, body, None, ()
+
+
+def route_asset(req):
+    found = ASSETS.get(req.path.rsplit("/", 1)[1])
+    if found is None:
+        raise HTTPError(404)
+    status, headers, body = found.negotiate(
+        req.headers.get("accept-encoding", ""), req.headers.get("if-none-match", ""))
+    return status, headers, body, None, ()
+
+
+def is_compact(req):
+    return req.headers.get("x-chat-format") == COMPACT
+
+
+def route_chat(req):
+    data = req.json()
+    tenant = tenant_of(req)
+    compact = is_compact(req)
+    status, body, intent, stages = handle_chat(data, tenant, compact)
+    headers = [("Content-Type", JSON), (BUNDLE_HEADER, current_bundle(tenant)[0])]
+    if compact:
+        headers.append((FORMAT_HEADER, COMPACT))
+    return status, headers, body, intent, (("parse", req.parse_ns),) + stages
+
+
+def route_bundle(req):
+    status, headers, body = current_bundle(tenant_of(req))[1].negotiate(
+        req.headers.get("accept-encoding", ""), req.headers.get("if-none-match", ""))
+    return status, headers, body, None, ()
+
+
+def route_suggestions(req):
+    status, headers, body = current_suggestions(tenant_of(req))[1].negotiate(
+        req.headers.get("accept-encoding", ""), req.headers.get("if-none-match", ""))
+    return status, headers, body, None, ()
+
+
+def route_batch(req):
+    compact = is_compact(req)
+    status, body = handle_batch(req.json(), tenant_of(req), compact)
+    headers = [("Content-Type", JSON)]
+    if compact:
+        headers.append((FORMAT_HEADER, COMPACT))
+    return status, headers, body, None, ()
+
+
+def route_rank(req):
+    status, body = handle_rank(req.json(), tenant_of(req))
+    return status, [("Content-Type", JSON)], body, None, ()
+
+
+def route_stream(req):
+    channel = STREAMS.open()
+    if channel is None:
+        raise HTTPError(503)
+    return 200, list(SSE_HEADERS), stream_events(channel), None, ()
+
+
+async def stream_events(channel):
+    try:
+        while True:
+            try:
+                yield await asyncio.wait_for(channel.queue.get(), HEARTBEAT)
+            except asyncio.TimeoutError:
+                yield SSE_HEARTBEAT
+    finally:
+        STREAMS.close(channel.id)
+
+
+def route_send(req):
+    tenant = tenant_of(req)
+    status, body, intent = handle_send(req.json(), STREAMS, tenant)
+    return status, [("Content-Type", JSON), (BUNDLE_HEADER, current_bundle(tenant)[0])], body, intent, ()
+
+
+def route_metrics(req):
+    body = METRICS_EXPORTER.collect().encode()
+    return 200, [("Content-Type", "text/plain; version=0.0.4")], body, None, ()
+
+
+# (method, path) -> (route label for metrics, handler)
+ROUTES = {
+    ("GET", "/"): ("/", route_index),
+    ("POST", "/chat"): ("/chat", route_chat),
+    ("GET", "/chat/bundle"): ("/chat/bundle", route_bundle),
+    ("GET", "/chat/suggestions"): ("/chat/suggestions", route_suggestions),
+    ("POST", "/chat/batch"): ("/chat/batch", route_batch),
+    ("POST", "/chat/rank"): ("/chat/rank", route_rank),
+    ("GET", "/chat/stream"): ("/chat/stream", route_stream),
+    ("POST", "/chat/send"): ("/chat/send", route_send),
+    ("GET", "/metrics"): ("/metrics", route_metrics),
+}
+# prefix -> (route label, handler, methods)
+PREFIX_ROUTES = [
+    ("/assets/", "/assets/<name>", route_asset, ("GET",)),
+]
+
+
+def resolve(req):
+    method = "GET" if req.method == "HEAD" else req.method
+    found = ROUTES.get((method, req.path))
+    if found is not None:
+        return found
+    for prefix, label, handler, methods in PREFIX_ROUTES:
+        if req.path.startswith(prefix):
+            if method not in methods:
+                raise HTTPError(405)
+            return label, handler
+    if any(path == req.path for _, path in ROUTES):
+        raise HTTPError(405)
+    raise HTTPError(404)
+
+
+def error_body(status):
+    return to_json_bytes({"error": REASONS.get(status, "Error")})
+
+
+def encode_response(status, headers, body, keep_alive, head_only=False):
+    # body=None writes the head of a stream: no length, ends when the connection closes
+    out = ["HTTP/1.1 %d %s" % (status, REASONS.get(status, "Unknown"))]
+    out += ["%s: %s" % h for h in headers]
+    if status != 304 and body is not None:
+        out.append("Content-Length: %d" % len(body))
+    out.append("Connection: " + ("keep-alive" if keep_alive else "close"))
+    data = ("\r\n".join(out) + "\r\n\r\n").encode("latin-1")
+    if head_only or status == 304 or body is None:
+        return data
+    return data + body
+
+
+class ChatServer:
+    def __init__(self, max_connections=10000, idle_timeout=IDLE_TIMEOUT):
+        self.max_connections = max_connections
+        self.idle_timeout = idle_timeout
+        self.active = 0
+
+    async def dispatch(self, req):
+        started = time.perf_counter_ns()
+        label = "unmatched"
+        intent, stages = None, ()
+        try:
+            if TENANTS is not None:
+                req.tenant, _, req.path = route(req.headers.get("host"), req.path, TENANT_DOMAIN)
+            label, handler = resolve(req)
+            if req.tenant is not None and TENANTS.peek(req.tenant) is None:
+                # compile a cold tenant on a thread: the loop keeps serving the rest
+                await asyncio.get_running_loop().run_in_executor(None, TENANTS.get, req.tenant)
+            if req.path in ADMISSION_EXEMPT:
+                status, headers, body, intent, stages = handler(req)
+            else:
+                forwarded = req.headers.get(ADMISSION_CLIENT_HEADER) if ADMISSION_CLIENT_HEADER else None
+                client = None if is_static(req.method, req.path) else client_key(forwarded, req.client)
+                # a /chat reply already cached is cheap, as in the WSGI middleware
+                data = None
+                if req.method == "POST" and req.path == "/chat":
+                    try:
+                        data = req.json()
+                    except HTTPError:
+                        pass  # the handler answers 400 once admitted
+                decision = ADMISSION.admit(client,
+                                           is_cheap(req.method, req.path, data, resident_tenant(req.tenant),
+                                                    is_compact(req)),
+                                           req.headers.get("x-request-start"), block=False)
+                if decision is not None:
+                    status, _, retry_after = decision
+                    headers = [("Content-Type", JSON), ("Retry-After", str(retry_after))]
+                    body = rejection_body(status)
+                else:
+                    try:
+                        if PROFILER.wanted(req.headers.get("x-profile")):
+                            found, name = PROFILER.run(req.method, req.path, handler, req)
+                            status, headers, body, intent, stages = found
+                            if name:
+                                headers = list(headers) + [(PROFILE_ID_HEADER, name)]
+                        else:
+                            status, headers, body, intent, stages = handler(req)
+                    finally:
+                        ADMISSION.release()
+        except HTTPError as exc:
+            status, headers, body = exc.status, [("Content-Type", JSON)], error_body(exc.status)
+        except Exception:
+            log.exception("error handling %s %s", req.method, req.path)
+            status, headers, body = 500, [("Content-Type", JSON)], error_body(500)
+        METRICS.record_request(label, status, time.perf_counter_ns() - started, intent, stages)
+        return status, headers, body
+
+    async def handle_connection(self, reader, writer):
+        if self.active >= self.max_connections:
+            writer.write(encode_response(503, [("Retry-After", "1")], error_body(503), False))
+            await self._close(writer)
+            return
+        self.active += 1
+        peer = (writer.get_extra_info("peername") or (None,))[0]
+        try:
+            while True:
+                try:
+                    req = await asyncio.wait_for(read_request(reader), self.idle_timeout)
+                except HTTPError as exc:
+                    writer.write(encode_response(
+                        exc.status, [("Content-Type", JSON)], error_body(exc.status), False))
+                    await writer.drain()
+                    break
+                except (asyncio.IncompleteReadError, asyncio.TimeoutError, ConnectionError):
+                    break
+                req.client = peer
+                status, headers, body = await self.dispatch(req)
+                if not isinstance(body, bytes):
+                    await self._stream(reader, writer, status, headers, body)
+                    break
+                keep_alive = req.keep_alive
+                writer.write(encode_response(status, headers, body, keep_alive,
+                                             head_only=req.method == "HEAD"))
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except ConnectionError:
+            pass
+        finally:
+            self.active -= 1
+            await self._close(writer)
+
+    @staticmethod
+    async def _stream(reader, writer, status, headers, chunks):
+        # An SSE client sends nothing after its request, so a finished read means
+        # it hung up: stop right away instead of at the next heartbeat write.
+        hangup = asyncio.ensure_future(reader.read(1))
+        pending = None
+        try:
+            writer.write(encode_response(status, headers, None, False))
+            await writer.drain()
+            while True:
+                pending = asyncio.ensure_future(chunks.__anext__())
+                await asyncio.wait({pending, hangup}, return_when=asyncio.FIRST_COMPLETED)
+                if not pending.done():
+                    break
+                try:
+                    chunk = pending.result()
+                except StopAsyncIteration:
+                    break
+                pending = None
+                writer.write(chunk)
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            hangup.cancel()
+            if pending is not None and not pending.done():
+                pending.cancel()
+                await asyncio.gather(pending, return_exceptions=True)
+            await chunks.aclose()
+
+    @staticmethod
+    async def _close(writer):
+        writer.close()
+        try:
+            await writer.wait_closed()
+        except ConnectionError:
+            pass
+
+    async def serve(self, host, port, backlog=2048):
+        server = await asyncio.start_server(
+            self.handle_connection, host, port, limit=MAX_HEADER_BYTES, backlog=backlog)
+        log.info("serving on %s", ", ".join(str(s.getsockname()) for s in server.sockets))
+        async with server:
+            await server.serve_forever()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve the chatbot on an asyncio event loop.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--max-connections", type=int, default=10000)
+    parser.add_argument("--idle-timeout", type=float, default=IDLE_TIMEOUT)
+    parser.add_argument("--backlog", type=int, default=2048)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(name)s %(message)s")
+    server = ChatServer(args.max_connections, args.idle_timeout)
+    try:
+        asyncio.run(server.serve(args.host, args.port, args.backlog))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
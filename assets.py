@@ -0,0 +1,96 @@
+# assets.py
+
+# ======= Pre-rendered, pre-compressed static responses =======
+# Bodies are compressed once when the asset is built; a request only picks the
+# best encoding the client accepts and compares ETags.
+
+import gzip
+import hashlib
+
+try:
+    import brotli
+except ImportError:  # optional: gzip only without it
+    brotli = None
+
+# our order of preference among the encodings a client accepts; q-values only
+# decide whether an encoding is accepted at all, not which one wins
+ENCODINGS = ("br", "gzip")
+
+# long-lived, for fingerprinted URLs whose content never changes
+IMMUTABLE = "public, max-age=31536000, immutable"
+# always revalidate (cheap 304 when unchanged)
+REVALIDATE = "no-cache"
+
+
+def parse_accept_encoding(header: str):
+    # "gzip, br;q=0.8, *;q=0" -> {"gzip", "br"}
+    accepted = set()
+    for part in (header or "").split(","):
+        name, _, params = part.strip().partition(";")
+        name = name.strip().lower()
+        if not name:
+            continue
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        if q > 0:
+            accepted.add(name)
+    return accepted
+
+
+def etag_matches(if_none_match: str, etag: str):
+    if not if_none_match:
+        return False
+    for tag in if_none_match.split(","):
+        tag = tag.strip()
+        if tag == "*":
+            return True
+        if tag.startswith("W/"):
+            tag = tag[2:]
+        if tag == etag:
+            return True
+    return False
+
+
+class StaticAsset:
+    def __init__(self, body: bytes, content_type: str, cache_control=REVALIDATE, compress=True):
+        self.content_type = content_type
+        self.cache_control = cache_control
+        digest = hashlib.sha256(body).hexdigest()
+        self.fingerprint = digest[:12]
+
+        # encoding -> (body, strong etag); identity is keyed by None
+        self.variants = {None: (body, '"%s"' % digest[:20])}
+        if compress:
+            self.variants["gzip"] = (gzip.compress(body, 9, mtime=0), '"%s-gz"' % digest[:20])
+            if brotli is not None:
+                self.variants["br"] = (brotli.compress(body), '"%s-br"' % digest[:20])
+
+    def negotiate(self, accept_encoding="", if_none_match=""):
+        # -> (status, headers, body) for a GET of this asset
+        encoding = None
+        if len(self.variants) > 1:
+            accepted = parse_accept_encoding(accept_encoding)
+            for enc in ENCODINGS:
+                if enc in self.variants and (enc in accepted or "*" in accepted):
+                    encoding = enc
+                    break
+        body, etag = self.variants[encoding]
+
+        headers = [
+            ("ETag", etag),
+            ("Cache-Control", self.cache_control),
+        ]
+        if len(self.variants) > 1:
+            headers.append(("Vary", "Accept-Encoding"))
+        if etag_matches(if_none_match, etag):
+            return 304, headers, b""
+
+        headers.append(("Content-Type", self.content_type))
+        if encoding:
+            headers.append(("Content-Encoding", encoding))
+        return 200, headers, body
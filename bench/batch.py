@@ -0,0 +1,37 @@
+# bench/batch.py
+#
+# Messages/sec through /chat (one request per message) vs /chat/batch.
+# Run from the repo root:  python -m bench.batch
+
+import os
+import time
+
+# one client far above any rate limit: measure the handlers, not admission
+os.environ["ADMISSION_RATE"] = "0"
+
+from bench.matcher import MESSAGES
+from test import app, QUICK_SUGGESTIONS
+
+N = 5000
+
+
+def main():
+    client = app.test_client()
+    messages = [MESSAGES[i % len(MESSAGES)] for i in range(N)]
+    messages += [s.lower() for s in QUICK_SUGGESTIONS]
+
+    start = time.perf_counter()
+    for m in messages:
+        client.post("/chat", json={"message": m})
+    single = len(messages) / (time.perf_counter() - start)
+
+    start = time.perf_counter()
+    client.post("/chat/batch", json={"messages": messages})
+    batch = len(messages) / (time.perf_counter() - start)
+
+    print("/chat        %10.0f msg/s" % single)
+    print("/chat/batch  %10.0f msg/s  (%.0fx)" % (batch, batch / single))
+
+
+if __name__ == "__main__":
+    main()
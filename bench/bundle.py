@@ -0,0 +1,97 @@
+# bench/bundle.py
+#
+# How much /chat traffic the page's intent bundle answers without a round
+# trip, and whether every local answer is the one the server would have sent.
+# answer_locally() is a line-by-line port of answerLocally() in INDEX_HTML.
+#
+#   python -m bench.bundle
+#   python -m bench.bundle --messages 20000 --chips 50
+
+import argparse
+import gzip
+import json
+import random
+import re
+
+from bench.corpus import QUICK, corpus
+from test import DYNAMIC_REPLIES, PENDING_FOLLOW_UPS, current_bundle, detect_intent, normalize_message, reply_for
+
+ASCII = re.compile(r"[ -~]*")
+WORD = re.compile(r"[A-Za-z0-9_]+")
+
+
+def is_answer(bundle, norm):
+    return norm in bundle["answer_words"] or re.fullmatch(bundle["answer_pattern"], norm) is not None
+
+
+def answer_locally(bundle, text, last_intent=None):
+    if bundle is None or not ASCII.fullmatch(text):
+        return None
+    norm = " ".join(WORD.findall(text.lower()))
+    if last_intent in bundle["follow_ups"] and is_answer(bundle, norm):
+        return None
+    if re.search(bundle["slot_pattern"], norm):
+        return None
+    hits = [i for i, kw in enumerate(bundle["keywords"]) if kw in norm]
+    if not hits:
+        return None
+    best = max(hits, key=lambda i: (len(bundle["keywords"][i]), -i))
+    top = bundle["keywords"][best]
+    if any(bundle["intent_of"][i] != bundle["intent_of"][best] and bundle["keywords"][i] not in top
+           for i in hits):
+        return None
+    intent = bundle["intents"][bundle["intent_of"][best]]
+    replies = bundle["replies"].get(intent)
+    return (intent, replies) if replies else None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="share of /chat answered by the client-side bundle")
+    parser.add_argument("--messages", type=int, default=20000)
+    parser.add_argument("--chips", type=float, default=50, help="%% of messages that are chip clicks")
+    args = parser.parse_args(argv)
+
+    version, asset = current_bundle()
+    body = asset.variants[None][0]
+    bundle = json.loads(body)
+    print("bundle %s: %d keywords, %d static intents, %d bytes (%d gzipped)" % (
+        version, len(bundle["keywords"]), len(bundle["replies"]), len(body), len(gzip.compress(body))))
+
+    rnd = random.Random(5)
+    typed = corpus(args.messages)
+    messages = [rnd.choice(QUICK) if rnd.random() * 100 < args.chips else typed[i]
+                for i in range(args.messages)]
+    local = wrong = 0
+    reasons = {"no keyword": 0, "several intents": 0, "dynamic reply": 0, "non-ASCII": 0, "follow-up": 0,
+               "class or route": 0}
+    last_intent = None
+    for text in messages:
+        found = answer_locally(bundle, text, last_intent)
+        if found is not None:
+            local += 1
+            intent, replies = found
+            if (intent, replies, PENDING_FOLLOW_UPS.get(intent)) != reply_for(detect_intent(text), normalize_message(text)):
+                wrong += 1
+        else:
+            intent = detect_intent(text)
+            norm = " ".join(WORD.findall(text.lower()))
+            if not ASCII.fullmatch(text):
+                reasons["non-ASCII"] += 1
+            elif last_intent in bundle["follow_ups"] and is_answer(bundle, norm):
+                reasons["follow-up"] += 1
+            elif re.search(bundle["slot_pattern"], norm):
+                reasons["class or route"] += 1
+            else:
+                hits = [kw for kw in bundle["keywords"] if kw in norm]
+                key = "no keyword" if not hits else "dynamic reply" if intent in DYNAMIC_REPLIES else "several intents"
+                reasons[key] += 1
+        last_intent = intent
+
+    n = len(messages)
+    print("answered in the page: %d of %d (%.1f%%), differing from /chat: %d" % (local, n, 100.0 * local / n, wrong))
+    for reason, count in reasons.items():
+        print("  to /chat, %-16s %6d (%.1f%%)" % (reason + ":", count, 100.0 * count / n))
+
+
+if __name__ == "__main__":
+    main()
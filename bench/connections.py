@@ -0,0 +1,122 @@
+# bench/connections.py
+#
+# How many idle / slow connections one deployment can hold while still answering
+# a fresh /chat request quickly. Each step opens N connections that send half a
+# request header and then stall (a parent on a school-gate 3G link), then times a
+# probe request. A step fails when the probe takes longer than --probe-timeout.
+#
+#   python -m bench.connections                      (gunicorn sync vs asyncio)
+#   python -m bench.connections --modes asyncio --steps 100 1000 5000
+#
+# Opening thousands of sockets needs a high enough `ulimit -n`.
+
+import argparse
+import os
+import socket
+import subprocess
+import sys
+import time
+
+import requests
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+MODES = {
+    "gunicorn-sync": lambda port, workers: [
+        sys.executable, "-m", "gunicorn", "-w", str(workers), "-k", "sync",
+        "-b", "127.0.0.1:%d" % port, "test:app"],
+    "gunicorn-gthread": lambda port, workers: [
+        sys.executable, "-m", "gunicorn", "-w", str(workers), "-k", "gthread", "--threads", "8",
+        "-b", "127.0.0.1:%d" % port, "test:app"],
+    "asyncio": lambda port, workers: [
+        sys.executable, "aserver.py", "--port", str(port)],
+}
+
+PARTIAL = b"POST /chat HTTP/1.1\r\nHost: localhost\r\n"
+
+
+def wait_ready(url, timeout=15):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            requests.get(url, timeout=0.5)
+            return
+        except requests.RequestException:
+            time.sleep(0.1)
+    raise RuntimeError("server at %s did not start" % url)
+
+
+def tree_rss_kb(pid):
+    # resident memory of a process and its children, from /proc (Linux only)
+    total = 0
+    pids = [pid]
+    while pids:
+        p = pids.pop()
+        try:
+            with open("/proc/%d/status" % p) as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        total += int(line.split()[1])
+            with open("/proc/%d/task/%d/children" % (p, p)) as f:
+                pids += [int(c) for c in f.read().split()]
+        except OSError:
+            continue
+    return total
+
+
+def probe(port, timeout):
+    start = time.perf_counter()
+    try:
+        r = requests.post("http://127.0.0.1:%d/chat" % port, json={"message": "fees"},
+                          timeout=timeout)
+        ok = r.status_code == 200
+    except requests.RequestException:
+        ok = False
+    return ok, (time.perf_counter() - start) * 1000
+
+
+def run_mode(mode, port, workers, steps, probe_timeout):
+    proc = subprocess.Popen(MODES[mode](port, workers), cwd=ROOT,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    rows = []
+    held = []
+    try:
+        wait_ready("http://127.0.0.1:%d/" % port)
+        for n in steps:
+            while len(held) < n:
+                try:
+                    s = socket.create_connection(("127.0.0.1", port), timeout=2)
+                    s.sendall(PARTIAL)
+                    held.append(s)
+                except OSError:
+                    break
+            time.sleep(0.5)
+            ok, ms = probe(port, probe_timeout)
+            rows.append((mode, len(held), ok, ms, tree_rss_kb(proc.pid) // 1024))
+            print("%-18s %8d %6s %10.1f %8d" % rows[-1])
+            if not ok:
+                break
+    finally:
+        for s in held:
+            s.close()
+        proc.terminate()
+        proc.wait()
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="idle/slow connection capacity per serving mode")
+    parser.add_argument("--modes", nargs="+", default=["gunicorn-sync", "asyncio"], choices=list(MODES))
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--steps", nargs="+", type=int, default=[2, 8, 50, 200, 800])
+    parser.add_argument("--probe-timeout", type=float, default=2.0)
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args(argv)
+
+    print("%-18s %8s %6s %10s %8s" % ("mode", "held", "ok", "probe ms", "RSS MB"))
+    for i, mode in enumerate(args.modes):
+        run_mode(mode, args.port + i, args.workers, args.steps, args.probe_timeout)
+
+
+if __name__ == "__main__":
+    main()
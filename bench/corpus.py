@@ -0,0 +1,73 @@
+# bench/corpus.py
+#
+# Deterministic synthetic parent messages for benchmarks, weighted roughly like
+# admission-week traffic: mostly chips and short questions, some typos, some
+# Hinglish, a few long pasted paragraphs.
+
+import random
+
+GREETINGS = ["hi", "hello", "Hey!", "good morning", "Good evening sir", "hello ma'am"]
+
+QUICK = [
+    "Timings", "Fees", "Discounts", "Admission process", "Exam schedule",
+    "Attendance policy", "Extracurriculars", "Payment modes", "Contact staff", "Facilities",
+]
+
+QUESTIONS = [
+    "what are the fees for class 5?",
+    "Is there any sibling discount",
+    "how can I pay the fees online",
+    "where can i see payment history",
+    "what time does school close",
+    "when are the midterm exams",
+    "is there a bus facility for my area",
+    "do you follow cbse board",
+    "how many teachers are there",
+    "what are the admission requirements for grade 1",
+    "is the bus fee included",
+    "which sports do you offer",
+]
+
+TYPOS = [
+    "fess", "addmission", "timmings", "scolarship", "recipts", "libary",
+    "wat are the fess", "exm scedule", "tranport charges", "sibbling discont",
+]
+
+HINGLISH = [
+    "fees kitni hai", "admission kab shuru hoga", "bus ki facility hai kya",
+    "school ka time kya hai", "exam kab se hai beta ka", "mujhe fees ka breakup chahiye",
+]
+
+UNKNOWN = ["ok", "thanks", "what is the weather today", "my name is rahul", "???"]
+
+FILLER = (
+    "I am writing because my daughter is moving from another city and we are not sure "
+    "about the process and also we wanted to understand many things like"
+).split()
+
+
+def rambling(rnd):
+    # a long pasted paragraph with one or two real questions buried in it
+    words = [rnd.choice(FILLER) for _ in range(rnd.randint(40, 120))]
+    for q in rnd.sample(QUESTIONS, 2):
+        words.insert(rnd.randrange(len(words)), q)
+    return " ".join(words)
+
+
+# (weight, generator)
+MIX = [
+    (30, lambda rnd: rnd.choice(QUICK)),
+    (25, lambda rnd: rnd.choice(QUESTIONS)),
+    (10, lambda rnd: rnd.choice(GREETINGS)),
+    (10, lambda rnd: rnd.choice(TYPOS)),
+    (10, lambda rnd: rnd.choice(HINGLISH)),
+    (10, lambda rnd: rnd.choice(UNKNOWN)),
+    (5, rambling),
+]
+
+
+def corpus(n=2000, seed=2024):
+    rnd = random.Random(seed)
+    weights = [w for w, _ in MIX]
+    makers = [m for _, m in MIX]
+    return [rnd.choices(makers, weights)[0](rnd) for _ in range(n)]
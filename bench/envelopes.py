@@ -0,0 +1,94 @@
+# bench/envelopes.py
+#
+# /chat bodies from the prebuilt per-intent envelopes against building and
+# serializing the payload on every request, and the size of the full and
+# compact formats. Every full body is checked against the rebuilt one.
+#
+#   python -m bench.envelopes
+#   python -m bench.envelopes --messages 5000 --chips 50
+
+import argparse
+import os
+import random
+import time
+
+os.environ.setdefault("ADMISSION_RATE", "0")
+
+from bench.corpus import QUICK, corpus
+from test import (DEFAULT_TENANT, FACTS, KB_STORE, RESPONSE_CACHE, current_envelopes, handle_chat,
+                  normalize_message, reply_for, to_json_bytes)
+
+
+def rebuilt(norm):
+    # the body as /chat built it before envelopes
+    kb = KB_STORE.current
+    intent, replies, _ = reply_for(kb.detect(norm), norm, kb)
+    return to_json_bytes({"intent": intent, "replies": replies, "suggest": DEFAULT_TENANT.quick})
+
+
+def prebuilt(norm):
+    # the same with envelopes: a lookup unless a fact row or the greeting answers
+    kb = KB_STORE.current
+    intent = kb.detect(norm)
+    envelope = current_envelopes().get(intent)
+    if envelope is not None and FACTS.current.answer(intent, norm) is None:
+        return envelope[0]
+    intent, replies, _ = reply_for(intent, norm, kb)
+    return to_json_bytes({"intent": intent, "replies": replies, "suggest": DEFAULT_TENANT.quick})
+
+
+def time_each(fn, items, before=None):
+    clock = time.perf_counter_ns
+    samples = []
+    for item in items:
+        if before is not None:
+            before()
+        t0 = clock()
+        fn(item)
+        samples.append(clock() - t0)
+    samples.sort()
+    pick = lambda q: samples[min(len(samples) - 1, int(q * len(samples)))] / 1000
+    return pick(0.5), pick(0.99)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="prebuilt /chat envelopes and the compact format")
+    parser.add_argument("--messages", type=int, default=5000)
+    parser.add_argument("--chips", type=float, default=50, help="%% of messages that are chip clicks")
+    args = parser.parse_args(argv)
+
+    rnd = random.Random(5)
+    typed = corpus(args.messages)
+    messages = [rnd.choice(QUICK) if rnd.random() * 100 < args.chips else typed[i]
+                for i in range(args.messages)]
+    norms = [normalize_message(m) for m in messages]
+
+    full = lambda m: handle_chat({"message": m})[1]
+    compact = lambda m: handle_chat({"message": m}, compact=True)[1]
+    mismatches = 0
+    full_bytes = compact_bytes = 0
+    for m, norm in zip(messages, norms):
+        RESPONSE_CACHE.clear()
+        body = full(m)
+        mismatches += body != rebuilt(norm)
+        full_bytes += len(body)
+        RESPONSE_CACHE.clear()
+        compact_bytes += len(compact(m))
+    n = len(messages)
+    print("%d messages (%.0f%% chips), full bodies differing from rebuilt ones: %d" % (n, args.chips, mismatches))
+    print("mean body: full %.0f bytes, compact %.0f bytes (%+.0f%%)" % (
+        full_bytes / n, compact_bytes / n, 100.0 * (compact_bytes - full_bytes) / full_bytes))
+
+    rows = [
+        ("detect, build, serialize", rebuilt, norms, None),
+        ("detect, envelope", prebuilt, norms, None),
+        ("uncached /chat, full", full, messages, RESPONSE_CACHE.clear),
+        ("uncached /chat, compact", compact, messages, RESPONSE_CACHE.clear),
+    ]
+    print("%-26s %8s %8s  (µs, handle_chat for /chat)" % ("", "p50", "p99"))
+    for label, fn, items, before in rows:
+        print("%-26s %8.2f %8.2f" % ((label,) + time_each(fn, items, before)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+# bench/facts.py
+#
+# Time to answer a question from a fact table (slot extraction + row lookup),
+# with tables of --rows rows each, for messages that name a class or route
+# and for ones that don't (which only pay for the slot search).
+#
+#   python -m bench.facts
+#   python -m bench.facts --rows 50000
+
+import argparse
+import os
+import tempfile
+import time
+
+from facts import load_facts
+from kb import normalize_message
+from test import FACT_TABLES
+
+MESSAGES = [
+    ("exam_schedule", "exam dates for class 9"),
+    ("fees", "what are the fees for 10th class"),
+    ("fees", "fee for class xi"),
+    ("timings", "bus timing for route 120"),
+    ("transport", "route no 7 pickup"),
+    ("fees", "fees for class 99"),
+]
+PLAIN = [
+    ("fees", "what are the fees"),
+    ("default", "can you tell me the fee structure and whether transport is included"),
+]
+
+
+def write_tables(directory, rows):
+    with open(os.path.join(directory, "exam_dates.csv"), "w") as f:
+        f.write("class,term1,term2\n")
+        f.writelines("%d,Oct %d,Feb %d\n" % (i, i % 28 + 1, i % 27 + 1) for i in range(1, rows + 1))
+    with open(os.path.join(directory, "fees.csv"), "w") as f:
+        f.write("grade,tuition,activity\n")
+        f.writelines('%d,"%d","%d"\n' % (i, 50000 + i, 200 + i % 50) for i in range(1, rows + 1))
+    with open(os.path.join(directory, "bus_routes.csv"), "w") as f:
+        f.write("route,area,pickup,drop\n")
+        f.writelines("%d,Sector %d,7:%02d AM,2:%02d PM\n" % (i, i, i % 60, i % 60) for i in range(1, rows + 1))
+
+
+def time_answers(book, messages, rounds):
+    norms = [(intent, normalize_message(m)) for intent, m in messages]
+    samples = []
+    clock = time.perf_counter_ns
+    for _ in range(rounds):
+        for intent, norm in norms:
+            t0 = clock()
+            book.answer(intent, norm)
+            samples.append(clock() - t0)
+    samples.sort()
+    pick = lambda q: samples[min(len(samples) - 1, int(q * len(samples)))] / 1000
+    return pick(0.5), pick(0.99)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="fact table answer latency")
+    parser.add_argument("--rows", type=int, default=5000, help="rows per table")
+    parser.add_argument("--rounds", type=int, default=20000)
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        write_tables(tmp, args.rows)
+        t0 = time.perf_counter()
+        book = load_facts(tmp, FACT_TABLES)
+        load_ms = (time.perf_counter() - t0) * 1000
+    print("%d rows per table, %d tables loaded in %.1f ms" % (args.rows, len(book.tables), load_ms))
+    for intent, message in MESSAGES + PLAIN:
+        found = book.answer(intent, normalize_message(message))
+        print("  %-40s -> %s" % (message, found[1][:60] if found else None))
+    print("%-14s %8s %8s  (µs)" % ("", "p50", "p99"))
+    print("%-14s %8.2f %8.2f" % (("with a slot",) + time_answers(book, MESSAGES, args.rounds)))
+    print("%-14s %8.2f %8.2f" % (("no slot",) + time_answers(book, PLAIN, args.rounds)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+# bench/fuzzy.py
+#
+# Added latency of the typo fallback in detect_intent (p50 / p99 per message).
+# Run from the repo root:  python -m bench.fuzzy
+
+import time
+
+from kb import compile_kb_file
+from test import KB_PATH, DYNAMIC_REPLIES, normalize_message
+
+TYPOS = [
+    "fess", "addmission", "timmings", "scolarship", "recipts", "libary",
+    "what are the fess for clas 5", "sibbling discont", "tranport charges",
+    "exm scedule", "principle name", "adimssion form",
+]
+CLEAN = ["fees", "admission process", "hi", "exam schedule", "no idea at all"]
+
+
+def percentiles(samples):
+    samples = sorted(samples)
+    pick = lambda q: samples[min(len(samples) - 1, int(q * len(samples)))]
+    return pick(0.50), pick(0.99)
+
+
+def run(kb, messages, rounds=2000, cold=False):
+    # cold: forget memoized corrections before every message
+    norms = [normalize_message(m) for m in messages]
+    samples = []
+    clock = time.perf_counter_ns
+    memo = kb.fuzzy._memo if kb.fuzzy else {}
+    for _ in range(rounds):
+        for n in norms:
+            if cold:
+                memo.clear()
+            t0 = clock()
+            kb.detect(n)
+            samples.append(clock() - t0)
+    return [s / 1000 for s in percentiles(samples)]
+
+
+def main():
+    for distance in (0, 1, 2):
+        t0 = time.perf_counter()
+        kb = compile_kb_file(KB_PATH, DYNAMIC_REPLIES, max_edit_distance=distance)
+        build_ms = (time.perf_counter() - t0) * 1e3
+        size = len(kb.fuzzy) if kb.fuzzy else 0
+        cold = run(kb, TYPOS, cold=True)
+        warm = run(kb, TYPOS)
+        clean = run(kb, CLEAN)
+        print("max_distance=%d  index=%5d keys  build=%5.1f ms  p50/p99 us:  "
+              "typos cold %5.1f/%5.1f  warm %4.1f/%4.1f  clean %4.1f/%4.1f"
+              % (distance, size, build_ms, cold[0], cold[1], warm[0], warm[1],
+                 clean[0], clean[1]))
+
+
+if __name__ == "__main__":
+    main()
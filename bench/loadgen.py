@@ -0,0 +1,203 @@
+# bench/loadgen.py
+#
+# Capacity planning: start the app under gunicorn, replay a weighted mix of page
+# loads, quick-suggestion chips and typed /chat questions at fixed open-loop
+# arrival rates, and sweep the worker class and worker count.
+#
+#   python -m bench.loadgen
+#   python -m bench.loadgen --classes sync gthread --workers 1 2 4 --threads 8 \
+#       --rates 200 400 800 --duration 10 --json sweep.json
+#
+# Arrivals are a Poisson process and never wait for earlier answers (parents
+# don't), but at most --concurrency requests are in flight, like the connection
+# limit of a proxy; latency is measured from each request's scheduled time, so
+# time spent waiting for a free connection counts. Each request uses a fresh
+# connection. Admission control is off unless --admission, so the numbers are the
+# server's own capacity rather than the limiter's.
+#
+# "capacity" is the highest rate a configuration served with under 1% errors
+# and p99 within --slo ms. Client and server share the machine: on a small box
+# the client's own CPU use lowers every number, so compare configurations, and
+# measure absolute capacity from another host.
+
+import argparse
+import asyncio
+import importlib.util
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+
+from bench.connections import ROOT, wait_ready
+from bench.corpus import QUICK, corpus
+
+# name -> (weight, request builder(rnd, messages) -> bytes)
+TRAFFIC = {
+    "page": (10, lambda rnd, messages: (
+        b"GET / HTTP/1.1\r\nHost: localhost\r\nAccept-Encoding: gzip\r\nConnection: close\r\n\r\n")),
+    "chip": (50, lambda rnd, messages: chat_request(rnd.choice(QUICK))),
+    "chat": (40, lambda rnd, messages: chat_request(rnd.choice(messages))),
+}
+
+# worker class -> module gunicorn needs for it
+WORKER_CLASSES = {"sync": None, "gthread": None, "gevent": "gevent", "eventlet": "eventlet"}
+
+
+def chat_request(message):
+    body = json.dumps({"message": message}).encode()
+    return (b"POST /chat HTTP/1.1\r\nHost: localhost\r\nContent-Type: application/json\r\n"
+            b"Content-Length: %d\r\nConnection: close\r\n\r\n%s" % (len(body), body))
+
+
+def parse_mix(text):
+    # "page=10,chip=50,chat=40" -> {name: weight}
+    mix = {}
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        if name not in TRAFFIC:
+            raise argparse.ArgumentTypeError("unknown traffic %r (one of %s)" % (name, ", ".join(TRAFFIC)))
+        mix[name] = float(weight)
+    return mix
+
+
+async def one(port, payload, scheduled, slots, results, timeout):
+    async with slots:
+        try:
+            reader, writer = await asyncio.wait_for(asyncio.open_connection("127.0.0.1", port), timeout)
+            writer.write(payload)
+            status_line = await asyncio.wait_for(reader.readline(), timeout)
+            await asyncio.wait_for(reader.read(), timeout)
+            writer.close()
+            status = int(status_line.split()[1])
+        except (OSError, asyncio.TimeoutError, ValueError, IndexError):
+            status = 0
+    results.append((status, time.perf_counter() - scheduled))
+
+
+async def drive(port, rate, duration, mix, concurrency, timeout, seed=11):
+    rnd = random.Random(seed)
+    messages = corpus()
+    names = list(mix)
+    weights = [mix[n] for n in names]
+    slots = asyncio.Semaphore(concurrency)
+    results = []
+    tasks = []
+    start = time.perf_counter()
+    t = 0.0
+    while t < duration:
+        t += rnd.expovariate(rate)
+        delay = start + t - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        payload = TRAFFIC[rnd.choices(names, weights)[0]][1](rnd, messages)
+        tasks.append(asyncio.ensure_future(one(port, payload, start + t, slots, results, timeout)))
+    await asyncio.gather(*tasks)
+    return results
+
+
+def summarize(results, duration):
+    latencies = sorted(lat for status, lat in results if status == 200)
+    pct = lambda q: latencies[min(len(latencies) - 1, int(q * len(latencies)))] * 1000 if latencies else float("nan")
+    errors = sum(1 for status, _ in results if status != 200)
+    return {
+        "sent": len(results),
+        "ok_per_s": len(latencies) / duration,
+        "error_pct": 100.0 * errors / max(1, len(results)),
+        "p50_ms": pct(0.50),
+        "p90_ms": pct(0.90),
+        "p99_ms": pct(0.99),
+        "max_ms": latencies[-1] * 1000 if latencies else float("nan"),
+    }
+
+
+def gunicorn_cmd(worker_class, workers, threads, port, preload):
+    cmd = [sys.executable, "-m", "gunicorn", "-k", worker_class, "-w", str(workers),
+           "--backlog", "4096", "-b", "127.0.0.1:%d" % port]
+    if worker_class == "gthread":
+        cmd += ["--threads", str(threads)]
+    elif worker_class in ("gevent", "eventlet"):
+        cmd += ["--worker-connections", "1000"]
+    return cmd + (["--preload", "test:create_app()"] if preload else ["test:app"])
+
+
+def run_config(worker_class, workers, args, port):
+    env = dict(os.environ, KB_RELOAD_INTERVAL="0")
+    if not args.admission:
+        env.update(ADMISSION_RATE="0", ADMISSION_MAX_CONCURRENT="0")
+    proc = subprocess.Popen(gunicorn_cmd(worker_class, workers, args.threads, port, args.preload),
+                            cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    rows = []
+    try:
+        wait_ready("http://127.0.0.1:%d/" % port)
+        # fill every worker's caches before measuring
+        asyncio.run(drive(port, min(args.rates), args.warmup, args.mix, args.concurrency, args.timeout))
+        for rate in args.rates:
+            results = asyncio.run(drive(port, rate, args.duration, args.mix, args.concurrency, args.timeout))
+            row = dict(worker_class=worker_class, workers=workers,
+                       threads=args.threads if worker_class == "gthread" else 1,
+                       rate=rate, **summarize(results, args.duration))
+            rows.append(row)
+            print("%-8s %7d %7d %7.0f %8.0f %6.2f %8.1f %8.1f %8.1f %8.1f" % (
+                worker_class, workers, row["threads"], rate, row["ok_per_s"], row["error_pct"],
+                row["p50_ms"], row["p90_ms"], row["p99_ms"], row["max_ms"]), flush=True)
+            time.sleep(1.0)  # let any backlog drain before the next step
+    finally:
+        proc.terminate()
+        proc.wait()
+    return rows
+
+
+def capacity(rows, slo_ms):
+    ok = [r["rate"] for r in rows if r["error_pct"] < 1 and r["p99_ms"] <= slo_ms]
+    return max(ok) if ok else 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="open-loop load test and gunicorn configuration sweep")
+    parser.add_argument("--classes", nargs="+", default=["sync", "gthread"], choices=list(WORKER_CLASSES))
+    parser.add_argument("--workers", nargs="+", type=int, default=[1, 2, 4])
+    parser.add_argument("--threads", type=int, default=8, help="per gthread worker")
+    parser.add_argument("--rates", nargs="+", type=float, default=[100, 200, 400, 800])
+    parser.add_argument("--duration", type=float, default=5.0, help="seconds per rate")
+    parser.add_argument("--warmup", type=float, default=2.0)
+    parser.add_argument("--concurrency", type=int, default=256, help="most requests in flight")
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix("page=10,chip=50,chat=40"))
+    parser.add_argument("--timeout", type=float, default=10.0, help="client gives up after this")
+    parser.add_argument("--slo", type=float, default=250.0, help="p99 ms a rate must meet to count")
+    parser.add_argument("--preload", action="store_true", help='gunicorn --preload "test:create_app()"')
+    parser.add_argument("--admission", action="store_true", help="leave admission control on")
+    parser.add_argument("--port", type=int, default=8800)
+    parser.add_argument("--json", help="also write the rows here")
+    args = parser.parse_args(argv)
+
+    rows = []
+    print("%-8s %7s %7s %7s %8s %6s %8s %8s %8s %8s" % (
+        "class", "workers", "threads", "rate/s", "ok/s", "err%", "p50 ms", "p90 ms", "p99 ms", "max ms"))
+    configs = 0
+    for worker_class in args.classes:
+        module = WORKER_CLASSES[worker_class]
+        if module and importlib.util.find_spec(module) is None:
+            print("%-8s skipped: pip install %s" % (worker_class, module))
+            continue
+        for workers in args.workers:
+            rows += run_config(worker_class, workers, args, args.port + configs)
+            configs += 1
+
+    print("\ncapacity at p99 <= %.0f ms, < 1%% errors:" % args.slo)
+    seen = []
+    for r in rows:
+        key = (r["worker_class"], r["workers"])
+        if key not in seen:
+            seen.append(key)
+            same = [x for x in rows if (x["worker_class"], x["workers"]) == key]
+            print("  %-8s x%-3d %6.0f req/s" % (key[0], key[1], capacity(same, args.slo)))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"args": {k: v for k, v in vars(args).items() if k != "json"}, "rows": rows},
+                      f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+# bench/matcher.py
+#
+# Per-message latency of the keyword matcher as the keyword table grows.
+# Run from the repo root:  python -m bench.matcher
+
+import random
+import string
+import time
+
+from matcher import KeywordMatcher
+
+MESSAGES = [
+    "hi",
+    "what are the school timings?",
+    "Can you tell me the fee structure for class 5 and whether transport is included",
+    "payment history",
+    "my son wants to join robotics club, what are the admission steps and the exam schedule",
+    "kya bus ki facility hai sector 12 ke liye",
+    "asdfgh",
+]
+
+
+def synthetic_keywords(n, seed=7):
+    rnd = random.Random(seed)
+    words = set()
+    while len(words) < n:
+        k = rnd.randint(1, 3)
+        words.add(" ".join(
+            "".join(rnd.choice(string.ascii_lowercase) for _ in range(rnd.randint(3, 9)))
+            for _ in range(k)
+        ))
+    return [(w, "intent_%d" % (i % 50)) for i, w in enumerate(sorted(words))]
+
+
+def naive_best(patterns, msg):
+    # what detect_intent used to do: test every keyword against the message
+    for kw, intent in patterns:
+        if kw in msg:
+            return intent
+    return None
+
+
+def per_message_us(fn, messages, rounds):
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for m in messages:
+            fn(m)
+    return (time.perf_counter() - start) / (rounds * len(messages)) * 1e6
+
+
+def main():
+    messages = [m.lower() for m in MESSAGES]
+    print("%8s %10s %12s %12s" % ("keywords", "build ms", "matcher us", "naive us"))
+    for n in (100, 1_000, 10_000, 50_000):
+        patterns = synthetic_keywords(n)
+        t0 = time.perf_counter()
+        m = KeywordMatcher(patterns)
+        build_ms = (time.perf_counter() - t0) * 1e3
+        ac = per_message_us(m.best, messages, 2000)
+        naive = per_message_us(lambda s: naive_best(patterns, s), messages, max(1, 200_000 // n))
+        print("%8d %10.1f %12.2f %12.2f" % (n, build_ms, ac, naive))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+# bench/overload.py
+#
+# Result-day surge: open-loop /chat traffic (arrivals don't wait for answers,
+# like real parents) at rising rates against gunicorn gthread workers, with
+# admission control off and on. Without it, latency grows with the backlog for
+# everyone; with it the excess gets fast 429/503s and the answered requests
+# keep a bounded tail.
+#
+#   python -m bench.overload
+#   python -m bench.overload --rates 500 2000 4000 --duration 5 --workers 2
+#
+# Traffic: 70% quick-suggestion chips (cached, cheap), 30% unique questions
+# (cache misses), from --clients addresses sent as X-Forwarded-For. Each request
+# carries X-Request-Start with its send time, as nginx would add it: with
+# gthread workers most of the wait happens in gunicorn's queue before the app
+# sees the request, and the request's age is what admission control can shed on.
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+
+from bench.connections import ROOT, wait_ready
+from bench.corpus import QUICK, QUESTIONS
+
+MODES = {
+    "off": {"ADMISSION_RATE": "0", "ADMISSION_MAX_CONCURRENT": "0"},
+    "on": {"ADMISSION_RATE": "20", "ADMISSION_BURST": "40", "ADMISSION_MAX_CONCURRENT": "4",
+           "ADMISSION_MAX_QUEUE": "16", "ADMISSION_QUEUE_TIMEOUT": "0.1",
+           "ADMISSION_CHEAP_RESERVE": "4", "ADMISSION_MAX_WAIT": "0.05"},
+}
+
+
+def make_request(i, rnd, clients):
+    # -> request with a %s slot for the X-Request-Start time
+    if rnd.random() < 0.7:
+        message = rnd.choice(QUICK)
+    else:
+        message = "%s %d" % (rnd.choice(QUESTIONS), i)
+    body = json.dumps({"message": message})
+    return ("POST /chat HTTP/1.1\r\nHost: localhost\r\nContent-Type: application/json\r\n"
+            "X-Forwarded-For: 10.0.%d.%d\r\nX-Request-Start: t=%%s\r\n"
+            "Content-Length: %d\r\nConnection: close\r\n\r\n%s"
+            % (rnd.randrange(clients) // 250, rnd.randrange(clients) % 250, len(body), body))
+
+
+async def one(port, template, scheduled, results, timeout):
+    try:
+        reader, writer = await asyncio.wait_for(asyncio.open_connection("127.0.0.1", port), timeout)
+        # stamped once connected, so client-side lag doesn't count as server backlog
+        writer.write((template % ("%.6f" % time.time())).encode())
+        status_line = await asyncio.wait_for(reader.readline(), timeout)
+        await asyncio.wait_for(reader.read(), timeout)
+        writer.close()
+        status = int(status_line.split()[1])
+    except (OSError, asyncio.TimeoutError, ValueError, IndexError):
+        status = 0
+    results.append((status, time.perf_counter() - scheduled))
+
+
+async def drive(port, rate, duration, clients, timeout, seed=7):
+    rnd = random.Random(seed)
+    results = []
+    tasks = []
+    start = time.perf_counter()
+    t = 0.0
+    i = 0
+    while t < duration:
+        t += rnd.expovariate(rate)
+        delay = start + t - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        tasks.append(asyncio.ensure_future(
+            one(port, make_request(i, rnd, clients), start + t, results, timeout)))
+        i += 1
+    await asyncio.gather(*tasks)
+    return results
+
+
+def summarize(results, duration):
+    pct = lambda xs, q: sorted(xs)[min(len(xs) - 1, int(q * len(xs)))] * 1000 if xs else float("nan")
+    ok = [lat for status, lat in results if status == 200]
+    shed = [lat for status, lat in results if status in (429, 503)]
+    return {
+        "ok_per_s": len(ok) / duration,
+        "429": sum(1 for s, _ in results if s == 429),
+        "503": sum(1 for s, _ in results if s == 503),
+        "failed": sum(1 for s, _ in results if s not in (200, 429, 503)),
+        "ok_p50_ms": pct(ok, 0.5),
+        "ok_p99_ms": pct(ok, 0.99),
+        "shed_p99_ms": pct(shed, 0.99),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="open-loop overload test, admission control off vs on")
+    parser.add_argument("--modes", nargs="+", default=list(MODES), choices=list(MODES))
+    parser.add_argument("--rates", nargs="+", type=float, default=[250, 500, 1000, 2000])
+    parser.add_argument("--duration", type=float, default=4.0)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--threads", type=int, default=32)
+    parser.add_argument("--clients", type=int, default=2000)
+    parser.add_argument("--timeout", type=float, default=10.0, help="client gives up after this")
+    parser.add_argument("--port", type=int, default=8780)
+    parser.add_argument("--json", help="also write the rows here")
+    args = parser.parse_args(argv)
+
+    rows = []
+    print("%-5s %7s %8s %6s %6s %6s %10s %10s %11s" % (
+        "mode", "rate/s", "ok/s", "429", "503", "fail", "ok p50 ms", "ok p99 ms", "shed p99 ms"))
+    for n, mode in enumerate(args.modes):
+        port = args.port + n
+        env = dict(os.environ, KB_RELOAD_INTERVAL="0", ADMISSION_CLIENT_HEADER="X-Forwarded-For",
+                   **MODES[mode])
+        cmd = [sys.executable, "-m", "gunicorn", "-k", "gthread", "-w", str(args.workers),
+               "--threads", str(args.threads), "--backlog", "4096", "-b", "127.0.0.1:%d" % port,
+               "test:app"]
+        proc = subprocess.Popen(cmd, cwd=ROOT, env=env,
+                                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            wait_ready("http://127.0.0.1:%d/" % port)
+            for rate in args.rates:
+                results = asyncio.run(drive(port, rate, args.duration, args.clients, args.timeout))
+                row = dict(mode=mode, rate=rate, **summarize(results, args.duration))
+                rows.append(row)
+                print("%-5s %7.0f %8.0f %6d %6d %6d %10.1f %10.1f %11.1f" % (
+                    mode, rate, row["ok_per_s"], row["429"], row["503"], row["failed"],
+                    row["ok_p50_ms"], row["ok_p99_ms"], row["shed_p99_ms"]))
+                time.sleep(1.0)  # let the backlog drain between steps
+        finally:
+            proc.terminate()
+            proc.wait()
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(rows, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+# bench/querylog.py
+#
+# Cost of logging every /chat question on the request path:
+#
+#   sync       what logging in chat() directly would do: a JSON line appended
+#              to a gzip file per request
+#   querylog   QueryLog.record(), with the background flusher running
+#
+# then /chat throughput through the Flask test client with the log off and on,
+# and what happens when the disk stalls (records are dropped and counted,
+# record() stays as fast).
+#
+#   python -m bench.querylog
+
+import gzip
+import json
+import os
+import tempfile
+import threading
+import time
+
+from bench.matcher import MESSAGES
+from querylog import QueryLog, analyze, read_records, segments
+
+N = 200000
+
+
+def percentiles(samples):
+    samples = sorted(samples)
+    pick = lambda q: samples[min(len(samples) - 1, int(q * len(samples)))]
+    return pick(0.50), pick(0.99), pick(0.999)
+
+
+def time_calls(fn, n=N):
+    clock = time.perf_counter_ns
+    samples = []
+    for i in range(n):
+        message = MESSAGES[i % len(MESSAGES)]
+        t0 = clock()
+        fn(message, "default", 41000)
+        samples.append(clock() - t0)
+    return [s / 1000 for s in percentiles(samples)]
+
+
+def sync_writer(path):
+    f = gzip.open(path, "at", encoding="utf-8")
+
+    def write(message, intent, latency_ns):
+        f.write(json.dumps([time.time(), message, intent, latency_ns // 1000]) + "\n")
+        f.flush()
+    return write, f
+
+
+def chat_rate(client, n=20000):
+    start = time.perf_counter()
+    for i in range(n):
+        client.post("/chat", json={"message": "%s %d" % (MESSAGES[i % len(MESSAGES)], i % 500)})
+    return n / (time.perf_counter() - start)
+
+
+def main():
+    with tempfile.TemporaryDirectory() as tmp:
+        print("%-10s %9s %9s %9s  (µs per logged question)" % ("", "p50", "p99", "p99.9"))
+        write, f = sync_writer(os.path.join(tmp, "sync.jsonl.gz"))
+        print("%-10s %9.2f %9.2f %9.2f" % (("sync",) + tuple(time_calls(write))))
+        f.close()
+
+        qlog = QueryLog(os.path.join(tmp, "log"), flush_interval=0.2)
+        print("%-10s %9.2f %9.2f %9.2f" % (("querylog",) + tuple(time_calls(qlog.record))))
+        qlog.flush()
+        stats = qlog.stats()
+        size = sum(os.path.getsize(p) for p in segments(qlog.directory))
+        print("written %d, dropped %d, %.1f bytes/record on disk"
+              % (stats["written"], stats["dropped"], size / max(1, stats["written"])))
+
+        # a stalled disk: hold the writer so nothing leaves the buffer
+        stalled = QueryLog(os.path.join(tmp, "stalled"), capacity=50000)
+        with stalled._write_lock:
+            holder = threading.Thread(target=stalled.flush)
+            holder.start()
+            p50, p99, p999 = time_calls(stalled.record)
+        holder.join()
+        print("stalled    %9.2f %9.2f %9.2f  dropped %d of %d"
+              % (p50, p99, p999, stalled.stats()["dropped"], N))
+
+        t0 = time.perf_counter()
+        report = analyze(read_records(segments(qlog.directory)), top=5)
+        print("analyzer: %d records in %.2f s, top unmatched %s"
+              % (report["total"], time.perf_counter() - t0, report["phrasings"][:1]))
+
+        os.environ.setdefault("ADMISSION_RATE", "0")  # one client, far above its limit
+        import test
+        client = test.app.test_client()
+        chat_rate(client, 2000)
+        off = chat_rate(client)
+        test.QUERY_LOG = QueryLog(os.path.join(tmp, "chat"))
+        on = chat_rate(client)
+        test.QUERY_LOG.flush()
+        print("/chat through the test client: %.0f/s log off, %.0f/s log on (%d logged)"
+              % (off, on, test.QUERY_LOG.stats()["written"]))
+
+
+if __name__ == "__main__":
+    main()
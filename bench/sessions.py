@@ -0,0 +1,88 @@
+# bench/sessions.py
+#
+# Conversation state under a crowd of parents: N conversations send a message
+# each round (a get and a set, like /chat does), first the same N every round,
+# then N new ones every round (people leaving and arriving). Memory must level
+# off once the store is full and stay there.
+#
+#   python -m bench.sessions                         (100k conversations, both stores)
+#   python -m bench.sessions --sessions 200000 --max-mb 16 --rounds 8
+
+import argparse
+import os
+import tempfile
+import time
+import tracemalloc
+
+from sessions import FileSessionStore, MemorySessionStore
+
+INTENTS = ["fees", "admission", "exam_schedule", "timings", "transport", "default"]
+PENDING = {"fees": "fee_breakdown", "admission": "admission_form", "exam_schedule": "exam_class"}
+
+
+def rss_mb():
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+
+def conversation_ids(start, n):
+    # the page's ids are UUIDs; 22 characters is a token_urlsafe(16)-sized stand-in
+    return ["c%021d" % i for i in range(start, start + n)]
+
+
+def touch_all(store, ids):
+    t0 = time.perf_counter()
+    for i, cid in enumerate(ids):
+        store.get(cid)
+        intent = INTENTS[i % len(INTENTS)]
+        store.set(cid, intent, PENDING.get(intent))
+    return len(ids) / (time.perf_counter() - t0)
+
+
+def bytes_per_session(n=20000):
+    # what the in-memory store really spends per conversation (its RECORD_BYTES)
+    store = MemorySessionStore(max_bytes=1 << 40)
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    for cid in conversation_ids(0, n):
+        store.set(cid, "fees", "fee_breakdown")
+    used = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    return used / n
+
+
+def run(name, store, sessions, rounds):
+    for phase in ("steady", "churn"):
+        for r in range(rounds):
+            start = 0 if phase == "steady" else (r + 1) * sessions * 10
+            ops = touch_all(store, conversation_ids(start, sessions))
+            print("%-8s %-7s %6d %10d %10.0f %9.1f"
+                  % (name, phase, r + 1, len(store), ops, rss_mb()))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="conversation state memory under load")
+    parser.add_argument("--sessions", type=int, default=100000)
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--max-mb", type=int, default=32)
+    parser.add_argument("--stores", nargs="+", default=["memory", "file"], choices=["memory", "file"])
+    args = parser.parse_args(argv)
+
+    print("memory store: %.0f bytes per conversation (RECORD_BYTES = %d)"
+          % (bytes_per_session(), MemorySessionStore.RECORD_BYTES))
+    print("%-8s %-7s %6s %10s %10s %9s" % ("store", "phase", "round", "live", "msgs/s", "RSS MB"))
+    max_bytes = args.max_mb * 1024 * 1024
+    with tempfile.TemporaryDirectory() as tmp:
+        for name in args.stores:
+            if name == "memory":
+                store = MemorySessionStore(max_bytes=max_bytes)
+            else:
+                store = FileSessionStore(os.path.join(tmp, "sessions"), max_bytes=max_bytes)
+            run(name, store, args.sessions, args.rounds)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+# bench/startup.py
+#
+# Cold start and per-worker memory of a gunicorn deployment, before and after
+# the app factory + KB snapshot:
+#
+#   plain      gunicorn test:app, no snapshot (every worker compiles the KB)
+#   snapshot   gunicorn test:app, workers map the cached KB snapshot
+#   preload    gunicorn --preload "test:create_app()" with the snapshot
+#
+#   python -m bench.startup
+#   python -m bench.startup --workers 8 --runs 5
+#
+# "first ms" is from spawning gunicorn to the first answered /chat. Memory is
+# read from /proc/<worker>/smaps_rollup after a short warm-up: RSS counts shared
+# pages in full, PSS splits them between the processes sharing them, and
+# private is what the worker alone holds. Linux only.
+
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import requests
+
+from bench.connections import ROOT
+
+MODES = {
+    "plain": (["test:app"], False),
+    "snapshot": (["test:app"], True),
+    "preload": (["--preload", "test:create_app()"], True),
+}
+
+
+def smaps(pid):
+    # -> {"Rss": kB, "Pss": kB, "Private": kB}
+    out = {"Rss": 0, "Pss": 0, "Private": 0}
+    with open("/proc/%d/smaps_rollup" % pid) as f:
+        for line in f:
+            name, _, rest = line.partition(":")
+            if name in ("Rss", "Pss"):
+                out[name] = int(rest.split()[0])
+            elif name in ("Private_Clean", "Private_Dirty"):
+                out["Private"] += int(rest.split()[0])
+    return out
+
+
+def children(pid):
+    with open("/proc/%d/task/%d/children" % (pid, pid)) as f:
+        return [int(c) for c in f.read().split()]
+
+
+def run_once(mode, port, workers, cache_dir):
+    args, use_cache = MODES[mode]
+    env = dict(os.environ, KB_CACHE_DIR=cache_dir if use_cache else "", KB_RELOAD_INTERVAL="0")
+    cmd = [sys.executable, "-m", "gunicorn", "-w", str(workers), "-b", "127.0.0.1:%d" % port] + args
+    url = "http://127.0.0.1:%d/chat" % port
+    started = time.perf_counter()
+    proc = subprocess.Popen(cmd, cwd=ROOT, env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        while True:
+            try:
+                if requests.post(url, json={"message": "fees"}, timeout=1).status_code == 200:
+                    break
+            except requests.RequestException:
+                pass
+            if proc.poll() is not None or time.perf_counter() - started > 30:
+                raise RuntimeError("gunicorn (%s) did not start" % mode)
+            time.sleep(0.005)
+        first_ms = (time.perf_counter() - started) * 1000
+        # wait for every worker, then give each some traffic
+        deadline = time.time() + 10
+        while len(children(proc.pid)) < workers and time.time() < deadline:
+            time.sleep(0.05)
+        time.sleep(1.0)
+        session = requests.Session()
+        for i in range(200 * workers):
+            session.post(url, json={"message": ("fees", "bus timing", "admision", "hi")[i % 4]})
+        mem = [smaps(pid) for pid in children(proc.pid)]
+    finally:
+        proc.terminate()
+        proc.wait()
+    avg = lambda key: sum(m[key] for m in mem) / len(mem) / 1024
+    return first_ms, avg("Rss"), avg("Pss"), avg("Private")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="gunicorn cold start and per-worker memory")
+    parser.add_argument("--modes", nargs="+", default=list(MODES), choices=list(MODES))
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--port", type=int, default=8790)
+    args = parser.parse_args(argv)
+
+    print("%-10s %10s %14s %14s %14s" % ("mode", "first ms", "RSS MB/worker",
+                                          "PSS MB/worker", "private MB/wkr"))
+    with tempfile.TemporaryDirectory() as cache_dir:
+        for mode in args.modes:
+            runs = [run_once(mode, args.port, args.workers, cache_dir) for _ in range(args.runs)]
+            # median run by start time; memory is steady between runs
+            runs.sort()
+            print("%-10s %10.0f %14.1f %14.1f %14.1f" % ((mode,) + runs[len(runs) // 2]))
+
+
+if __name__ == "__main__":
+    main()
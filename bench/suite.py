@@ -0,0 +1,214 @@
+# bench/suite.py
+#
+# In-process micro-benchmarks for the matching and reply pipeline.
+#
+#   python -m bench.suite              run, compare against bench/baseline.json
+#   python -m bench.suite --save       run and write a new baseline
+#
+# Every operation is timed on its own, so the report has real percentiles; each
+# case runs --repeat times. Around each repeat a fixed pure-Python workload is
+# timed as well (calibration_us); the repeat with the median throughput
+# relative to it is kept, and the case's baseline is scaled by how much slower
+# or faster that workload ran than when the baseline was recorded, so a busy
+# or slower machine doesn't read as a regression. The run exits with status 1
+# when a case is still slower than its scaled baseline by more than --tolerance
+# (ops/sec down or p50 up).
+#
+# bench/baseline.json records the machine and commit it came from. Calibration
+# follows overall speed, not every difference between machines (caches, the
+# Python build), so re-record the baseline in the same commit as any change
+# meant to move these numbers, and after moving to another machine: run the
+# suite twice without --save and check both pass, then run it with --save and
+# commit baseline.json, with the before/after table in the commit message.
+
+import argparse
+import gc
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+from bench.corpus import corpus
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+
+
+def current_commit():
+    # short hash of the checkout the numbers came from, or None outside git
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                             cwd=os.path.dirname(BASELINE), check=True).stdout
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return out.strip() or None
+
+
+def _reference_work():
+    # fixed work of the kind the cases do: string handling, dict and list building
+    seen = {}
+    for i in range(4000):
+        words = ("Fees for class %d please" % (i % 13)).lower().split()
+        seen[" ".join(words)] = len(words)
+    return sorted(seen)
+
+
+def calibrate(runs=7):
+    # median us of _reference_work: how fast this machine is right now
+    clock = time.perf_counter_ns
+    samples = []
+    for _ in range(runs):
+        t0 = clock()
+        _reference_work()
+        samples.append(clock() - t0)
+    samples.sort()
+    return round(samples[len(samples) // 2] / 1000, 1)
+
+
+def measure(fn, items, rounds, before=None, repeat=5):
+    # the median repeat by throughput relative to the machine's speed, taken
+    # around each repeat: a shared machine's speed moves within a single run
+    runs = []
+    for _ in range(repeat):
+        start = calibrate()
+        run = _measure_once(fn, items, rounds, before)
+        run["calibration_us"] = round((start + calibrate()) / 2, 1)
+        runs.append(run)
+    runs.sort(key=lambda r: r["ops_per_sec"] * r["calibration_us"])
+    return runs[len(runs) // 2]
+
+
+def _measure_once(fn, items, rounds, before):
+    clock = time.perf_counter_ns
+    samples = []
+    gc.disable()
+    try:
+        for _ in range(rounds):
+            for item in items:
+                if before is not None:
+                    before()
+                t0 = clock()
+                fn(item)
+                samples.append(clock() - t0)
+    finally:
+        gc.enable()
+    samples.sort()
+    pick = lambda q: samples[min(len(samples) - 1, int(q * len(samples)))] / 1000
+    mean_ns = sum(samples) / len(samples)
+    return {
+        "ops_per_sec": round(1e9 / mean_ns, 1),
+        "p50_us": round(pick(0.50), 2),
+        "p95_us": round(pick(0.95), 2),
+        "p99_us": round(pick(0.99), 2),
+        "n": len(samples),
+    }
+
+
+def run_cases(rounds, repeat):
+    # one client far above any rate limit: measure the handlers, not admission
+    os.environ["ADMISSION_RATE"] = "0"
+    from test import (app, answer_batch, build_replies, detect_intent, KB_STORE,
+                      RESPONSE_CACHE)
+
+    messages = corpus()
+    intents = list(KB_STORE.current.entries)
+    client = app.test_client()
+    chat = lambda m: client.post("/chat", json={"message": m})
+
+    # warm up imports, caches and the JIT-less interpreter paths
+    for m in messages[:200]:
+        detect_intent(m)
+        chat(m)
+
+    cases = {
+        "detect_intent": measure(detect_intent, messages, rounds, repeat=repeat),
+        "build_replies": measure(build_replies, intents, rounds * 50, repeat=repeat),
+        "chat_cached": measure(chat, messages, max(1, rounds // 2), repeat=repeat),
+        "chat_uncached": measure(chat, messages, max(1, rounds // 2),
+                                 before=RESPONSE_CACHE.clear, repeat=repeat),
+        "answer_batch_100": measure(
+            answer_batch, [messages[i:i + 100] for i in range(0, len(messages), 100)],
+            rounds, repeat=repeat),
+    }
+    return {
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "commit": current_commit(),
+        "corpus_size": len(messages),
+        "cases": cases,
+    }
+
+
+def speed_scale(cur, base):
+    # > 1 when the machine ran the calibration slower now than for the baseline
+    if cur.get("calibration_us") and base.get("calibration_us"):
+        return cur["calibration_us"] / base["calibration_us"]
+    return 1.0
+
+
+def compare(result, baseline, tolerance):
+    failures = []
+    for name, cur in result["cases"].items():
+        base = baseline.get("cases", {}).get(name)
+        if base is None:
+            continue
+        scale = speed_scale(cur, base)
+        if cur["ops_per_sec"] < base["ops_per_sec"] / scale * (1 - tolerance):
+            failures.append("%s: %.0f ops/s vs baseline %.0f (x%.2f for machine speed)"
+                            % (name, cur["ops_per_sec"], base["ops_per_sec"], 1 / scale))
+        if cur["p50_us"] > base["p50_us"] * scale * (1 + tolerance):
+            failures.append("%s: p50 %.1f us vs baseline %.1f (x%.2f for machine speed)"
+                            % (name, cur["p50_us"], base["p50_us"], scale))
+    return failures
+
+
+def print_table(result, baseline=None):
+    # vs base: ops/sec against the baseline scaled for machine speed (the speed column)
+    print("%-18s %12s %10s %10s %10s %8s %10s"
+          % ("case", "ops/sec", "p50 us", "p95 us", "p99 us", "speed", "vs base"))
+    for name, c in result["cases"].items():
+        speed = delta = ""
+        base = (baseline or {}).get("cases", {}).get(name)
+        if base:
+            scale = speed_scale(c, base)
+            speed = "x%.2f" % (1 / scale)
+            delta = "%+.0f%%" % ((c["ops_per_sec"] * scale / base["ops_per_sec"] - 1) * 100)
+        print("%-18s %12.0f %10.2f %10.2f %10.2f %8s %10s"
+              % (name, c["ops_per_sec"], c["p50_us"], c["p95_us"], c["p99_us"], speed, delta))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="matching / reply pipeline micro-benchmarks")
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--baseline", default=BASELINE)
+    parser.add_argument("--tolerance", type=float, default=0.30,
+                        help="allowed slowdown as a fraction (default 0.30)")
+    parser.add_argument("--save", action="store_true", help="write the results as the new baseline")
+    args = parser.parse_args(argv)
+
+    result = run_cases(args.rounds, args.repeat)
+    baseline = None
+    if os.path.exists(args.baseline) and not args.save:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    print_table(result, baseline)
+
+    if args.save:
+        with open(args.baseline, "w") as f:
+            json.dump(result, f, indent=2, sort_keys=True)
+            f.write("\n")
+        print("baseline written to %s" % args.baseline)
+        return 0
+    if baseline is None:
+        print("no baseline at %s (run with --save to create one)" % args.baseline)
+        return 0
+    failures = compare(result, baseline, args.tolerance)
+    for line in failures:
+        print("REGRESSION " + line)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
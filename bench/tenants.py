@@ -0,0 +1,118 @@
+# bench/tenants.py
+#
+# Serving many schools from one process (see tenants.py): what a cold tenant
+# costs (a first compile, or mapping its snapshot after an eviction), what
+# routing adds to a warm /chat, and how a Zipf-skewed mix of --tenants schools
+# behaves with room for only --cache of them.
+#
+#   python -m bench.tenants
+#   python -m bench.tenants --tenants 500 --cache 32 --requests 20000
+#
+# Runs in process through the Flask test client, like the app behind gunicorn
+# minus the socket.
+
+import argparse
+import os
+import random
+import resource
+import shutil
+import tempfile
+import time
+
+from bench.connections import ROOT
+
+
+def make_tenants(directory, count):
+    # copies of the school's KB, each with its own name and one extra intent so
+    # every tenant compiles (and snapshots) separately
+    with open(os.path.join(ROOT, "knowledge_base.csv"), encoding="utf-8") as f:
+        kb = f.read().rstrip("\n")
+    names = ["school-%03d" % i for i in range(count)]
+    for i, name in enumerate(names):
+        os.makedirs(os.path.join(directory, name))
+        with open(os.path.join(directory, name, "knowledge_base.csv"), "w", encoding="utf-8") as f:
+            f.write(kb.replace("Mira", "Branch %d" % i))
+            f.write('\nbranch_%d,"branch %d office",Branch %d office is open 8 AM to 2 PM.\n' % (i, i, i))
+    shutil.copytree(os.path.join(ROOT, "facts"), os.path.join(directory, names[0], "facts"))
+    return names
+
+
+def chat(client, path, message):
+    response = client.post(path, json={"message": message})
+    assert response.status_code == 200, (path, response.status_code)
+
+
+def timed(fn, *args):
+    t0 = time.perf_counter()
+    fn(*args)
+    return (time.perf_counter() - t0) * 1000
+
+
+def median(values):
+    values = sorted(values)
+    return values[len(values) // 2]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="multi-tenant load, eviction and memory")
+    parser.add_argument("--tenants", type=int, default=200)
+    parser.add_argument("--cache", type=int, default=64, help="TENANT_CACHE_SIZE")
+    parser.add_argument("--requests", type=int, default=10000, help="Zipf-mixed /chat requests")
+    parser.add_argument("--zipf", type=float, default=1.1, help="skew of the tenant mix")
+    args = parser.parse_args(argv)
+
+    tmp = tempfile.mkdtemp(prefix="bench-tenants-")
+    try:
+        names = make_tenants(os.path.join(tmp, "tenants"), args.tenants)
+        os.environ.update(TENANTS_DIR=os.path.join(tmp, "tenants"), TENANT_CACHE_SIZE=str(args.cache),
+                          KB_CACHE_DIR=os.path.join(tmp, "cache"), KB_RELOAD_INTERVAL="0",
+                          ADMISSION_RATE="0", ADMISSION_MAX_CONCURRENT="0")
+        import test
+        client = test.app.test_client()
+        chat(client, "/chat", "fees")
+        rss0 = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+        sample = names[:min(20, len(names))]
+        first = [timed(chat, client, "/t/%s/chat" % n, "fees") for n in sample]
+        sizes_compiled = [test.TENANTS.peek(n).size for n in sample if test.TENANTS.peek(n)]
+        # push the sample out, then bring it back from the snapshots
+        for n in names[len(sample):len(sample) + args.cache]:
+            chat(client, "/t/%s/chat" % n, "fees")
+        again = [timed(chat, client, "/t/%s/chat" % n, "fees") for n in sample]
+        sizes = [test.TENANTS.peek(n).size for n in sample if test.TENANTS.peek(n)]
+
+        rounds = 2000
+        warm = names[0]
+        chat(client, "/t/%s/chat" % warm, "fees")
+        plain = median([timed(chat, client, "/chat", "fees") for _ in range(rounds)]) * 1000
+        routed = median([timed(chat, client, "/t/%s/chat" % warm, "fees") for _ in range(rounds)]) * 1000
+
+        print("%d tenants, cache of %d" % (args.tenants, args.cache))
+        print("  cold, compiled:       %7.1f ms median first request, ~%d KB held" % (
+            median(first), median(sizes_compiled) // 1024 if sizes_compiled else 0))
+        print("  cold, from snapshot:  %7.1f ms median first request, ~%d KB held" % (
+            median(again), median(sizes) // 1024 if sizes else 0))
+        print("  warm /chat:           %7.1f us default school, %.1f us under /t/<name>/" % (plain, routed))
+
+        weights = [1 / (i + 1) ** args.zipf for i in range(len(names))]
+        rnd = random.Random(3)
+        mix = rnd.choices(names, weights, k=args.requests)
+        before = test.TENANTS.stats()
+        t0 = time.perf_counter()
+        for name in mix:
+            chat(client, "/t/%s/chat" % name, "fees")
+        elapsed = time.perf_counter() - t0
+        stats = test.TENANTS.stats()
+        loads = stats["loads"] - before["loads"]
+        print("  Zipf(%.1f) mix:        %7.0f req/s, %d loads (%.1f%% of requests), %d evictions" % (
+            args.zipf, args.requests / elapsed, loads, 100.0 * loads / args.requests,
+            stats["evictions"] - before["evictions"]))
+        print("  resident:             %7d tenants, ~%.1f MB counted, max RSS +%.1f MB" % (
+            stats["resident"], stats["bytes"] / 2 ** 20,
+            (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss0) / 1024))
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
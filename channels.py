@@ -0,0 +1,77 @@
+# channels.py
+
+# ======= Persistent streaming channels (Server-Sent Events) =======
+# The page opens one EventSource on /chat/stream for the whole visit and gets a
+# session id back as its first event. Messages are then posted to /chat/send
+# with that id, and every reply is pushed down the open stream as soon as it is
+# ready, with no new connection or JSON round trip per message.
+#
+# The hub only stores queues; the caller picks the queue type: queue.SimpleQueue
+# for the threaded Flask server, asyncio.Queue for aserver.py. Both have
+# put_nowait(), which is all publish() needs.
+
+import json
+import secrets
+import threading
+import time
+
+# seconds between keep-alive comments on an idle stream
+HEARTBEAT = 15.0
+
+
+def sse_event(event: str, data) -> bytes:
+    payload = json.dumps(data, separators=(",", ":"))
+    return ("event: %s\ndata: %s\n\n" % (event, payload)).encode("utf-8")
+
+
+SSE_HEARTBEAT = b": ping\n\n"
+
+SSE_HEADERS = [
+    ("Content-Type", "text/event-stream"),
+    ("Cache-Control", "no-cache"),
+    ("X-Accel-Buffering", "no"),  # keep nginx from buffering the stream
+]
+
+
+class Channel:
+    __slots__ = ("id", "queue", "opened")
+
+    def __init__(self, channel_id, queue):
+        self.id = channel_id
+        self.queue = queue
+        self.opened = time.monotonic()
+
+
+class ChannelHub:
+    def __init__(self, make_queue, max_channels=10000):
+        self.make_queue = make_queue
+        self.max_channels = max_channels
+        self._channels = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._channels)
+
+    def open(self):
+        # -> Channel, or None when the hub is full
+        with self._lock:
+            if len(self._channels) >= self.max_channels:
+                return None
+            channel = Channel(secrets.token_urlsafe(12), self.make_queue())
+            self._channels[channel.id] = channel
+        channel.queue.put_nowait(sse_event("session", {"session": channel.id}))
+        return channel
+
+    def close(self, channel_id):
+        with self._lock:
+            self._channels.pop(channel_id, None)
+
+    def get(self, channel_id):
+        return self._channels.get(channel_id) if isinstance(channel_id, str) else None
+
+    def publish(self, channel_id, event, data):
+        channel = self.get(channel_id)
+        if channel is None:
+            return False
+        channel.queue.put_nowait(sse_event(event, data))
+        return True
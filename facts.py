@@ -0,0 +1,208 @@
+# facts.py
+
+# ======= Fact tables: answers that depend on a class, grade or route =======
+# "exam dates for class 9" or "bus timing for route 12" need a row, not one
+# canned reply. Each table is a CSV next to the KB (one row per key) with a
+# reply template filled from the row's columns. Every reply is rendered when
+# the tables are loaded, so answering is one regex search for the slots and
+# one dict lookup, however many rows there are.
+#
+# Slots are read from the normalized message (see kb.normalize_message):
+#
+#   class   "class 9", "grade 10", "std 4", "9th class", "class ix", "class lkg"
+#   route   "route 12", "route no 12", "bus 12", "bus number 12"
+#
+# Only the transport table uses the route slot, so naming a route is enough
+# to get its row even when the keywords picked another intent ("bus timing for
+# route 12" matches timings first).
+
+import csv
+import hashlib
+import io
+import logging
+import os
+import re
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+# also used by the page's intent bundle (JavaScript regex syntax too)
+SLOT_PATTERN = (
+    r"\b(?:(?:class|grade|std|standard) (\d{1,2}|[ivx]{1,4}|nursery|lkg|ukg)(?:st|nd|rd|th)?"
+    r"|(\d{1,2})(?:st|nd|rd|th) (?:class|grade|std|standard)"
+    r"|(?:route|bus) (?:no |number )?(\d{1,3}))\b"
+)
+_SLOTS = re.compile(SLOT_PATTERN)
+
+ROMAN = {r: str(n) for n, r in enumerate(
+    "i ii iii iv v vi vii viii ix x xi xii".split(), 1)}
+
+
+def slot_key(value):
+    # "09" -> "9", "IX" -> "9", "LKG" -> "lkg"; None for roman-looking words that aren't numerals
+    value = value.strip().lower()
+    if value.isdigit():
+        return str(int(value))
+    if value and set(value) <= set("ivx"):
+        return ROMAN.get(value)
+    return value or None
+
+
+def has_slot_word(norm):
+    # every slot has one of these words, and most messages have none of them;
+    # plain substring tests are cheaper than any regex here
+    return ("class" in norm or "grade" in norm or "std" in norm or "standard" in norm
+            or "route" in norm or "bus" in norm)
+
+
+def extract_slots(norm):
+    # -> {"class": key, "route": key} for the first of each found in the message
+    if not has_slot_word(norm):
+        return {}
+    slots = {}
+    for m in _SLOTS.finditer(norm):
+        cls, ordinal, route = m.groups()
+        if route is not None:
+            slots.setdefault("route", str(int(route)))
+        else:
+            key = slot_key(cls or ordinal)
+            if key is not None:
+                slots.setdefault("class", key)
+    return slots
+
+
+class FactTable:
+    def __init__(self, rows, key, slot, template, missing):
+        # template is filled from each row's columns; missing from {key}
+        self.slot = slot
+        self.missing = missing
+        self.replies = {}
+        for row in rows:
+            k = slot_key(row.get(key) or "")
+            if k is None:
+                continue
+            try:
+                self.replies[k] = template.format_map(row)
+            except KeyError as exc:
+                raise ValueError("reply template needs a %s column" % exc) from None
+
+    def __len__(self):
+        return len(self.replies)
+
+    def lookup(self, key):
+        reply = self.replies.get(key)
+        return reply if reply is not None else self.missing.format(key=key)
+
+
+class FactBook:
+    def __init__(self, tables, version):
+        # tables: intent -> FactTable
+        self.tables = tables
+        self.version = version
+        # a slot only one table uses names its intent by itself
+        owners = {}
+        for intent, table in tables.items():
+            owners.setdefault(table.slot, []).append(intent)
+        self.owners = {slot: intents[0] for slot, intents in owners.items() if len(intents) == 1}
+
+    def lookup(self, intent, key):
+        # -> reply for this key of the intent's table, or None without a table
+        table = self.tables.get(intent)
+        if table is None:
+            return None
+        key = slot_key(key)
+        return table.lookup(key) if key is not None else None
+
+    def answer(self, intent, norm):
+        # -> (intent, reply) when the message names a row, else None
+        if not self.tables:
+            return None
+        slots = extract_slots(norm)
+        if not slots:
+            return None
+        table = self.tables.get(intent)
+        if table is not None and table.slot in slots:
+            return intent, table.lookup(slots[table.slot])
+        for slot, key in slots.items():
+            owner = self.owners.get(slot)
+            if owner is not None:
+                return owner, self.tables[owner].lookup(key)
+        return None
+
+
+def load_facts(directory, specs):
+    # specs: intent -> (csv file, key column, slot, template, missing template)
+    tables = {}
+    digest = hashlib.sha256()
+    for intent, (filename, key, slot, template, missing) in sorted(specs.items()):
+        path = os.path.join(directory, filename)
+        try:
+            with open(path, "rb") as f:
+                raw = f.read()
+        except FileNotFoundError:
+            continue
+        digest.update(filename.encode() + b"\0" + raw + b"\0")
+        rows = csv.DictReader(io.StringIO(raw.decode("utf-8-sig")))
+        tables[intent] = FactTable(rows, key, slot, template, missing)
+    return FactBook(tables, digest.hexdigest()[:16])
+
+
+class FactStore:
+    # the fact tables in use, reloaded when a file changes (like KnowledgeBaseStore)
+    def __init__(self, directory, specs, poll_interval=2.0):
+        self.directory = directory
+        self.specs = specs
+        self.poll_interval = poll_interval
+        self._listeners = []
+        self._stamp = self._stat()
+        self.current = load_facts(directory, specs)
+
+    def _stat(self):
+        stamp = []
+        for filename, *_ in self.specs.values():
+            try:
+                st = os.stat(os.path.join(self.directory, filename))
+                stamp.append((st.st_mtime_ns, st.st_size))
+            except OSError:
+                stamp.append(None)
+        return tuple(stamp)
+
+    def on_swap(self, fn):
+        self._listeners.append(fn)
+
+    def check(self):
+        stamp = self._stat()
+        if stamp == self._stamp:
+            return False
+        self._stamp = stamp
+        try:
+            new = load_facts(self.directory, self.specs)
+        except (OSError, ValueError, csv.Error, UnicodeDecodeError) as exc:
+            log.warning("fact tables reload failed, keeping version %s: %s", self.current.version, exc)
+            return False
+        old = self.current
+        if new.version == old.version:
+            return False
+        self.current = new
+        log.info("fact tables reloaded: %s -> %s", old.version, new.version)
+        for fn in self._listeners:
+            fn(old, new)
+        return True
+
+    def _watch(self):
+        while True:
+            time.sleep(self.poll_interval)
+            try:
+                self.check()
+            except Exception:
+                log.exception("fact tables watcher error")
+
+    def start_watcher(self):
+        if self.poll_interval <= 0:
+            return
+        self._spawn_watcher()
+        os.register_at_fork(after_in_child=self._spawn_watcher)
+
+    def _spawn_watcher(self):
+        threading.Thread(target=self._watch, name="facts-watcher", daemon=True).start()
@@ -0,0 +1,202 @@
+# fuzzy.py
+
+# ======= Typo-tolerant token correction (symmetric delete / SymSpell) =======
+# Every vocabulary word is indexed under all strings reachable from it by up to
+# `max_distance` deletions. A typo is looked up the same way: its own deletions
+# are generated and probed in the dict, and the few candidates that share a key
+# are verified with a bounded edit distance. No scan over the vocabulary.
+#
+# The index is a hash table in flat int arrays (keyed by the CRC32 of each
+# deletion), so it can live in a memory-mapped KB snapshot (see snapshot.py).
+# Two deletions with the same CRC share a slot; that only adds candidates,
+# which the edit-distance check throws out.
+
+from array import array
+import zlib
+
+
+def _deletes(word: str, distance: int):
+    out = {word}
+    frontier = (word,)
+    for _ in range(distance):
+        frontier = {w[:i] + w[i + 1:] for w in frontier if len(w) > 1 for i in range(len(w))}
+        out |= frontier
+    return out
+
+
+def edit_distance(a: str, b: str, limit: int):
+    # Optimal string alignment distance (Levenshtein + adjacent transposition),
+    # bit-parallel after Myers/Hyyro: one pass over b with a few int ops per char.
+    # Anything above limit is reported as limit + 1.
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    if not a or not b:
+        return min(max(len(a), len(b)), limit + 1)
+    peq = {}
+    for i, ch in enumerate(a):
+        peq[ch] = peq.get(ch, 0) | (1 << i)
+    m = len(a)
+    mask = (1 << m) - 1
+    high = 1 << (m - 1)
+    vp, vn, d0, pm_prev = mask, 0, 0, 0
+    score = m
+    for ch in b:
+        pm = peq.get(ch, 0)
+        tr = (((~d0) & pm) << 1) & pm_prev
+        d0 = ((((pm & vp) + vp) ^ vp) | pm | vn | tr) & mask
+        hp = vn | (~(d0 | vp) & mask)
+        hn = d0 & vp
+        if hp & high:
+            score += 1
+        elif hn & high:
+            score -= 1
+        hp = ((hp << 1) | 1) & mask
+        hn = (hn << 1) & mask
+        vp = hn | (~(d0 | hp) & mask)
+        vn = hp & d0
+        pm_prev = pm
+    return score if score <= limit else limit + 1
+
+
+def _hash(key: str):
+    return zlib.crc32(key.encode("utf-8")) or 1  # 0 marks an empty slot
+
+
+class DeletionIndex:
+    def __init__(self, words, max_distance=2, min_length=4, memo_size=10000):
+        # vocabulary in first-seen order; the position settles ties
+        vocab = {}
+        for w in words:
+            if len(w) >= 3 and w not in vocab:
+                vocab[w] = len(vocab)
+        postings = {}  # deletion hash -> word ids
+        for w, wid in vocab.items():
+            for d in _deletes(w, max_distance):
+                ids = postings.setdefault(_hash(d), [])
+                if not ids or ids[-1] != wid:
+                    ids.append(wid)
+
+        size = 8
+        while size < 2 * len(postings):
+            size *= 2
+        hashes = array("I", bytes(4 * size))
+        starts = array("I", bytes(4 * size))
+        ends = array("I", bytes(4 * size))
+        ids = array("I")
+        for h, wids in postings.items():
+            i = h & (size - 1)
+            while hashes[i]:
+                i = (i + 1) & (size - 1)
+            hashes[i] = h
+            starts[i] = len(ids)
+            ids.extend(wids)
+            ends[i] = len(ids)
+        self._setup(list(vocab), max_distance, min_length, memo_size,
+                    {"hashes": hashes, "starts": starts, "ends": ends, "ids": ids})
+
+    def _setup(self, words, max_distance, min_length, memo_size, tables):
+        self.max_distance = max_distance
+        self.min_length = min_length
+        self.words = words
+        self.vocab = {w: i for i, w in enumerate(words)}
+        self._hashes = tables["hashes"]
+        self._starts = tables["starts"]
+        self._ends = tables["ends"]
+        self._ids = tables["ids"]
+        self._mask = len(self._hashes) - 1
+        # token -> correction; parents repeat the same typos (and the same
+        # unknown words), so most lookups never reach the index
+        self.memo_size = memo_size
+        self._memo = {}
+
+    def tables(self):
+        # int arrays that, with words and the settings, rebuild the index
+        return {"hashes": self._hashes, "starts": self._starts, "ends": self._ends, "ids": self._ids}
+
+    @classmethod
+    def from_tables(cls, words, tables, max_distance=2, min_length=4, memo_size=10000):
+        self = cls.__new__(cls)
+        self._setup(list(words), max_distance, min_length, memo_size, tables)
+        return self
+
+    def __len__(self):
+        # distinct deletion keys
+        return sum(1 for h in self._hashes if h)
+
+    def _postings(self, key: str):
+        # word ids indexed under `key` (plus any sharing its hash)
+        h = _hash(key)
+        hashes, mask = self._hashes, self._mask
+        i = h & mask
+        while True:
+            slot = hashes[i]
+            if slot == h:
+                return self._ids[self._starts[i]:self._ends[i]]
+            if not slot:
+                return ()
+            i = (i + 1) & mask
+
+    def allowed_distance(self, token: str):
+        if len(token) < self.min_length:
+            return 0
+        return min(self.max_distance, 1 if len(token) < 8 else 2)
+
+    def correct(self, token: str):
+        # Closest vocabulary word, or None if the token is known or too far off
+        if token in self.vocab:
+            return None
+        memo = self._memo
+        if token in memo:
+            return memo[token]
+        limit = self.allowed_distance(token)
+        best = self._lookup(token, limit) if limit else None
+        if self.memo_size:
+            if len(memo) >= self.memo_size:
+                memo.clear()
+            memo[token] = best
+        return best
+
+    def _lookup(self, token: str, limit: int):
+        # Distance-1 matches always share a key with the token's own 0/1-deletes,
+        # so the larger 2-delete set is only generated when those find nothing.
+        words = self.words
+        hashes, starts, ends, ids, mask = self._hashes, self._starts, self._ends, self._ids, self._mask
+        crc = zlib.crc32
+        tried = set()
+        best = None
+        best_key = None
+        for level in range(1, limit + 1):
+            candidates = set()
+            for d in _deletes(token, level):
+                # _postings(d), inlined: this loop is the cold path's hot spot
+                h = crc(d.encode("utf-8")) or 1
+                i = h & mask
+                slot = hashes[i]
+                while slot and slot != h:
+                    i = (i + 1) & mask
+                    slot = hashes[i]
+                if slot:
+                    candidates.update(ids[starts[i]:ends[i]])
+            for wid in candidates - tried:
+                cand = words[wid]
+                dist = edit_distance(token, cand, limit)
+                if dist > limit:
+                    continue
+                key = (dist, abs(len(cand) - len(token)), wid)
+                if best_key is None or key < best_key:
+                    best, best_key = cand, key
+            if best is not None and best_key[0] <= level:
+                return best
+            tried |= candidates
+        return best
+
+    def correct_text(self, norm: str):
+        # norm is a normalized message (single spaces); unknown tokens are corrected
+        tokens = norm.split(" ")
+        changed = False
+        for i, tok in enumerate(tokens):
+            fixed = self.correct(tok)
+            if fixed is not None:
+                tokens[i] = fixed
+                changed = True
+        return " ".join(tokens) if changed else norm
@@ -0,0 +1,317 @@
+# kb.py
+
+# ======= Knowledge base: CSV source -> compiled, immutable snapshot =======
+# knowledge_base.csv has one row per intent: intent,prompt,reply where prompt is
+# a comma-separated keyword list. Replies that must be computed per request
+# (e.g. the time-of-day greeting) are registered in code and looked up by
+# intent; their CSV reply text is ignored. A row with no prompt is never
+# detected: it holds the answer to a follow-up question (see FOLLOW_UP_YES in
+# test.py), so each school words its own.
+#
+# A compiled KB can be cached as a binary snapshot (see snapshot.py) named after
+# the CSV's hash and the build settings, so workers and later restarts map the
+# same file instead of compiling their own copy. A snapshot's replies are
+# served as they are, so the cache directory must be ours alone: it is created
+# 0700, and one owned by another user or writable by others is not used.
+#
+# KnowledgeBaseStore keeps the current CompiledKB in a plain attribute. A
+# background thread watches the file and, on change, compiles a new snapshot
+# and swaps the attribute. Requests just read `store.current` once: no locks,
+# and in-flight requests finish on the snapshot they started with.
+
+import csv
+import glob
+import hashlib
+import io
+import json
+import logging
+import os
+import re
+import stat
+import threading
+import time
+
+from fuzzy import DeletionIndex
+from matcher import KeywordMatcher
+import ranker
+from ranker import IntentRanker
+from snapshot import read_snapshot, write_snapshot
+
+log = logging.getLogger(__name__)
+
+# Looser stems, tried with lower priority than the KB keywords
+STEMS = {
+    "fee": "fees", "pay": "payment", "exam": "exam_schedule", "test": "exam_schedule",
+    "time": "timings", "open": "timings", "close": "timings",
+    "bus": "transport", "transport": "transport",
+    "admit": "admission", "enroll": "admission"
+}
+
+
+# bump when compiling changes in a way the settings below don't capture
+SNAPSHOT_FORMAT = 2
+# snapshots kept per cache directory (older ones are from previous KB edits)
+SNAPSHOT_KEEP = 8
+
+
+def normalize_message(message: str):
+    # lowercase, punctuation -> spaces, whitespace collapsed
+    return " ".join(re.findall(r"\w+", message.lower()))
+
+
+class CompiledKB:
+    def __init__(self, entries, version, max_edit_distance=2, rank_threshold=0.15):
+        # entries: intent -> {"prompt": [...], "reply": str or callable}
+        self.entries = entries
+        self.version = version
+        self.rank_threshold = rank_threshold
+
+        # keyword -> intent (later intents win a shared keyword, as in a dict)
+        self.keywords = {}
+        for intent, data in entries.items():
+            for token in data["prompt"]:
+                token_norm = token.strip().lower()
+                if token_norm:
+                    self.keywords[token_norm] = intent
+        stems = {s: i for s, i in STEMS.items() if i in entries}
+        self.matcher = KeywordMatcher(list(self.keywords.items()) + list(stems.items()))
+
+        # typo fallback over the individual words of every keyword and stem
+        self.fuzzy = None
+        if max_edit_distance > 0:
+            words = [w for kw in self.matcher.keywords for w in kw.split()]
+            self.fuzzy = DeletionIndex(words, max_distance=max_edit_distance)
+
+        # last resort: TF-IDF similarity to each intent's prompts and reply
+        self.ranker = IntentRanker.from_entries(entries, normalize_message)
+
+    def save_snapshot(self, path):
+        # callable replies are stored as null and bound again on load
+        entries = {intent: {"prompt": data["prompt"],
+                            "reply": None if callable(data["reply"]) else data["reply"]}
+                   for intent, data in self.entries.items()}
+        header = {
+            "version": self.version,
+            "entries": entries,
+            "keywords": self.keywords,
+            "matcher": {"keywords": self.matcher.keywords, "intents": self.matcher.intents,
+                        "alphabet": self.matcher.alphabet},
+            "fuzzy": None if self.fuzzy is None else {
+                "words": self.fuzzy.words, "max_distance": self.fuzzy.max_distance,
+                "min_length": self.fuzzy.min_length},
+            "ranker": {"intents": self.ranker.intents},
+        }
+        arrays = {"matcher." + k: v for k, v in self.matcher.tables().items()}
+        if self.fuzzy is not None:
+            arrays.update(("fuzzy." + k, v) for k, v in self.fuzzy.tables().items())
+        arrays["ranker.idf"] = self.ranker.idf
+        arrays["ranker.weights"] = self.ranker.weights
+        write_snapshot(path, header, arrays)
+
+    @classmethod
+    def from_snapshot(cls, path, dynamic_replies=None, rank_threshold=0.15):
+        # the arrays stay in the mapped file; only the small tables become objects
+        header, arrays = read_snapshot(path)
+        dynamic_replies = dynamic_replies or {}
+        self = cls.__new__(cls)
+        self.entries = {intent: {"prompt": data["prompt"],
+                                 "reply": dynamic_replies.get(intent, data["reply"] or "")}
+                        for intent, data in header["entries"].items()}
+        self.version = header["version"]
+        self.rank_threshold = rank_threshold
+        self.keywords = header["keywords"]
+        part = lambda prefix: {k[len(prefix):]: v for k, v in arrays.items() if k.startswith(prefix)}
+        m = header["matcher"]
+        self.matcher = KeywordMatcher.from_tables(m["keywords"], m["intents"], m["alphabet"],
+                                                  part("matcher."))
+        f = header["fuzzy"]
+        self.fuzzy = f and DeletionIndex.from_tables(f["words"], part("fuzzy."), f["max_distance"],
+                                                     f["min_length"])
+        self.ranker = IntentRanker.from_arrays(header["ranker"]["intents"], arrays["ranker.idf"],
+                                               arrays["ranker.weights"])
+        return self
+
+    def _match(self, norm: str):
+        # exact keywords, then the same after typo correction; None if neither hits
+        intent = self.matcher.best(norm)
+        if intent is None and self.fuzzy is not None:
+            corrected = self.fuzzy.correct_text(norm)
+            if corrected is not norm:
+                intent = self.matcher.best(corrected)
+        return intent
+
+    def detect(self, norm: str):
+        # norm must already be normalized (see normalize_message)
+        return self._match(norm) or self._ranked([norm])[0]
+
+    def detect_batch(self, norms):
+        # Keyword stages per message; the leftovers are ranked in one product
+        out = [self._match(n) for n in norms]
+        pending = [i for i, intent in enumerate(out) if intent is None]
+        if pending:
+            for i, intent in zip(pending, self._ranked([norms[i] for i in pending])):
+                out[i] = intent
+        return out
+
+    def _ranked(self, norms):
+        # the TF-IDF fallback for messages no keyword matched
+        return [top[0][0] if top and top[0][1] >= self.rank_threshold else "default"
+                for top in self.ranker.rank_batch(norms, k=1)]
+
+    def rank(self, norm: str, k=3):
+        return self.ranker.rank(norm, k)
+
+    def reply(self, intent: str):
+        return self.entries.get(intent, self.entries["default"])["reply"]
+
+    def is_dynamic(self, intent: str):
+        return callable(self.reply(intent))
+
+
+def parse_kb_csv(text: str, dynamic_replies=None):
+    dynamic_replies = dynamic_replies or {}
+    entries = {}
+    for row in csv.DictReader(io.StringIO(text)):
+        intent = (row.get("intent") or "").strip()
+        if not intent:
+            continue
+        if intent in entries:
+            raise ValueError(f"duplicate intent {intent!r} in knowledge base")
+        prompt = [p.strip() for p in (row.get("prompt") or "").split(",") if p.strip()]
+        reply = dynamic_replies.get(intent, row.get("reply") or "")
+        entries[intent] = {"prompt": prompt, "reply": reply}
+    if "default" not in entries:
+        raise ValueError("knowledge base has no 'default' intent")
+    return entries
+
+
+def snapshot_name(version, dynamic_replies=None, max_edit_distance=2):
+    # everything besides the CSV bytes that changes what compiling produces
+    settings = json.dumps([SNAPSHOT_FORMAT, STEMS, sorted(dynamic_replies or ()), max_edit_distance,
+                           ranker.N_FEATURES, ranker.CHAR_NGRAMS, ranker.PROMPT_WEIGHT])
+    return "kb-%s-%s.snap" % (version, hashlib.sha256(settings.encode()).hexdigest()[:8])
+
+
+def private_dir(path):
+    # -> True when path is a directory (created 0700 if missing) that only this
+    # user owns and can write; anyone else could plant snapshots in it
+    try:
+        os.makedirs(path, mode=0o700, exist_ok=True)
+        st = os.lstat(path)
+    except OSError as exc:
+        log.warning("KB snapshot cache %s unusable: %s", path, exc)
+        return False
+    if not stat.S_ISDIR(st.st_mode) or st.st_uid != os.geteuid() or st.st_mode & 0o022:
+        log.warning("KB snapshot cache %s is not a directory private to this user; not using it", path)
+        return False
+    return True
+
+
+def compile_kb_file(path: str, dynamic_replies=None, max_edit_distance=2, rank_threshold=0.15,
+                    cache_dir=None):
+    with open(path, "rb") as f:
+        raw = f.read()
+    version = hashlib.sha256(raw).hexdigest()[:16]
+    snap = None
+    if cache_dir and private_dir(cache_dir):
+        snap = os.path.join(cache_dir, snapshot_name(version, dynamic_replies, max_edit_distance))
+        try:
+            return CompiledKB.from_snapshot(snap, dynamic_replies, rank_threshold)
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError, KeyError, TypeError) as exc:
+            log.warning("ignoring unreadable KB snapshot %s: %s", snap, exc)
+
+    entries = parse_kb_csv(raw.decode("utf-8-sig"), dynamic_replies)
+    kb = CompiledKB(entries, version, max_edit_distance, rank_threshold)
+    if snap:
+        try:
+            kb.save_snapshot(snap)
+            prune_snapshots(cache_dir)
+            # map what was just written, so this process shares the pages too
+            # instead of keeping its private copy of the arrays
+            return CompiledKB.from_snapshot(snap, dynamic_replies, rank_threshold)
+        except OSError as exc:
+            log.warning("could not write KB snapshot %s: %s", snap, exc)
+    return kb
+
+
+def prune_snapshots(cache_dir, keep=SNAPSHOT_KEEP):
+    # Unlinking is safe for processes still mapping an old file
+    paths = sorted(glob.glob(os.path.join(cache_dir, "kb-*.snap")), key=os.path.getmtime)
+    for old in paths[:-keep]:
+        try:
+            os.remove(old)
+        except OSError:
+            pass
+
+
+class KnowledgeBaseStore:
+    def __init__(self, path: str, dynamic_replies=None, poll_interval=2.0,
+                 max_edit_distance=2, rank_threshold=0.15, cache_dir=None):
+        self.path = path
+        self.cache_dir = cache_dir
+        self.dynamic_replies = dynamic_replies or {}
+        self.poll_interval = poll_interval
+        self.max_edit_distance = max_edit_distance
+        self.rank_threshold = rank_threshold
+        self._listeners = []
+        self._stamp = self._stat()
+        # startup compile is synchronous: a broken file should fail loudly
+        self.current = self._compile()
+        self._thread = None
+
+    def _compile(self):
+        return compile_kb_file(self.path, self.dynamic_replies, self.max_edit_distance,
+                               self.rank_threshold, self.cache_dir)
+
+    def _stat(self):
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return None
+        return (st.st_mtime_ns, st.st_size)
+
+    def on_swap(self, fn):
+        # fn(old, new) is called from the watcher thread after each swap
+        self._listeners.append(fn)
+
+    def check(self):
+        # Rebuild if the file changed; returns True when a new KB was swapped in
+        stamp = self._stat()
+        if stamp is None or stamp == self._stamp:
+            return False
+        self._stamp = stamp
+        try:
+            new = self._compile()
+        except (OSError, ValueError, csv.Error, UnicodeDecodeError) as exc:
+            log.warning("knowledge base reload failed, keeping version %s: %s",
+                        self.current.version, exc)
+            return False
+        old = self.current
+        if new.version == old.version:
+            return False
+        self.current = new
+        log.info("knowledge base reloaded: %s -> %s", old.version, new.version)
+        for fn in self._listeners:
+            fn(old, new)
+        return True
+
+    def _watch(self):
+        while True:
+            time.sleep(self.poll_interval)
+            try:
+                self.check()
+            except Exception:
+                log.exception("knowledge base watcher error")
+
+    def start_watcher(self):
+        if self.poll_interval <= 0:
+            return
+        self._spawn_watcher()
+        # threads don't survive fork (gunicorn --preload): restart in each worker
+        os.register_at_fork(after_in_child=self._spawn_watcher)
+
+    def _spawn_watcher(self):
+        self._thread = threading.Thread(target=self._watch, name="kb-watcher", daemon=True)
+        self._thread.start()
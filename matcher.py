@@ -0,0 +1,156 @@
+# matcher.py
+
+# ======= Multi-pattern keyword matcher (Aho-Corasick) =======
+# Compiled once from the (keyword, intent) table. A message is scanned a single
+# time, left to right, no matter how many keywords the KB has.
+#
+# Ties are settled in a fixed order: the longest keyword wins, and between
+# keywords of equal length the one listed first (higher priority) wins. So
+# "payment history" beats "payment" and "history" regardless of dict order.
+#
+# The automaton is kept as flat int arrays (every transition resolved ahead of
+# time), so a compiled matcher can be written to a KB snapshot and used
+# straight from a memory-mapped file (see snapshot.py).
+
+from array import array
+
+
+class KeywordMatcher:
+    def __init__(self, patterns):
+        # patterns: iterable of (keyword, intent), highest priority first.
+        # A keyword listed twice keeps its first position and its last intent,
+        # the same way a plain dict assignment would.
+        table = {}
+        for kw, intent in patterns:
+            kw = kw.strip().lower()
+            if kw:
+                table[kw] = intent
+        self.keywords = list(table)
+        self.intents = [table[kw] for kw in self.keywords]
+
+        goto = [{}]
+        out = [-1]  # pattern index ending exactly at this state
+        for idx, kw in enumerate(self.keywords):
+            state = 0
+            for ch in kw:
+                nxt = goto[state].get(ch)
+                if nxt is None:
+                    nxt = len(goto)
+                    goto[state][ch] = nxt
+                    goto.append({})
+                    out.append(-1)
+                state = nxt
+            out[state] = idx
+
+        # Rank = (length, priority) folded into one int so the scan compares once.
+        n = len(self.keywords)
+        rank = [len(kw) * (n + 1) + (n - i) for i, kw in enumerate(self.keywords)]
+
+        fail = [0] * len(goto)
+        link = [-1] * len(goto)   # next state on the suffix chain that ends a keyword
+        best = [-1] * len(goto)   # best pattern ending at this state or any suffix of it
+        queue = []
+        for nxt in goto[0].values():
+            queue.append(nxt)
+        for s in queue:
+            best[s] = out[s]
+        head = 0
+        while head < len(queue):
+            state = queue[head]
+            head += 1
+            for ch, nxt in goto[state].items():
+                f = fail[state]
+                while f and ch not in goto[f]:
+                    f = fail[f]
+                f = goto[f].get(ch, 0)
+                fail[nxt] = f
+                link[nxt] = f if out[f] >= 0 else link[f]
+                own, inherited = out[nxt], best[f]
+                if own < 0 or (inherited >= 0 and rank[inherited] > rank[own]):
+                    best[nxt] = inherited
+                else:
+                    best[nxt] = own
+                queue.append(nxt)
+
+        # Dense transition table, one row per state: [best pattern, next state
+        # on any character no keyword uses, next state on each keyword
+        # character...]. Next states are stored as row offsets, so the scan does
+        # no multiplication. Filled in BFS order: a state starts as a copy of its
+        # (shallower, already finished) fail state's row, then gets its own edges.
+        alphabet = sorted({ch for kw in self.keywords for ch in kw})
+        width = len(alphabet) + 2
+        column = {ch: col for col, ch in enumerate(alphabet, 2)}
+        table = array("i", bytes(4 * width * len(goto)))
+        for state in [0] + queue:
+            row = state * width
+            if state:
+                frow = fail[state] * width
+                table[row:row + width] = table[frow:frow + width]
+            table[row] = best[state]
+            for ch, nxt in goto[state].items():
+                table[row + column[ch]] = nxt * width
+
+        self._set_tables("".join(alphabet), table, array("i", out), array("i", link), array("i", rank))
+
+    def _set_tables(self, alphabet, table, out, link, rank):
+        self.alphabet = alphabet
+        self._width = len(alphabet) + 2
+        # message character -> table column, as one str.translate() + encode()
+        self._columns = _Columns({ord(ch): chr(col) for col, ch in enumerate(alphabet, 2)})
+        self._table = table
+        self._out = out
+        self._link = link
+        self._rank = rank
+
+    def tables(self):
+        # int arrays that, with keywords/intents/alphabet, rebuild the matcher
+        return {"table": self._table, "out": self._out, "link": self._link, "rank": self._rank}
+
+    @classmethod
+    def from_tables(cls, keywords, intents, alphabet, tables):
+        # tables: name -> int sequence, e.g. memoryviews over a snapshot file
+        self = cls.__new__(cls)
+        self.keywords = list(keywords)
+        self.intents = list(intents)
+        self._set_tables(alphabet, tables["table"], tables["out"], tables["link"], tables["rank"])
+        return self
+
+    def __len__(self):
+        return len(self.keywords)
+
+    def _columns_of(self, text: str):
+        cols = text.translate(self._columns)
+        # one byte per column while the alphabet fits (the usual case)
+        return cols.encode("latin-1") if self._width <= 256 else map(ord, cols)
+
+    def best(self, text: str):
+        # Single pass; returns the winning intent or None.
+        table, rank = self._table, self._rank
+        state = 0
+        top = -1
+        top_rank = -1
+        for col in self._columns_of(text):
+            state = table[state + col]
+            b = table[state]
+            if b >= 0 and rank[b] > top_rank:
+                top, top_rank = b, rank[b]
+        return self.intents[top] if top >= 0 else None
+
+    def find_all(self, text: str):
+        # Every keyword hit as (end_offset, keyword, intent), in scan order.
+        table, width, out, link = self._table, self._width, self._out, self._link
+        state = 0
+        for pos, col in enumerate(self._columns_of(text)):
+            state = table[state + col]
+            s = state // width
+            s = s if out[s] >= 0 else link[s]
+            while s > 0:
+                idx = out[s]
+                yield pos + 1, self.keywords[idx], self.intents[idx]
+                s = link[s]
+
+
+class _Columns(dict):
+    # str.translate() table: characters no keyword uses all become column 1
+    def __missing__(self, key):
+        return "\x01"
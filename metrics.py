@@ -0,0 +1,284 @@
+# metrics.py
+
+# ======= Low-overhead counters + fixed-bucket histograms, Prometheus output =======
+# Recording is a dict update and a bisect under one uncontended lock. Each
+# worker keeps its own Registry; when METRICS_DIR is set, a background thread
+# writes the worker's snapshot to METRICS_DIR/<pid>-<start>.json every
+# `flush_interval` seconds and /metrics on any worker merges all the files, so
+# totals stay correct across gunicorn workers (including ones that exited).
+# A file whose worker has exited is folded into METRICS_DIR/retired.json by the
+# next /metrics, so the directory holds one file per live worker plus one.
+
+from bisect import bisect_left
+import fcntl
+import glob
+import json
+import logging
+import os
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+# seconds; tuned for a handler that normally takes tens of microseconds
+DEFAULT_BUCKETS = (
+    0.000005, 0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005,
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5,
+)
+
+# metric name -> (type, help)
+METRICS = {
+    "chatbot_requests_total": ("counter", "HTTP requests by route and status."),
+    "chatbot_request_duration_seconds": ("histogram", "Time spent in the request handler, by route."),
+    "chatbot_stage_duration_seconds": ("histogram", "Time spent in each /chat stage."),
+    "chatbot_intent_total": ("counter", "Replies sent, by detected intent."),
+    "chatbot_response_cache_hits_total": ("counter", "/chat response cache hits."),
+    "chatbot_response_cache_misses_total": ("counter", "/chat response cache misses."),
+    "chatbot_query_log_records_total": ("counter", "/chat questions buffered for the query log."),
+    "chatbot_query_log_dropped_total": ("counter", "Query log records dropped because the buffer was full."),
+    "chatbot_admission_rejected_total": ("counter", "Requests turned away by admission control, by reason."),
+    "chatbot_tenant_loads_total": ("counter", "Tenants compiled on first use or after eviction."),
+    "chatbot_tenant_evictions_total": ("counter", "Tenants dropped from memory to stay within the tenant cache."),
+    "chatbot_tenant_expirations_total": ("counter", "Tenants dropped from memory after TENANT_IDLE_TTL unused."),
+}
+
+
+class Registry:
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        # bucket bounds in integer nanoseconds so observe() never touches floats
+        self.bounds_ns = [int(b * 1e9) for b in buckets]
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self.counters = {}    # (name, labels) -> int
+        self.histograms = {}  # (name, labels) -> [bucket counts..., +Inf count, sum_ns]
+        self._collectors = []
+        self._keys = {}
+
+    def inc(self, name, labels=(), value=1):
+        key = (name, labels)
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def _observe(self, key, ns):
+        h = self.histograms.get(key)
+        if h is None:
+            h = self.histograms[key] = [0] * (len(self.bounds_ns) + 2)
+        h[bisect_left(self.bounds_ns, ns)] += 1
+        h[-1] += ns
+
+    def observe_ns(self, name, labels, ns):
+        with self._lock:
+            self._observe((name, labels), ns)
+
+    def record_request(self, route, status, duration_ns, intent=None, stages=()):
+        # everything one request produces, under a single lock acquisition;
+        # label tuples are built once per distinct value and reused
+        keys = self._keys
+        rk = keys.get((route, status))
+        if rk is None:
+            rk = keys[(route, status)] = (
+                ("chatbot_requests_total", (("route", route), ("status", str(status)))),
+                ("chatbot_request_duration_seconds", (("route", route),)),
+            )
+        bounds = self.bounds_ns
+        counters = self.counters
+        with self._lock:
+            counters[rk[0]] = counters.get(rk[0], 0) + 1
+            self._observe(rk[1], duration_ns)
+            if intent is not None:
+                ik = keys.get(("intent", intent))
+                if ik is None:
+                    ik = keys[("intent", intent)] = ("chatbot_intent_total", (("intent", intent),))
+                counters[ik] = counters.get(ik, 0) + 1
+            hists = self.histograms
+            for stage, ns in stages:
+                sk = keys.get(("stage", stage))
+                if sk is None:
+                    sk = keys[("stage", stage)] = ("chatbot_stage_duration_seconds", (("stage", stage),))
+                h = hists.get(sk)
+                if h is None:
+                    h = hists[sk] = [0] * (len(bounds) + 2)
+                h[bisect_left(bounds, ns)] += 1
+                h[-1] += ns
+
+    def add_collector(self, fn):
+        # fn() -> {(name, labels): value}; sampled into every snapshot
+        self._collectors.append(fn)
+
+    def reset(self):
+        with self._lock:
+            self.counters.clear()
+            self.histograms.clear()
+
+    def snapshot(self):
+        with self._lock:
+            counters = dict(self.counters)
+            histograms = {k: list(v) for k, v in self.histograms.items()}
+        for fn in self._collectors:
+            counters.update(fn())
+        return as_snapshot(counters, histograms)
+
+
+def merge(snapshots):
+    counters = {}
+    histograms = {}
+    for snap in snapshots:
+        for name, labels, value in snap.get("counters", ()):
+            key = (name, tuple(map(tuple, labels)))
+            counters[key] = counters.get(key, 0) + value
+        for name, labels, values in snap.get("histograms", ()):
+            key = (name, tuple(map(tuple, labels)))
+            cur = histograms.get(key)
+            histograms[key] = list(values) if cur is None else [a + b for a, b in zip(cur, values)]
+    return counters, histograms
+
+
+def as_snapshot(counters, histograms):
+    # {(name, labels): value} dicts -> the file format
+    return {
+        "counters": [[n, list(map(list, l)), v] for (n, l), v in counters.items()],
+        "histograms": [[n, list(map(list, l)), v] for (n, l), v in histograms.items()],
+    }
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _labels(labels, extra=()):
+    parts = ['%s="%s"' % (k, str(v).replace("\\", "\\\\").replace('"', '\\"'))
+             for k, v in tuple(labels) + tuple(extra)]
+    return "{%s}" % ",".join(parts) if parts else ""
+
+
+def render(counters, histograms, buckets=DEFAULT_BUCKETS):
+    by_name = {}
+    for (name, labels), value in counters.items():
+        by_name.setdefault(name, []).append(("counter", labels, value))
+    for (name, labels), values in histograms.items():
+        by_name.setdefault(name, []).append(("histogram", labels, values))
+
+    lines = []
+    for name in sorted(by_name):
+        kind, help_text = METRICS.get(name, (by_name[name][0][0], ""))
+        lines.append("# HELP %s %s" % (name, help_text))
+        lines.append("# TYPE %s %s" % (name, kind))
+        for kind, labels, value in sorted(by_name[name], key=lambda r: r[1]):
+            if kind == "counter":
+                lines.append("%s%s %d" % (name, _labels(labels), value))
+                continue
+            cumulative = 0
+            for bound, count in zip(buckets, value):
+                cumulative += count
+                lines.append("%s_bucket%s %d" % (name, _labels(labels, (("le", repr(bound)),)), cumulative))
+            cumulative += value[len(buckets)]
+            lines.append("%s_bucket%s %d" % (name, _labels(labels, (("le", "+Inf"),)), cumulative))
+            lines.append("%s_sum%s %.9f" % (name, _labels(labels), value[-1] / 1e9))
+            lines.append("%s_count%s %d" % (name, _labels(labels), cumulative))
+    return "\n".join(lines) + "\n"
+
+
+class Exporter:
+    def __init__(self, registry, directory=None, flush_interval=1.0):
+        self.registry = registry
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self._new_identity()
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+            self._spawn_flusher()
+            # each forked worker starts from zero under its own file
+            os.register_at_fork(after_in_child=self._after_fork)
+
+    def _new_identity(self):
+        self.filename = None
+        if self.directory:
+            self.filename = os.path.join(
+                self.directory, "%d-%d.json" % (os.getpid(), time.time_ns()))
+
+    def _after_fork(self):
+        self.registry.reset()
+        self._new_identity()
+        self._spawn_flusher()
+
+    def _spawn_flusher(self):
+        threading.Thread(target=self._flush_loop, name="metrics-flush", daemon=True).start()
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(self.flush_interval)
+            try:
+                self.flush()
+            except Exception:
+                log.exception("metrics flush failed")
+
+    def flush(self):
+        if not self.filename:
+            return
+        tmp = self.filename + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(self.registry.snapshot(), f, separators=(",", ":"))
+        os.replace(tmp, self.filename)
+
+    def retire_exited(self):
+        # Fold the files of workers that are gone into retired.json and delete
+        # them. Workers scrape concurrently, so this runs under a lock file.
+        exited = []
+        for path in glob.glob(os.path.join(self.directory, "*-*.json")):
+            pid = os.path.basename(path).split("-", 1)[0]
+            if pid.isdigit() and int(pid) != os.getpid() and not _pid_alive(int(pid)):
+                exited.append(path)
+        if not exited:
+            return
+        retired = os.path.join(self.directory, "retired.json")
+        with open(os.path.join(self.directory, "retired.lock"), "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            snapshots = []
+            try:
+                with open(retired) as f:
+                    snapshots.append(json.load(f))
+            except FileNotFoundError:
+                pass
+            folded = []
+            for path in exited:
+                try:
+                    with open(path) as f:
+                        snapshots.append(json.load(f))
+                    folded.append(path)
+                except FileNotFoundError:
+                    continue  # another worker folded it first
+                except ValueError:
+                    folded.append(path)  # cut short by the worker's death: nothing to keep
+            if not folded:
+                return
+            tmp = retired + ".%d.tmp" % os.getpid()
+            with open(tmp, "w") as f:
+                json.dump(as_snapshot(*merge(snapshots)), f, separators=(",", ":"))
+            # a crash between these loses the folded numbers rather than counting them twice
+            for path in folded:
+                os.remove(path)
+            os.replace(tmp, retired)
+
+    def collect(self):
+        # own live numbers + every other worker's last flushed snapshot
+        snapshots = [self.registry.snapshot()]
+        if self.directory:
+            try:
+                self.retire_exited()
+            except OSError as exc:
+                log.warning("could not fold exited workers' metrics: %s", exc)
+            for path in glob.glob(os.path.join(self.directory, "*.json")):
+                if path == self.filename:
+                    continue
+                try:
+                    with open(path) as f:
+                        snapshots.append(json.load(f))
+                except (OSError, ValueError):
+                    continue  # being replaced right now; next scrape picks it up
+        return render(*merge(snapshots), buckets=self.registry.buckets)
@@ -0,0 +1,223 @@
+# profiling.py
+
+# ======= On-demand profiling of single requests =======
+# A request is profiled when it carries the admin token in X-Profile, or when
+# it is the Nth since the last sampled one (sample_every). Everything else pays
+# one header lookup and one counter step.
+#
+# The profiled request runs under a sys.setprofile hook that records every
+# Python and C call on that thread only, so concurrent requests are neither
+# slowed nor mixed in. From that one run two files are written:
+#
+#   <id>.collapsed   "root;caller;callee <µs>" lines, self time per call stack,
+#                    for flamegraph.pl or speedscope
+#   <id>.pstats      the usual cProfile/pstats data (python -m pstats, snakeviz)
+#
+# The hook costs around a microsecond per call, so a profiled request runs a
+# few times slower than usual; compare stacks within a profile, not its total
+# against the latency histograms. Only the newest `keep` profiles are kept.
+
+import hmac
+import itertools
+import logging
+import marshal
+import operator
+import os
+import re
+import sys
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+PROFILE_HEADER = "X-Profile"
+PROFILE_ID_HEADER = "X-Profile-Id"
+_NAME = re.compile(r"\d+-[A-Z]+-[\w.-]*\.(?:collapsed|pstats)")
+# "Class.method" on Python 3.11+, the bare function name before that
+_qualname = operator.attrgetter("co_qualname" if sys.version_info >= (3, 11) else "co_name")
+
+
+def token_matches(value, expected):
+    # constant-time; compare_digest raises TypeError on non-ASCII str, so compare
+    # bytes (surrogatepass encodes any str a header can decode to)
+    return hmac.compare_digest(value.encode("utf-8", "surrogatepass"),
+                               expected.encode("utf-8", "surrogatepass"))
+
+
+class CallRecorder:
+    # sys.setprofile hook building exact per-stack self times and pstats rows
+    def __init__(self, root, clock=time.perf_counter_ns):
+        self.clock = clock
+        self.root = root
+        self.stacks = {}     # "root;a;b" -> self ns
+        self.stats = {}      # func key -> [primitive calls, calls, self ns, cumulative ns, callers]
+        self._stack = []     # [key, path, start ns, child ns]
+        self._active = {}    # func key -> frames of it open right now (recursion)
+
+    def _push(self, key, label, now):
+        parent = self._stack[-1][1] if self._stack else self.root
+        self._stack.append([key, parent + ";" + label, now, 0])
+        self._active[key] = self._active.get(key, 0) + 1
+
+    def _pop(self, now):
+        key, path, start, child = self._stack.pop()
+        elapsed = now - start
+        own = elapsed - child
+        if self._stack:
+            self._stack[-1][3] += elapsed
+        self.stacks[path] = self.stacks.get(path, 0) + own
+
+        depth = self._active[key] - 1
+        self._active[key] = depth
+        outer = depth == 0  # cumulative time counts the outermost call of a recursion only
+        row = self.stats.get(key)
+        if row is None:
+            row = self.stats[key] = [0, 0, 0, 0, {}]
+        row[0] += outer
+        row[1] += 1
+        row[2] += own
+        row[3] += elapsed if outer else 0
+        caller = self._stack[-1][0] if self._stack else ("~", 0, self.root)
+        c = row[4].get(caller)
+        if c is None:
+            c = row[4][caller] = [0, 0, 0, 0]
+        c[0] += outer
+        c[1] += 1
+        c[2] += own
+        c[3] += elapsed if outer else 0
+
+    def __call__(self, frame, event, arg):
+        now = self.clock()
+        if event == "call":
+            code = frame.f_code
+            key = (code.co_filename, code.co_firstlineno, code.co_name)
+            self._push(key, "%s:%s" % (os.path.basename(code.co_filename), _qualname(code)), now)
+        elif event == "c_call":
+            key = ("~", 0, _c_name(arg))
+            self._push(key, key[2], now)
+        elif self._stack:  # return, c_return, c_exception; unmatched ones predate the hook
+            self._pop(now)
+
+    def run(self, fn, *args):
+        sys.setprofile(self)
+        try:
+            return fn(*args)
+        finally:
+            sys.setprofile(None)
+            # frames still open (setprofile itself, a stream's generator) are left out
+            self._stack.clear()
+
+    def collapsed(self):
+        # microseconds; stacks under 1 µs are rounded up so nothing disappears
+        return "".join("%s %d\n" % (path, max(1, ns // 1000))
+                       for path, ns in sorted(self.stacks.items()))
+
+    def pstats(self):
+        # the dict pstats.Stats loads: func -> (cc, nc, tt, ct, {caller: (cc, nc, tt, ct)})
+        s = lambda ns: ns / 1e9
+        return {key: (cc, nc, s(tt), s(ct), {k: (a, b, s(c), s(d)) for k, (a, b, c, d) in callers.items()})
+                for key, (cc, nc, tt, ct, callers) in self.stats.items()}
+
+
+def _c_name(fn):
+    # the names cProfile gives builtins
+    owner = getattr(fn, "__self__", None)
+    if owner is not None and not isinstance(owner, type(sys)):
+        return "<method '%s' of '%s' objects>" % (fn.__name__, type(owner).__name__)
+    module = getattr(fn, "__module__", None)
+    if module:
+        return "<built-in method %s.%s>" % (module, fn.__name__)
+    return "<built-in method %s>" % getattr(fn, "__name__", repr(fn))
+
+
+class Profiler:
+    def __init__(self, directory, token=None, sample_every=0, keep=50):
+        self.directory = directory
+        self.token = token
+        self.sample_every = sample_every
+        self.keep = keep
+        self._counter = itertools.count(1)
+        self._write_lock = threading.Lock()
+        self.profiled = 0
+
+    def wanted(self, header):
+        # header: the request's X-Profile value, or None
+        if header is not None and self.token and token_matches(header, self.token):
+            return True
+        return self.sample_every > 0 and next(self._counter) % self.sample_every == 0
+
+    def run(self, method, path, fn, *args):
+        # -> (fn's result, profile id or None if it couldn't be written)
+        recorder = CallRecorder("%s %s" % (method, path))
+        started = time.perf_counter_ns()
+        result = recorder.run(fn, *args)
+        elapsed_ms = (time.perf_counter_ns() - started) / 1e6
+        try:
+            name = self._save(recorder, method, path, elapsed_ms)
+        except OSError as exc:
+            log.warning("could not write profile for %s %s: %s", method, path, exc)
+            name = None
+        return result, name
+
+    def _save(self, recorder, method, path, elapsed_ms):
+        slug = re.sub(r"[^\w.-]+", "_", path.strip("/"))[:40] or "root"
+        name = "%d-%s-%s-%dms" % (time.time_ns(), method, slug, elapsed_ms)
+        base = os.path.join(self.directory, name)
+        with self._write_lock:
+            os.makedirs(self.directory, exist_ok=True)
+            with open(base + ".collapsed", "w", encoding="utf-8") as f:
+                f.write(recorder.collapsed())
+            with open(base + ".pstats", "wb") as f:
+                marshal.dump(recorder.pstats(), f)
+            self.profiled += 1
+            self._prune()
+        return name
+
+    def _prune(self):
+        for name in self.list()[self.keep:]:
+            for ext in (".collapsed", ".pstats"):
+                try:
+                    os.remove(os.path.join(self.directory, name + ext))
+                except OSError:
+                    pass
+
+    def list(self):
+        # profile ids, newest first
+        try:
+            files = os.listdir(self.directory)
+        except OSError:
+            return []
+        names = {f.rsplit(".", 1)[0] for f in files if _NAME.fullmatch(f)}
+        return sorted(names, key=lambda n: int(n.split("-", 1)[0]), reverse=True)
+
+    def path(self, filename):
+        # filesystem path of one profile file, or None if the name isn't one of ours
+        if not _NAME.fullmatch(filename):
+            return None
+        path = os.path.join(self.directory, filename)
+        return path if os.path.isfile(path) else None
+
+
+class ProfilingMiddleware:
+    # WSGI: runs the app under the profiler for the requests Profiler.wanted() picks
+    def __init__(self, app, profiler):
+        self.app = app
+        self.profiler = profiler
+
+    def __call__(self, environ, start_response):
+        if not self.profiler.wanted(environ.get("HTTP_X_PROFILE")):
+            return self.app(environ, start_response)
+        held = []
+
+        def hold(status, headers, exc_info=None):
+            # headers go out once the profile id is known (Flask never uses write())
+            held[:] = [status, headers, exc_info]
+            return lambda data: None
+
+        body, name = self.profiler.run(environ.get("REQUEST_METHOD", "GET"), environ.get("PATH_INFO", "/"),
+                                       self.app, environ, hold)
+        status, headers, exc_info = held
+        if name:
+            headers = list(headers) + [(PROFILE_ID_HEADER, name)]
+        start_response(status, headers, exc_info)
+        return body
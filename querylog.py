@@ -0,0 +1,246 @@
+# querylog.py
+
+# ======= Query log: what parents asked, for offline KB gap analysis =======
+# Each answered message becomes one (timestamp, normalized message, intent,
+# latency) record. record() only appends a tuple to an in-memory buffer under an
+# uncontended lock; it never touches the disk. A background thread takes the
+# whole buffer every `flush_interval` seconds (or as soon as `batch` records are
+# waiting) and appends it to the current segment as one gzip member of JSON
+# lines. When the buffer already holds `capacity` records the new one is dropped
+# and counted, so a stalled disk costs log lines, never request latency.
+#
+# Segments are DIR/queries-<start ns>-<pid>.jsonl.gz, rotated at `segment_bytes`
+# or `segment_seconds`; the oldest are deleted beyond `keep`. Each worker writes
+# its own segments, so there is no locking between processes.
+#
+# Ranking the unmatched phrasings (intent "default"):
+#
+#   python querylog.py /var/log/chatbot/queries --top 30
+
+import argparse
+import atexit
+from collections import Counter
+import glob
+import gzip
+import json
+import logging
+import os
+import threading
+import time
+import zlib
+
+log = logging.getLogger(__name__)
+
+UNMATCHED = "default"
+
+# left out of the unknown-word ranking
+STOP_WORDS = frozenset("""
+a about am an and any are can do does for from have how i in is it me my of on or
+please school the there to what when where which who why will with you your
+""".split())
+
+
+class QueryLog:
+    def __init__(self, directory, capacity=65536, batch=4096, flush_interval=1.0,
+                 segment_bytes=16 * 1024 * 1024, segment_seconds=3600, keep=168):
+        self.directory = directory
+        self.capacity = capacity
+        self.batch = batch
+        self.flush_interval = flush_interval
+        self.segment_bytes = segment_bytes
+        self.segment_seconds = segment_seconds
+        self.keep = keep
+
+        self._lock = threading.Lock()
+        self._buffer = []
+        self._wake = threading.Event()
+        self._write_lock = threading.Lock()  # the flusher vs an atexit flush
+        self.recorded = 0
+        self.dropped = 0
+        self.written = 0
+        self.failed = 0
+        self._new_segment()
+        os.makedirs(directory, exist_ok=True)
+        self._spawn_flusher()
+        # each forked worker starts with an empty buffer and its own segments
+        os.register_at_fork(after_in_child=self._after_fork)
+        atexit.register(self.flush)
+
+    def record(self, message, intent, latency_ns):
+        entry = (time.time(), message, intent, latency_ns // 1000)
+        with self._lock:
+            buffer = self._buffer
+            if len(buffer) >= self.capacity:
+                self.dropped += 1
+                return
+            buffer.append(entry)
+            self.recorded += 1
+            if len(buffer) == self.batch:
+                self._wake.set()
+
+    def _new_segment(self):
+        self.segment = None
+        self.segment_started = 0.0
+
+    def _after_fork(self):
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._buffer = []
+        self._wake = threading.Event()
+        self.recorded = self.dropped = self.written = self.failed = 0
+        self._new_segment()
+        self._spawn_flusher()
+
+    def _spawn_flusher(self):
+        threading.Thread(target=self._flush_loop, name="querylog-flush", daemon=True).start()
+
+    def _flush_loop(self):
+        while True:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception:
+                log.exception("query log flush failed")
+
+    def flush(self):
+        with self._lock:
+            entries, self._buffer = self._buffer, []
+        if not entries:
+            return
+        lines = "".join(json.dumps(e, ensure_ascii=False, separators=(",", ":")) + "\n"
+                        for e in entries)
+        with self._write_lock:
+            try:
+                path = self._segment_for_write()
+                # one complete gzip member per batch: a crash loses at most the
+                # batch being written, and readers can stop at a torn tail
+                with open(path, "ab") as f:
+                    f.write(gzip.compress(lines.encode("utf-8"), compresslevel=6))
+            except OSError:
+                self.failed += len(entries)
+                raise
+            self.written += len(entries)
+
+    def _segment_for_write(self):
+        now = time.time()
+        path = self.segment
+        if path is not None:
+            try:
+                size = os.path.getsize(path)
+            except OSError:
+                size = 0  # removed under us: start a new one
+                path = None
+            if size >= self.segment_bytes or now - self.segment_started >= self.segment_seconds:
+                path = None
+        if path is None:
+            path = self.segment = os.path.join(
+                self.directory, "queries-%d-%d.jsonl.gz" % (time.time_ns(), os.getpid()))
+            self.segment_started = now
+            self._prune()
+        return path
+
+    def _prune(self):
+        # every worker prunes the shared directory; losing a race is harmless
+        for path in segments(self.directory)[:-self.keep or None]:
+            if path == self.segment:
+                continue
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def stats(self):
+        return {
+            "recorded": self.recorded,
+            "dropped": self.dropped,
+            "written": self.written,
+            "failed": self.failed,
+            "buffered": len(self._buffer),
+            "segment": self.segment and os.path.basename(self.segment),
+        }
+
+
+def segments(directory):
+    # oldest first (names start with the creation time)
+    return sorted(glob.glob(os.path.join(directory, "queries-*.jsonl.gz")),
+                  key=lambda p: int(os.path.basename(p).split("-")[1]))
+
+
+# ======= Offline analysis =======
+
+def read_records(paths, since=None):
+    # -> (timestamp, message, intent, latency µs) from each segment in turn,
+    # streamed; stops quietly at a segment's torn tail (a write cut short)
+    for path in paths:
+        try:
+            with gzip.open(path, "rt", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        ts, message, intent, latency_us = json.loads(line)
+                    except ValueError:
+                        continue
+                    if since is None or ts >= since:
+                        yield ts, message, intent, latency_us
+        except (OSError, EOFError, zlib.error) as exc:
+            log.warning("stopped reading %s: %s", path, exc)
+
+
+def analyze(records, top=30, known_words=()):
+    # -> report dict: totals, the most frequent unmatched phrasings, and the
+    # words in them the KB doesn't know yet (keyword candidates)
+    total = 0
+    by_intent = Counter()
+    phrasings = Counter()
+    words = Counter()
+    known_words = STOP_WORDS | set(known_words)
+    for _, message, intent, _ in records:
+        total += 1
+        by_intent[intent] += 1
+        if intent == UNMATCHED and message:
+            phrasings[message] += 1
+            words.update(w for w in set(message.split()) if w not in known_words)
+    unmatched = by_intent[UNMATCHED]
+    return {
+        "total": total,
+        "unmatched": unmatched,
+        "by_intent": by_intent.most_common(),
+        "phrasings": phrasings.most_common(top),
+        "words": words.most_common(top),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="rank the most frequent unmatched questions in a query log")
+    parser.add_argument("directory", help="QUERY_LOG_DIR of the deployment")
+    parser.add_argument("--top", type=int, default=30)
+    parser.add_argument("--hours", type=float, help="only the last N hours")
+    parser.add_argument("--kb", help="knowledge_base.csv, to leave out words it already knows")
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    args = parser.parse_args(argv)
+
+    known = ()
+    if args.kb:
+        from kb import normalize_message, parse_kb_csv
+        with open(args.kb, encoding="utf-8") as f:
+            entries = parse_kb_csv(f.read())
+        known = {w for e in entries.values() for p in e["prompt"] for w in normalize_message(p).split()}
+    since = time.time() - args.hours * 3600 if args.hours else None
+    report = analyze(read_records(segments(args.directory), since), args.top, known)
+    if args.json:
+        print(json.dumps(report, indent=2, ensure_ascii=False))
+        return
+
+    total = report["total"] or 1
+    print("%d queries, %d unmatched (%.1f%%)" % (
+        report["total"], report["unmatched"], 100.0 * report["unmatched"] / total))
+    print("\n%7s %6s  unmatched phrasing" % ("count", "%"))
+    for message, count in report["phrasings"]:
+        print("%7d %6.2f  %s" % (count, 100.0 * count / total, message))
+    print("\n%7s  unknown word in unmatched queries" % "count")
+    for word, count in report["words"]:
+        print("%7d  %s" % (count, word))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+# ranker.py
+
+# ======= TF-IDF intent ranker over hashed word + character n-grams =======
+# Each intent's prompts and reply text become one TF-IDF vector in a fixed,
+# hashed feature space (no vocabulary to ship, no model to download). Messages
+# are hashed the same way into a sparse CSR batch, and one gather + segment sum
+# scores every message against every intent at once. Scores are cosine
+# similarities in [0, 1].
+
+import zlib
+
+import numpy as np
+
+N_FEATURES = 1 << 14
+CHAR_NGRAMS = (3, 4)
+# prompts describe the intent better than free reply prose
+PROMPT_WEIGHT = 2.0
+
+
+def hashed_features(norm: str, n_features=N_FEATURES):
+    # -> {feature index: count} for a normalized message
+    feats = {}
+    mask = n_features - 1
+    crc = zlib.crc32
+    words = norm.split()
+    grams = ["w:" + w for w in words]
+    grams += ["b:%s %s" % pair for pair in zip(words, words[1:])]
+    for w in words:
+        padded = "<%s>" % w
+        for n in CHAR_NGRAMS:
+            grams += ["c:" + padded[i:i + n] for i in range(len(padded) - n + 1)]
+    for g in grams:
+        h = crc(g.encode()) & mask
+        feats[h] = feats.get(h, 0) + 1
+    return feats
+
+
+class IntentRanker:
+    def __init__(self, docs, n_features=N_FEATURES):
+        # docs: intent -> [(normalized text, weight), ...]
+        self.intents = list(docs)
+        self.n_features = n_features
+        tf = np.zeros((n_features, len(self.intents)), dtype=np.float32)
+        for col, intent in enumerate(self.intents):
+            for text, weight in docs[intent]:
+                for h, count in hashed_features(text, n_features).items():
+                    tf[h, col] += weight * count
+        df = np.count_nonzero(tf, axis=1)
+        idf = np.log((1 + len(self.intents)) / (1 + df)).astype(np.float32) + 1
+        weights = np.log1p(tf) * idf[:, None]
+        norms = np.linalg.norm(weights, axis=0)
+        norms[norms == 0] = 1
+        self._setup(np.ascontiguousarray(weights / norms, dtype=np.float32), idf)
+
+    def _setup(self, weights, idf):
+        self.idf = idf
+        # (n_features, n_intents): row h holds feature h's weight for every intent
+        self.weights = weights
+
+    @classmethod
+    def from_arrays(cls, intents, idf, weights):
+        # e.g. read-only views over a KB snapshot file
+        self = cls.__new__(cls)
+        self.intents = list(intents)
+        self.n_features = weights.shape[0]
+        self._setup(weights, idf)
+        return self
+
+    @classmethod
+    def from_entries(cls, entries, normalize, n_features=N_FEATURES):
+        docs = {}
+        for intent, data in entries.items():
+            # nothing to detect for the fallback and for prompt-less (follow-up) rows
+            if intent == "default" or not data["prompt"]:
+                continue
+            parts = [(normalize(p), PROMPT_WEIGHT) for p in data["prompt"]]
+            if isinstance(data["reply"], str):
+                parts.append((normalize(data["reply"]), 1.0))
+            docs[intent] = parts
+        return cls(docs, n_features)
+
+    def scores(self, norms):
+        # (len(norms), n_intents) cosine scores in one sparse x dense product
+        indptr = [0]
+        indices = []
+        values = []
+        for norm in norms:
+            feats = hashed_features(norm, self.n_features)
+            indices.extend(feats)
+            values.extend(feats.values())
+            indptr.append(len(indices))
+        out = np.zeros((len(norms), len(self.intents)), dtype=np.float32)
+        if not indices:
+            return out
+        idx = np.asarray(indices, dtype=np.intp)
+        vals = np.log1p(np.asarray(values, dtype=np.float32)) * self.idf[idx]
+        starts = np.asarray(indptr[:-1], dtype=np.intp)
+        lengths = np.diff(np.asarray(indptr, dtype=np.intp))
+        rows = lengths > 0
+        qnorm = np.sqrt(np.add.reduceat(vals * vals, starts[rows]))
+        out[rows] = np.add.reduceat(self.weights[idx] * vals[:, None], starts[rows], axis=0)
+        out[rows] /= qnorm[:, None]
+        return out
+
+    def rank_batch(self, norms, k=3):
+        # -> [[(intent, score), ...top k], ...] per message, best first
+        if not self.intents:
+            return [[] for _ in norms]
+        scores = self.scores(norms)
+        k = min(k, len(self.intents))
+        top = np.argsort(-scores, axis=1, kind="stable")[:, :k]
+        return [
+            [(self.intents[j], round(float(row[j]), 4)) for j in order]
+            for row, order in zip(scores, top)
+        ]
+
+    def rank(self, norm: str, k=3):
+        return self.rank_batch([norm], k)[0]
+
@@ -0,0 +1,225 @@
+# sessions.py
+
+# ======= Conversation state =======
+# What the bot last said to each conversation: the intent it answered and the
+# follow-up question it is waiting on ("Would you like a fee breakdown?"), so a
+# bare "yes" or "class 7" can be answered. The state is small and disposable:
+# it expires `ttl` seconds after the conversation's last message, the least
+# recently used conversation is evicted when the store is full, and a store
+# never grows past its `max_bytes` budget.
+#
+# MemorySessionStore lives in one process. FileSessionStore keeps a fixed-size
+# hash table in a memory-mapped file, so every gunicorn worker on the host sees
+# the same conversations.
+#
+# Both: get(id) -> (intent, pending or None) or None; set(id, intent, pending)
+
+from collections import OrderedDict
+from contextlib import contextmanager
+import fcntl
+import hashlib
+import mmap
+import os
+import struct
+import threading
+import time
+
+DEFAULT_TTL = 30 * 60.0
+DEFAULT_MAX_BYTES = 32 * 1024 * 1024
+
+# longest conversation id accepted from a client
+MAX_ID_LENGTH = 64
+
+
+def valid_session_id(value):
+    return isinstance(value, str) and 0 < len(value) <= MAX_ID_LENGTH
+
+
+class SessionState:
+    __slots__ = ("intent", "pending", "touched")
+
+    def __init__(self, intent, pending, touched):
+        self.intent = intent
+        self.pending = pending
+        self.touched = touched
+
+
+class MemorySessionStore:
+    # measured per conversation (bench/sessions.py): the slotted record, a
+    # 22-character id string and its OrderedDict entry
+    RECORD_BYTES = 256
+
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES, ttl=DEFAULT_TTL, clock=time.monotonic):
+        self.max_sessions = max(1, max_bytes // self.RECORD_BYTES)
+        self.ttl = ttl
+        self.clock = clock
+        self._sessions = OrderedDict()  # id -> SessionState, least recently used first
+        self._lock = threading.Lock()
+        self.expired = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def get(self, session_id):
+        now = self.clock()
+        with self._lock:
+            state = self._sessions.get(session_id)
+            if state is None:
+                return None
+            if now - state.touched > self.ttl:
+                del self._sessions[session_id]
+                self.expired += 1
+                return None
+            return state.intent, state.pending
+
+    def set(self, session_id, intent, pending=None):
+        now = self.clock()
+        sessions = self._sessions
+        with self._lock:
+            state = sessions.get(session_id)
+            if state is not None:
+                state.intent, state.pending, state.touched = intent, pending, now
+                sessions.move_to_end(session_id)
+                return
+            # least recently used first is also oldest first, so every expired
+            # conversation is at the front
+            while sessions:
+                oldest = next(iter(sessions.values()))
+                if now - oldest.touched <= self.ttl:
+                    break
+                sessions.popitem(last=False)
+                self.expired += 1
+            while len(sessions) >= self.max_sessions:
+                sessions.popitem(last=False)
+                self.evictions += 1
+            sessions[session_id] = SessionState(intent, pending, now)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "store": "memory",
+                "size": len(self._sessions),
+                "max_sessions": self.max_sessions,
+                "ttl": self.ttl,
+                "expired": self.expired,
+                "evictions": self.evictions,
+            }
+
+
+# slot: id hash (0 = never used), last message (unix seconds), intent, pending
+RECORD = struct.Struct("<QI36s16s")
+HEAD = struct.Struct("<QI")
+# slots searched for an id; the stalest of them is evicted when all are live
+PROBE = 8
+
+
+class FileSessionStore:
+    # Open-addressing table of fixed 64-byte slots in one mmap'd file. Every
+    # operation takes flock() on the file, which serializes workers on this
+    # host; eviction is LRU within an id's probe window. Intents longer than
+    # 36 bytes (pending names: 16) are not kept.
+
+    def __init__(self, path, max_bytes=DEFAULT_MAX_BYTES, ttl=DEFAULT_TTL, clock=time.time):
+        slots = PROBE
+        while slots * 2 * RECORD.size <= max_bytes:
+            slots *= 2
+        self.path = path
+        self.slots = slots
+        self.size = slots * RECORD.size
+        self.ttl = ttl
+        self.clock = clock
+        self._lock = threading.Lock()
+        self.evictions = 0  # this process only
+        self._fd = None
+        self._open()
+        # flock() belongs to the open file, which a forked worker would share
+        # with its parent: give every worker its own
+        os.register_at_fork(after_in_child=self._open)
+
+    def _open(self):
+        if self._fd is not None:
+            os.close(self._fd)
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            if os.fstat(self._fd).st_size != self.size:
+                # new file, or a table of another size: start empty
+                os.ftruncate(self._fd, 0)
+                os.ftruncate(self._fd, self.size)
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+        self._map = mmap.mmap(self._fd, self.size)
+
+    @contextmanager
+    def _locked(self):
+        with self._lock:
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+            try:
+                yield self._map
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def _slot(self, session_id):
+        digest = hashlib.blake2b(session_id.encode("utf-8"), digest_size=8).digest()
+        key = int.from_bytes(digest, "little") or 1
+        return key, key & (self.slots - 1)
+
+    def get(self, session_id):
+        key, first = self._slot(session_id)
+        now = int(self.clock())
+        mask, size = self.slots - 1, RECORD.size
+        with self._locked() as m:
+            for i in range(first, first + PROBE):
+                offset = (i & mask) * size
+                if HEAD.unpack_from(m, offset)[0] == key:
+                    _, touched, intent, pending = RECORD.unpack_from(m, offset)
+                    if now - touched > self.ttl:
+                        return None
+                    return intent.rstrip(b"\0").decode(), pending.rstrip(b"\0").decode() or None
+        return None
+
+    def set(self, session_id, intent, pending=None):
+        key, first = self._slot(session_id)
+        now = int(self.clock())
+        mask, size = self.slots - 1, RECORD.size
+        intent_b = intent.encode("utf-8")
+        pending_b = (pending or "").encode("utf-8")
+        if len(intent_b) > 36 or len(pending_b) > 16:
+            intent_b = pending_b = b""
+        with self._locked() as m:
+            target = free = stalest = None
+            for i in range(first, first + PROBE):
+                offset = (i & mask) * size
+                slot_key, touched = HEAD.unpack_from(m, offset)
+                if slot_key == key:
+                    target = offset
+                    break
+                if free is None and (slot_key == 0 or now - touched > self.ttl):
+                    free = offset
+                if stalest is None or touched < stalest[1]:
+                    stalest = (offset, touched)
+            if target is None:
+                target = free
+            if target is None:
+                target = stalest[0]
+                self.evictions += 1
+            RECORD.pack_into(m, target, key, now, intent_b, pending_b)
+
+    def __len__(self):
+        now = int(self.clock())
+        with self._locked() as m:
+            return sum(1 for key, touched in (HEAD.unpack_from(m, o)
+                                              for o in range(0, self.size, RECORD.size))
+                       if key and now - touched <= self.ttl)
+
+    def stats(self):
+        return {
+            "store": "file",
+            "path": self.path,
+            "size": len(self),
+            "max_sessions": self.slots,
+            "ttl": self.ttl,
+            "evictions": self.evictions,
+        }
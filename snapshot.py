@@ -0,0 +1,87 @@
+# snapshot.py
+
+# ======= Binary snapshot files: JSON header + raw arrays, opened with mmap =======
+# A compiled KB is mostly flat number arrays (matcher table, typo index, TF-IDF
+# weights). Writing them once and mapping the file read-only in every process
+# means the pages live in the OS page cache, shared by all gunicorn workers and
+# reused by the next restart, instead of being rebuilt and copied per worker.
+#
+# Layout: MAGIC, uint32 header length, header JSON, then each array at an
+# 8-byte aligned offset. header["arrays"][name] = [kind, typecode, offset, shape]
+# where kind says whether the reader gets a memoryview or a numpy array back.
+
+from array import array
+import json
+import mmap
+import os
+import struct
+
+import numpy as np
+
+MAGIC = b"CHATKB\x00\x01"
+_LENGTH = struct.Struct("<I")
+
+# array typecode -> numpy dtype
+_DTYPES = {"i": np.int32, "I": np.uint32, "f": np.float32}
+
+
+def _as_bytes(value):
+    if isinstance(value, np.ndarray):
+        return np.ascontiguousarray(value).tobytes()
+    return bytes(value)
+
+
+def write_snapshot(path, header, arrays):
+    # arrays: name -> array.array or numpy array (dtype in _DTYPES)
+    header = dict(header, arrays={})
+    blobs = []
+    offset = 0
+    for name, value in arrays.items():
+        if isinstance(value, np.ndarray):
+            kind, shape = "numpy", list(value.shape)
+            code = next(c for c, t in _DTYPES.items() if value.dtype == t)
+        else:
+            kind, code, shape = "array", value.typecode, [len(value)]
+        data = _as_bytes(value)
+        header["arrays"][name] = [kind, code, offset, shape]
+        blobs.append(data)
+        offset += -(-len(data) // 8) * 8
+    head = json.dumps(header, separators=(",", ":")).encode("utf-8")
+    start = -(-(len(MAGIC) + _LENGTH.size + len(head)) // 8) * 8
+
+    tmp = "%s.%d.tmp" % (path, os.getpid())
+    with open(tmp, "wb") as f:
+        f.write(MAGIC + _LENGTH.pack(len(head)) + head)
+        f.write(b"\0" * (start - f.tell()))
+        for data in blobs:
+            f.write(data)
+            f.write(b"\0" * (-len(data) % 8))
+    # readers never see a half-written file
+    os.replace(tmp, path)
+
+
+def read_snapshot(path):
+    # -> (header, {name: memoryview or read-only numpy array}), all backed by the mapping
+    with open(path, "rb") as f:
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    if mm[:len(MAGIC)] != MAGIC:
+        raise ValueError("%s is not a KB snapshot" % path)
+    (length,) = _LENGTH.unpack_from(mm, len(MAGIC))
+    head_end = len(MAGIC) + _LENGTH.size + length
+    header = json.loads(bytes(mm[len(MAGIC) + _LENGTH.size:head_end]))
+    start = -(-head_end // 8) * 8
+
+    arrays = {}
+    for name, (kind, code, offset, shape) in header.pop("arrays").items():
+        count = 1
+        for n in shape:
+            count *= n
+        size = count * array(code).itemsize
+        if start + offset + size > len(mm):
+            raise ValueError("%s is truncated" % path)
+        if kind == "array":
+            arrays[name] = memoryview(mm)[start + offset:start + offset + size].cast(code)
+        else:
+            arrays[name] = np.frombuffer(mm, dtype=_DTYPES[code], count=count,
+                                         offset=start + offset).reshape(shape)
+    return header, arrays
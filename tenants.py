@@ -0,0 +1,289 @@
+# tenants.py
+
+# ======= Multi-tenant serving: many schools in one process =======
+# Each school (tenant) is a directory under TENANTS_DIR:
+#
+#   <name>/knowledge_base.csv   required, as KB_PATH; its prompt-less rows answer
+#                               "yes" to follow-up questions (see FOLLOW_UP_YES)
+#   <name>/facts/               optional fact tables, as FACTS_DIR (see facts.py)
+#   <name>/tenant.json          optional page settings: {"heading", "contact", "quick"}
+#
+# A request names its tenant by host (<name>.<TENANT_DOMAIN>) or by path prefix
+# (/t/<name>/chat); any other request is for the default school (KB_PATH).
+#
+# A tenant is compiled on its first request, once even when many arrive
+# together, and kept in an LRU bounded by tenant count and by an estimate of
+# the memory each one holds. One that no request has used for idle_ttl seconds
+# is dropped as well. An evicted tenant holds nothing (on_evict listeners drop
+# what others cache for it); its next request compiles it again, which with KB
+# snapshots (see kb.py) is mostly mapping a file. Tenants get no watcher thread
+# each: one sweeper thread per cache expires idle tenants and checks the files
+# of the rest every poll_interval, so requests never wait on a reload.
+# Conversations are kept per tenant: the same conversation id under two schools
+# is two conversations.
+
+import gc
+import json
+import logging
+import os
+import re
+import sys
+import threading
+import time
+import types
+from collections import OrderedDict
+
+log = logging.getLogger(__name__)
+
+TENANT_NAME = re.compile(r"[a-z0-9][a-z0-9-]{0,62}")
+# WSGI environ key holding the tenant name a request was routed to
+TENANT_KEY = "chatbot.tenant"
+TENANT_PREFIX = "/t/"
+
+# shared by every tenant (and the rest of the process): not counted in their size
+_SHARED = (type, types.ModuleType, types.FunctionType, types.BuiltinFunctionType, types.MethodType)
+
+
+def deep_size(obj):
+    # bytes of the objects reachable from obj: a rough figure for the private
+    # memory a tenant holds; arrays mapped from a KB snapshot count only their headers
+    seen = set()
+    stack = [obj]
+    total = 0
+    while stack:
+        o = stack.pop()
+        if id(o) in seen or isinstance(o, _SHARED):
+            continue
+        seen.add(id(o))
+        total += sys.getsizeof(o)
+        stack.extend(gc.get_referents(o))
+    return total
+
+
+def route(host, path, domain=None):
+    # -> (tenant name or None, prefix to strip, path after it)
+    if path.startswith(TENANT_PREFIX):
+        name, sep, rest = path[len(TENANT_PREFIX):].partition("/")
+        return name, TENANT_PREFIX + name, sep + rest or "/"
+    if domain and host:
+        host = host.split(":", 1)[0].lower()
+        if host.endswith("." + domain):
+            label = host[:-len(domain) - 1]
+            if "." not in label:
+                return label, "", path
+    return None, "", path
+
+
+def read_settings(directory):
+    # tenant.json, or {} without one
+    try:
+        with open(os.path.join(directory, "tenant.json"), encoding="utf-8") as f:
+            settings = json.load(f)
+    except FileNotFoundError:
+        return {}
+    if not isinstance(settings, dict):
+        raise ValueError("tenant.json in %s must hold an object" % directory)
+    return settings
+
+
+class Tenant:
+    def __init__(self, name, kb_store, facts, quick, index_page):
+        # kb_store: KnowledgeBaseStore, facts: FactStore, index_page: StaticAsset
+        self.name = name
+        self.kb_store = kb_store
+        self.facts = facts
+        self.quick = quick
+        self.index_page = index_page
+        # built from the KB in use, see current_bundle() and current_envelopes() in test.py
+        self.bundle = (None, None, None)  # (KB, version, StaticAsset)
+        self.envelopes = (None, None)     # (KB, {intent: (full body, compact body)})
+        self.suggestions = None           # (version, StaticAsset)
+        self.size = 0
+        self.last_used = time.monotonic()
+
+    def refresh(self):
+        # reload changed files; True when the KB or fact tables were swapped
+        kb_swapped = self.kb_store.check()
+        facts_swapped = self.facts.check()
+        return kb_swapped or facts_swapped
+
+
+class TenantCache:
+    def __init__(self, directory, load, max_tenants=64, max_bytes=256 * 1024 * 1024,
+                 idle_ttl=0, poll_interval=0):
+        # load(name, directory) -> Tenant; raises if the tenant's files are broken.
+        # idle_ttl or poll_interval of 0 turns that part of the sweeper off
+        self.directory = directory
+        self.load = load
+        self.max_tenants = max_tenants
+        self.max_bytes = max_bytes
+        self.idle_ttl = idle_ttl
+        self.poll_interval = poll_interval
+        self._listeners = []
+        self._thread = None
+        self._tenants = OrderedDict()  # name -> Tenant, least recently used first
+        self._lock = threading.Lock()
+        self._loading = {}             # name -> lock held while it compiles
+        self.bytes = 0
+        self.hits = 0
+        self.loads = 0
+        self.load_seconds = 0.0
+        self.evictions = 0
+        self.expirations = 0
+
+    def on_evict(self, fn):
+        # fn(tenant) is called after a tenant leaves the cache, outside its lock
+        self._listeners.append(fn)
+
+    def peek(self, name):
+        # the tenant if it is resident, without loading or touching recency
+        return self._tenants.get(name)
+
+    def get(self, name):
+        # -> Tenant, or None when there is no such tenant
+        with self._lock:
+            tenant = self._tenants.get(name)
+            if tenant is not None:
+                self._tenants.move_to_end(name)
+                self.hits += 1
+                tenant.last_used = time.monotonic()
+        if tenant is not None:
+            return tenant
+        if not TENANT_NAME.fullmatch(name):
+            return None
+        directory = os.path.join(self.directory, name)
+        if not os.path.isfile(os.path.join(directory, "knowledge_base.csv")):
+            return None
+
+        with self._lock:
+            loading = self._loading.setdefault(name, threading.Lock())
+        try:
+            with loading:
+                # whoever held the lock may have just compiled it
+                tenant = self._tenants.get(name)
+                if tenant is None:
+                    tenant = self._load(name, directory)
+        finally:
+            with self._lock:
+                self._loading.pop(name, None)
+        return tenant
+
+    def _load(self, name, directory):
+        t0 = time.perf_counter()
+        tenant = self.load(name, directory)
+        tenant.size = deep_size(tenant)
+        elapsed = time.perf_counter() - t0
+        with self._lock:
+            self._tenants[name] = tenant
+            self.bytes += tenant.size
+            self.loads += 1
+            self.load_seconds += elapsed
+            evicted = self._evict(keep=name)
+        self._evicted(evicted)
+        log.info("tenant %s loaded in %.0f ms, ~%d KB", name, elapsed * 1000, tenant.size // 1024)
+        return tenant
+
+    def _resize(self, tenant):
+        size = deep_size(tenant)
+        evicted = []
+        with self._lock:
+            if self._tenants.get(tenant.name) is tenant:
+                self.bytes += size - tenant.size
+                tenant.size = size
+                evicted = self._evict(keep=tenant.name)
+        self._evicted(evicted)
+
+    def _evict(self, keep):
+        # -> evicted tenants, least recently used first; the tenant just used
+        # stays even if it alone is over budget. Called holding the lock
+        evicted = []
+        while len(self._tenants) > 1 and (len(self._tenants) > self.max_tenants or self.bytes > self.max_bytes):
+            name = next(iter(self._tenants))
+            if name == keep:
+                self._tenants.move_to_end(name)
+                continue
+            evicted.append(self._tenants.pop(name))
+            self.bytes -= evicted[-1].size
+            self.evictions += 1
+        return evicted
+
+    def _evicted(self, tenants):
+        for tenant in tenants:
+            log.info("tenant %s evicted", tenant.name)
+            for fn in self._listeners:
+                fn(tenant)
+
+    def sweep(self):
+        # one sweeper pass: drop tenants idle past idle_ttl, then reload the
+        # changed files of the rest
+        now = time.monotonic()
+        with self._lock:
+            idle = [t for t in self._tenants.values() if 0 < self.idle_ttl < now - t.last_used]
+            for tenant in idle:
+                del self._tenants[tenant.name]
+                self.bytes -= tenant.size
+            self.expirations += len(idle)
+            resident = list(self._tenants.values())
+        self._evicted(idle)
+        if self.poll_interval > 0:
+            for tenant in resident:
+                if tenant.refresh():
+                    self._resize(tenant)
+
+    def _sweep_interval(self):
+        # often enough for both jobs; an idle tenant goes within 1.5 idle_ttl
+        return min([x for x in (self.poll_interval, self.idle_ttl / 2) if x > 0], default=0)
+
+    def _sweep_forever(self):
+        interval = self._sweep_interval()
+        while True:
+            time.sleep(interval)
+            try:
+                self.sweep()
+            except Exception:
+                log.exception("tenant sweeper error")
+
+    def start_sweeper(self):
+        if self._sweep_interval() <= 0:
+            return
+        self._spawn_sweeper()
+        # threads don't survive fork (gunicorn --preload): restart in each worker
+        os.register_at_fork(after_in_child=self._spawn_sweeper)
+
+    def _spawn_sweeper(self):
+        self._thread = threading.Thread(target=self._sweep_forever, name="tenant-sweeper", daemon=True)
+        self._thread.start()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "resident": len(self._tenants),
+                "max_tenants": self.max_tenants,
+                "bytes": self.bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "loads": self.loads,
+                "load_seconds": round(self.load_seconds, 3),
+                "evictions": self.evictions,
+                "idle_ttl": self.idle_ttl,
+                "expirations": self.expirations,
+                "tenants": {name: t.size for name, t in reversed(self._tenants.items())},
+            }
+
+
+class TenantMiddleware:
+    # WSGI: names the request's tenant in environ[TENANT_KEY] and moves a
+    # /t/<name> prefix from PATH_INFO to SCRIPT_NAME, so the routes behind it
+    # see /chat either way. Loading the tenant is left to the handler.
+    def __init__(self, app, domain=None):
+        self.app = app
+        self.domain = domain
+
+    def __call__(self, environ, start_response):
+        name, prefix, path = route(environ.get("HTTP_HOST"), environ.get("PATH_INFO", "/"), self.domain)
+        if name is not None:
+            environ[TENANT_KEY] = name
+            if prefix:
+                environ["SCRIPT_NAME"] = environ.get("SCRIPT_NAME", "") + prefix
+                environ["PATH_INFO"] = path
+        return self.app(environ, start_response)
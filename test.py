@@ -1,103 +1,100 @@
 # app.py
 
-from flask import Flask, request, jsonify, render_template_string
-from datetime import datetime
+from flask import Flask, Response, abort, g, request, jsonify, render_template_string, send_file
+from collections import Counter
+from datetime import datetime, timedelta
+import gc
+import json
+import os
+import queue
 import re
+import tempfile
+import time
+
+from admission import AdmissionController, AdmissionMiddleware, read_body
+from assets import IMMUTABLE, StaticAsset
+from channels import HEARTBEAT, SSE_HEADERS, SSE_HEARTBEAT, ChannelHub, sse_event
+from facts import SLOT_PATTERN, FactStore, has_slot_word
+from kb import KnowledgeBaseStore, normalize_message
+from metrics import Exporter, Registry
+from profiling import Profiler, ProfilingMiddleware, token_matches
+from querylog import QueryLog
+from response_cache import ResponseCache
+from sessions import FileSessionStore, MemorySessionStore, valid_session_id
+from tenants import TENANT_KEY, Tenant, TenantCache, TenantMiddleware, read_settings
 
 app = Flask(__name__)
 
+# ======= Time-of-day greeting =======
+# (start hour, greeting); the reply changes at each start hour
+GREETING_BUCKETS = ((0, "Good morning!"), (12, "Good afternoon!"), (17, "Good evening!"))
+
+def greeting_for_hour(hour: int):
+    text = GREETING_BUCKETS[0][1]
+    for start, greeting in GREETING_BUCKETS:
+        if hour >= start:
+            text = greeting
+    return text
+
+def next_greeting_change(now: datetime):
+    # the next moment greeting_for_hour() gives a different answer
+    for start, _ in GREETING_BUCKETS:
+        if start > now.hour:
+            return now.replace(hour=start, minute=0, second=0, microsecond=0)
+    midnight = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    return midnight + timedelta(days=1)
+
 # ======= Knowledge / Rule-based response database =======
-KB = {
-    "adaptive_greeting": {
-        "prompt": ["hi", "hello", "hey", "good morning", "good evening", "good afternoon"],
-        "reply": lambda: (
-            "Good morning!" if 0 <= datetime.now().hour < 12
-            else "Good afternoon!" if 12 <= datetime.now().hour < 17
-            else "Good evening!"
-        )
-    },
-    "timings": {
-        "prompt": ["timing", "hours", "when open", "open", "close", "schedule", "time"],
-        "reply": "School hours: Monday–Saturday, 8:00 AM — 2:00 PM. No entry allowed after 8:00AM. 2nd and 4th Saturdays are non instructional. Primary classes end at 1:40PM"
-    },
-    "fees": {
-        "prompt": ["fee", "fees", "tuition", "cost", "price"],
-        "reply": "Current fees : Annual tuition ₹55,000, uniform and books not included.TnC apply. Transport extra based on route. Activity fees ₹2,00 per term. for more info: call XXXXXXXXXX"
-    },
-    "discounts": {
-        "prompt": ["discount", "scholarship", "sibling", " concession", "rebate"],
-        "reply": "We offer a 10% sibling discount, and a 5% early-payment discount on tuition if paid before April 30 each year.for class 11 students, 10 % discount if student has score 90 percent or above in class 10 CBSE exams and 15% discount on tuition if student scored above 95% in class 10 CBSE exams. for more informatio call XXXXXXXXXX" 
-    },
-    "policies": {
-        "prompt": ["policy", "policies", "rules", "attendance policy", "discipline"],
-        "reply": "Key policies: 80% minimum attendance to sit exams,proper uniform required , mobile phones restricted on campus, strict anti-bullying rules."
-    },
-    "payment": {
-        "prompt": ["payment", "pay", "mode", "transaction", "upi", "bank transfer", "online"],
-        "reply": "Payments accepted: UPI, netbanking (NEFT/IMPS), credit/debit cards at the office, and cheque. We provide digital invoices on request."
-    },
-    "history": {
-        "prompt": ["history", "founded", "established", "about us", "about"],
-        "reply": "Our school was founded in 1972 by Mohini Oberoi mam with a vision of quality afordable education and youth empowerment. Mira Model School has a long history of academic and co-curricular excellence ."
-    },
-    "attendance": {
-        "prompt": ["attendance", "absent", "leave", "attendance rule", "required attendance"],
-        "reply": "Students should maintain at least 80% attendance. Submit leave requests via the parent portal or written note to the class teacher."
-    },
-    "extracurriculars": {
-        "prompt": ["extra", "extracurricular", "activities", "clubs", "sports", "music", "dance", "robotics"],
-        "reply": "Extra-curriculars: football, basketball, music, dance, art, coding club, robotics and debate. We host a variety of intra school and interschool "
-    },
-    "syllabus": {
-        "prompt": ["syllabus", "curriculum", "cbse", "board", "what we teach"],
-        "reply": "We follow the CBSE curriculum with additional life-skills and project-based learning modules."
-    },
-    "exam_schedule": {
-        "prompt": ["exam", "exam schedule", "test", "datesheet", "date sheet", "finals", "midterm"],
-        "reply": "Exam schedules are published term-wise in the parent portal and on the notice board. Example: Term 1 exams: Oct 5–10; Term 2 exams: Feb 12–18 (example)."
-    },
-    "staff": {
-        "prompt": ["staff", "teachers", "principal", "head", "teacher info", "faculty"],
-        "reply": "We have over 50  teaching staff and 15 support staff. All teachers are certified with average 6+ years teaching experience. Contact details are available on request."
-    },
-    "amenities": {
-        "prompt": ["amenity", "facility", "facilities", "labs", "library", "playground", "bus"],
-        "reply": "Facilities: Smart classrooms, Physics,Chemistry,Biology & computer labs, library, playground, art studio, and music room "
-    },
-    "history_of_payments": {
-        "prompt": [ "payment history", "fee history", "invoices", "receipts"],
-        "reply": "Parents can view payment history and download receipts from the parent portal under 'Payments'."
-    },
-    "admission": {
-        "prompt": ["admission", "enroll", "registration", "apply", "how to join"],
-        "reply": "Admissions: Fill the online application on our admission page, submit required documents and pay the registration fee. Interview and assessment dates are shared later. "
-    },
-    "transport": {
-        "prompt": ["transport", "bus", "bus routes", "pickup", "drop"],
-        "reply": "School transport: multiple bus routes with GPS tracking; pick-up times vary by route. Contact transport coordinator for route availability and charges."
-    },
-    "safety": {
-        "prompt": ["safety", "security", "covid", "sanitation", "first aid"],
-        "reply": "Safety: CCTV coverage, trained first-aid staff, regular fire drills, and strict visitor check-in procedures."
-    },
-    "help":{
-        "prompt": ["help", "options", "suggestions", "what can i ask", "what to ask"],
-        "reply": "You can ask about timings, fees, discounts, admissions, transport, exams, staff, facilities.If you need more information, contact the school office at  011-25508486, 25500489 or email at office@miramodelschooldelhi.edu.in.For admissions related queries email administrator@miramodelschooldelhi.edu.in. For fee related queries email fees@miramodelschooldelhi.edu.in"
-    },
-    "default": {
-        "prompt": [],
-        "reply": "Sorry, I didn't get that. You can ask about timings, fees, discounts, admissions, transport, exams, staff, facilities, or say 'help' for suggested prompts."
-    }
-    
+# Loaded from knowledge_base.csv and hot-reloaded when the file changes (see kb.py)
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+KB_PATH = os.environ.get("KB_PATH", os.path.join(BASE_DIR, "knowledge_base.csv"))
+
+# intent -> callable, for replies computed per request
+DYNAMIC_REPLIES = {
+    "adaptive_greeting": lambda: greeting_for_hour(datetime.now().hour)
 }
 
-# Precompute keyword -> intent map for faster matching
-INTENT_KEYWORDS = {}
-for intent, data in KB.items():
-    for token in data["prompt"]:
-        token_norm = token.strip().lower()
-        if token_norm:
-            INTENT_KEYWORDS[token_norm] = intent
+KB_STORE = KnowledgeBaseStore(
+    KB_PATH, DYNAMIC_REPLIES,
+    poll_interval=float(os.environ.get("KB_RELOAD_INTERVAL", 2.0)),
+    # typo tolerance for the fuzzy fallback; 0 turns it off
+    max_edit_distance=int(os.environ.get("FUZZY_MAX_DISTANCE", 2)),
+    # minimum TF-IDF score before falling back to 'default'
+    rank_threshold=float(os.environ.get("RANK_THRESHOLD", 0.15)),
+    # compiled snapshots, shared by workers and restarts; KB_CACHE_DIR="" turns it
+    # off. Only a directory private to this user is used (see kb.py), so the
+    # default is one per user
+    cache_dir=os.environ.get(
+        "KB_CACHE_DIR", os.path.join(tempfile.gettempdir(), "chatbot-kb-cache-%d" % os.geteuid())) or None
+)
+KB_STORE.start_watcher()
+
+# ======= Fact tables (see facts.py) =======
+# Rows for questions naming a class or a bus route, e.g. "exam dates for class 9".
+# intent -> (CSV in FACTS_DIR, key column, slot, reply template, reply for an unknown key)
+FACT_TABLES = {
+    "exam_schedule": (
+        "exam_dates.csv", "class", "class",
+        "Class {class} exam schedule: Term 1 exams {term1}, Term 2 exams {term2}. The subject-wise date sheet is on the parent portal.",
+        "I don't have the exam schedule for class {key}. Exam schedules are published term-wise on the parent portal and the notice board."
+    ),
+    "fees": (
+        "fees.csv", "grade", "class",
+        "Class {grade} fees: annual tuition ₹{tuition}, activity fees ₹{activity} per term. Transport is extra depending on the route; uniform and books are not included.",
+        "I don't have the fees for class {key}. Please contact the school office about fees."
+    ),
+    "transport": (
+        "bus_routes.csv", "route", "route",
+        "Route {route} ({area}): morning pick-up from {pickup}, afternoon drop from {drop}. Contact the transport coordinator to change stops.",
+        "I don't have the timings for route {key}. Please contact the transport coordinator for route availability and charges."
+    ),
+}
+
+FACTS = FactStore(
+    os.environ.get("FACTS_DIR", os.path.join(BASE_DIR, "facts")), FACT_TABLES,
+    poll_interval=float(os.environ.get("KB_RELOAD_INTERVAL", 2.0))
+)
+FACTS.start_watcher()
 
 # Helpful quick bank-style suggestions (bank-helper style buttons)
 QUICK_SUGGESTIONS = [
@@ -113,29 +110,174 @@ QUICK_SUGGESTIONS = [
     "Facilities"
 ]
 
+# Page heading and contact block (other schools set theirs in tenant.json, see tenants.py)
+SCHOOL_HEADING = "MAQS: Mira Advanced Query System."
+SCHOOL_CONTACT = """Contact info :Phone
+
+Landline: 011-25508486, 25500489
+
+Mobile: 9311125072
+
+office@miramodelschooldelhi.edu.in
+administrator@miramodelschooldelhi.edu.in
+fees@miramodelschooldelhi.edu.in"""
+
+# Bank-helper style follow-ups sent after the main reply
+ADDITIONAL_REPLIES = {
+    "fees": [
+        "Would you like a fee breakdown (tuition / activity / transport)?",
+        "Need to download invoice or see payment history?"
+    ],
+    "admission": [
+        "Want the admission form link?",
+        "Would you like available seat count by grade?"
+    ],
+    "exam_schedule": [
+        "I can email the full term calendar or show the dates for a specific class.",
+        "Which class/grade's exam schedule would you like?"
+    ],
+    "fee_breakdown": [
+        "Ask about 'transport' for bus routes and charges."
+    ],
+    "default": [
+        "Try: 'Timings', 'Fees', 'Admission', 'Exam schedule', 'Staff info'.",
+        "Or type 'help' to see more suggestions."
+    ]
+}
+
+EMPTY_MESSAGE_REPLY = "Please type a question or choose a suggestion."
+
+# Max messages accepted by /chat/batch in one request
+BATCH_LIMIT = 10000
+
 # ======= Utility: simple keyword-based intent detector =======
-def detect_intent(message: str):
-    msg = message.lower()
-    # direct exact keyword mapping first
-    for kw, intent in INTENT_KEYWORDS.items():
-        if kw in msg:
-            return intent
-    # fallback: regex / word token matching (looser)
-    words = re.findall(r"\w+", msg)
-    for w in words:
-        if w in INTENT_KEYWORDS:
-            return INTENT_KEYWORDS[w]
-    # more advanced: look for stems
-    stems = {
-        "fee": "fees", "pay": "payment", "exam": "exam_schedule", "test": "exam_schedule",
-        "time": "timings", "open": "timings", "close": "timings",
-        "bus": "transport", "transport": "transport",
-        "admit": "admission", "enroll": "admission"
-    }
-    for s, intent in stems.items():
-        if s in msg:
-            return intent
-    return "default"
+def detect_intent(message: str, kb=None):
+    # keywords (longest wins, then priority) -> typo correction -> TF-IDF ranking
+    return (kb or KB_STORE.current).detect(normalize_message(message))
+
+def detect_intents(messages, kb=None):
+    # Batch version of detect_intent: every distinct message is matched once
+    # and the ones no keyword catches are ranked together
+    kb = kb or KB_STORE.current
+    norms = [normalize_message(m) for m in messages]
+    distinct = list(dict.fromkeys(norms))
+    found = dict(zip(distinct, kb.detect_batch(distinct)))
+    return [found[n] for n in norms]
+
+def rank_intents(message: str, k=3, kb=None):
+    # [(intent, score), ...] best first; scores are cosine similarities in [0, 1]
+    return (kb or KB_STORE.current).rank(normalize_message(message), k)
+
+def build_replies(intent: str, kb=None):
+    kb = kb or KB_STORE.current
+
+    # the reply may be string or callable (adaptive greeting)
+    reply_obj = kb.reply(intent)
+    reply_text = reply_obj() if callable(reply_obj) else reply_obj
+
+    # bank-helper style additional replies / clarifications
+    return [reply_text] + ADDITIONAL_REPLIES.get(intent, [])[:2]
+
+def reply_for(intent, norm, kb=None, facts=None):
+    # -> (intent, replies, pending follow-up); a message naming a class or route
+    # gets its fact table row instead of the canned reply
+    fact = (facts or FACTS.current).answer(intent, norm)
+    if fact is not None:
+        return fact[0], [fact[1]], None
+    return intent, build_replies(intent, kb), PENDING_FOLLOW_UPS.get(intent)
+
+def answer_batch(messages, kb=None, facts=None):
+    # [{"intent": ..., "replies": [...]}, ...]; every distinct message is answered
+    # once, each intent's replies are built once, and only a message with a slot
+    # word is looked up in the fact tables
+    kb = kb or KB_STORE.current
+    facts = facts or FACTS.current
+    norms = [normalize_message(m) if isinstance(m, str) and m.strip() else None for m in messages]
+    distinct = [n for n in dict.fromkeys(norms) if n is not None]
+    replies = {}
+    answers = {None: {"intent": None, "replies": [EMPTY_MESSAGE_REPLY]}}
+    for norm, intent in zip(distinct, kb.detect_batch(distinct)):
+        fact = facts.answer(intent, norm) if has_slot_word(norm) else None
+        if fact is not None:
+            answers[norm] = {"intent": fact[0], "replies": [fact[1]]}
+            continue
+        if intent not in replies:
+            replies[intent] = build_replies(intent, kb)
+        answers[norm] = {"intent": intent, "replies": replies[intent]}
+    return [answers[n] for n in norms]
+
+# ======= Follow-up answers (conversation state, see sessions.py) =======
+# The first ADDITIONAL_REPLIES question of these intents waits for an answer;
+# the conversation remembers it until the next message.
+PENDING_FOLLOW_UPS = {
+    "fees": "fee_breakdown",
+    "admission": "admission_form",
+    "exam_schedule": "exam_class",
+}
+
+# pending follow-up -> still pending after "yes". The reply to "yes" is the KB
+# row of the same name (no prompt, so never detected), so it reloads with the
+# KB and each school has its own; without the row "yes" is an ordinary message.
+FOLLOW_UP_YES = {
+    "fee_breakdown": None,
+    "admission_form": None,
+    "exam_class": "exam_class",
+}
+
+FOLLOW_UP_DECLINED = "Okay! Anything else I can help with?"
+
+# matched against normalized messages
+YES_WORDS = {"yes", "y", "yeah", "yep", "yes please", "sure", "ok", "okay", "please", "haan", "ha", "ji", "ji haan"}
+NO_WORDS = {"no", "n", "nope", "no thanks", "not now", "nahi", "na"}
+CLASS_ANSWER = re.compile(r"(?:for )?(?:class |grade |std |standard )?(\d{1,2})(?:st|nd|rd|th)?")
+
+SESSION_FILE = os.environ.get("SESSION_FILE")
+SESSION_OPTIONS = dict(
+    max_bytes=int(os.environ.get("SESSION_MAX_MB", 32)) * 1024 * 1024,
+    ttl=float(os.environ.get("SESSION_TTL", 1800))
+)
+# SESSION_FILE (say /dev/shm/chatbot-sessions) shares conversations between
+# gunicorn workers; without it each process keeps its own
+SESSIONS = (FileSessionStore(SESSION_FILE, **SESSION_OPTIONS) if SESSION_FILE
+            else MemorySessionStore(**SESSION_OPTIONS))
+
+def recall(data, tenant):
+    # -> (session key or None, (last intent, pending follow-up) or None); a
+    # conversation id is only unique within its school, so other schools' keys
+    # carry the tenant name (which has no "/")
+    conversation = data.get("conversation")
+    if not valid_session_id(conversation):
+        conversation = None
+    elif tenant.name:
+        conversation = tenant.name + "/" + conversation
+    state = SESSIONS.get(conversation) if conversation else None
+    # the page also sends the intent it last showed: the store may have lost the
+    # conversation, or the page answered the last question itself (intent bundle)
+    last_intent = data.get("last_intent")
+    if isinstance(last_intent, str) and (state is None or state[0] != last_intent):
+        state = (last_intent, PENDING_FOLLOW_UPS.get(last_intent))
+    return conversation, state
+
+def answer_follow_up(state, norm, kb=None, facts=None):
+    # -> (intent, replies, still pending) when `norm` answers the pending question, else None
+    if state is None or state[1] is None:
+        return None
+    intent, pending = state
+    if norm in NO_WORDS:
+        return intent, [FOLLOW_UP_DECLINED], None
+    if pending == "exam_class":
+        m = CLASS_ANSWER.fullmatch(norm)
+        reply = m and (facts or FACTS.current).lookup("exam_schedule", m.group(1))
+        if reply:
+            return intent, [reply], None
+    kb = kb or KB_STORE.current
+    if norm in YES_WORDS and pending in FOLLOW_UP_YES and pending in kb.entries:
+        return intent, build_replies(pending, kb), FOLLOW_UP_YES[pending]
+    return None
+
+def remember(conversation, intent, pending):
+    if conversation:
+        SESSIONS.set(conversation, intent, pending)
 
 # ======= Routes =======
 INDEX_HTML = """
@@ -383,23 +525,12 @@ INDEX_HTML = """
 
     <div class="left">
       <div class="logo">
-        <img src="data:image/jpeg;base64,/9j/4AAQSkZJRgABAQAAAQABAAD/2wCEAAkGBxITEhUREhIVFRUWGRgVGRIRFxIaFRsZGhIYGxkYHBUYHighGx0xHxoZITEhJSorLy4vGCAzODMtPCgtMS4BCgoKDg0OGhAQGysdHyAtKy4tNSs3LS03MC03LTEtLSs3LS0uNy0rLSstLS0uLi0tLS0tLi0tKy0rKysrLS0tLf/AABEIAMQBAQMBIgACEQEDEQH/xAAcAAEAAgIDAQAAAAAAAAAAAAAABgcEBQEDCAL/xABEEAACAgECBAQBCAQMBgMAAAABAgADEQQSBRMhMQYiQVEHFCMyQmFxgZEzc4KzFSQlNDVSYnShsbK0CEODkqLhU3LR/8QAGAEBAQEBAQAAAAAAAAAAAAAAAAEDAgT/xAApEQEBAAICAgECBAcAAAAAAAAAAQIRAxIhQTEiYQQTMtEzUXGBobHB/9oADAMBAAIRAxEAPwC8YiICIiAiIgIiICIiAiIgIiICIiAiIgIiICIiAiIgIiICIiAiIgIiICIiAiIgIiICIiAiIgIiICIiAiIgIiICIiAiIgIiICIiAiIgIiICIiAiIgIiICIiAiIgIiICIiAiIgIiICIiAiIgIiICIiAiIgIiICIiAiIgIiICIiAiIgIiICInBgczqv1CIpZ2CqO7MQAPxM1uo4k7lhTtVUJD6m39Gu36QUZG8jGCchR16kgiRTXeJtLWRYn8ZfqflWoYcoBXVbGqAGDsDbmFSjopyZZjaJZ/DiMStNdlxGCdiqq4PY7rSoI+1cz6XUao/wDKpTPbdc7N+KisD8mkB4hRr9RbzH5gevmIE045XdQ9bbky5qbZZWTzWXLIcKRO7hnBq6dTS/yim6yvaX27ntBC3IRtG98lbFJJPeud9YiW6riFtbbbNXoq277XDA4PbvaDMezxAyEZt0tilXbmIzKg2LuKkguQdoY9vqmdPHhVqCOurTpsbZptX5l3K3QhAQ2V6MPRmBBz0jPEPDVZBUWYqICE6qjUVvgm8uxtZOrlrQ2enVfSTGT2Jnw7xE9mQ2msBAViKyCQrAlW22bGIODjCnqCO4my0vFqbDsV8P35bgpZ/wBjgNj7cSEaLgmoYs+k1I+hYFeqyvkbm1A2ELUB2rBO1gRlsTo0nEXrZhqNLzkvs3Lbaio7jc5DGzAQFak5hyE25IGcS9Z6FlgzmRfg/Ew4LaS42qBltNeSLVUkgFLG6lSVbBbcrY6MBN/oNatq7lyMEqyuCGVh3Vgex7ffkEZBnGlZMREgREQEREBERAREQEREBERAREQEREBERAREQEwuI68V4GC7tnZUmN7Y74yQAPdiQBM2aziGkYWfKKQDaFCMh6CxASdmfqsCSQfc9eh6BprtAwU16oJyrnLoUGV09zfRAL/SBYkqxAAf0GRjE4JogLLFo5Vr9FstZSKQ20g2AMWd7GXCthtp29WBBE3eq4tVbXy1TnNaGX5OwwenR+aD+jUZwSfcAZJGY1xctoKymiaqziN5rrSliSdinJ8rNuKqpY7nY/gMKO8fPhElPCaEQfKXDooAxaVWhQOgAq6IAOmM5PbrMGnxtoma2jSvzraUd+RQpG7YOqoxAUnsOh9ZVPH/AAtxC6z5TxTV0VU7gr2c0utecDYtSjCnp26e5M7fh2TpizJXUjW8xade62WXWIGwOTo1O5l6AlugHrn12vDj1t3u/ZNpBrfjdSCvK0djDHm5rohB9QAobP3nEkPAPiZptSt1pqupporD2XWBSgYkDljYSSev/qUN4h0wrvdecbrMsbH2BRvLEkAAnPcE/aSPSTvwa4p0NwFld+nvP821VTV1mzyqynVKxWpsgAbuh2gjGZrycHHMJZElu1p8N4nw3X4tqsqdxkBgTXevbPs49J267hbY8yjVIFZdl20XBXGHCW9A2RgYbB/tShdJ4Sa6x6kdNNrObivQ2s4bl7N+Vu656djnrg9essDw9rOKaM1U8SspfQndTZqDZvZCyttVrsgjzELlu2e46TLPhk/Tku0n4TbUlQOnsa9rHLjc7rc9v1Us6HFS14yTnooPXIztNDY+lyuoIYOxY6pQQu5jja6knYB0VSCVwoB2nGcPh2iq0bG5VV6WUKNSvU1oMkKVHlFeeu5APdh3abHU2nUE0VHFX0bbl/xqQ9t3ozfVHQde2FdNyDGZg8RXl6awJ5dlT7cem2s4x+UoDwL491desoOp1NtlLkVutrMwAcYDYPYhsHPsDO+PiuctnpLXo6IEx+IatKqntc4StS7H7FGTMlZGZxmebdJ4219+vrb5VcqWaiv5pXIQI1yjZtHTG3pLb+MGvto4cbKLHrfmVjfWSGwWORkTfLgyxymN9ptOJxmVn8D+LajUU6k6i6y0rYgU2MWIHLzgZkC8Q+IdeeKXaavW31q2qNKhXbaoa4KMKD2Ge0Y/h7c7jv4NvRWYlQcb8Mcd0lT6irir3isFymGDYAycK+4N064md8LviRZrLfkmqC80gtXag2h8DJUr2DY69O+D0kvDevbG70bWjETq1N6orO5AVQWYnsABkn8pirszOZS/w7+IFt/E7EusY1aktykcnbWQSa1A9Mr0PucS5xO+TjuF1Ul25iInCkREBERAREQEREDTcf4nptDVZqrdqZxkgDfYwBCL7sfQTz/wXi2l1Oqts4hza7dQ4ZdZp7GXksV2jKDunbr36e3WT746cP1V9mjroqstXFxxWrMN3zYBYjoOmcE49ZXlvg1zwkcTRifM62VEdkWw1hx69x1B957uDHCYbt81xd7Sfwu9nDW1HD9Zq/kik71+YV1tBGN62kMF7DoVM7W4jprrhotB8/fqDte63mGoIASzWM4D6jC5wmFrHbbOz4kVKNdwlX+eTl1KQMEWDmqCBnoc9O/uJLeH30UamlkpppqLMhFCVhRuG0M1gGXIcqhYYRTZtyx7cZWamXurGHqvCegAXNfytk6XWP1batwrNaVoVWs7mYgAYGw++ZreP6FdFVXxCpS+lIWu6ncpvpDYXC3fXAOA1Vm5c9Og6jf6ZGr322EUvZbt5qdVfTm0BkJ9LVLMevUebGRmOI6jZp7aSFrV7q+VVtA2AOt1hYsCuQmGJYbQSA3qTnM7vz5Eb0PiXQU1mzTcR5Hl6VmlrAPsFDj5r7ks2H2Eium4ZTp9M2s4mLXOqcvTokc18053G60D6K5bp7Z9cgTb/FSjTjSIyaWmu3nbWtprVM/NOSjp9Ktux2nIIwQSJ3+MvD1mt1nDNOrgF9Gm8nvWqAFnI+3PT3Im+HWSX43v/CMv4JeLVAbh1zBeu7Tg+uSxevPv2I98n2lwaWhUUIihVXoFUAAD2AHaeYuJeGdRRq7k0yW2rprlTmohJDdGQnYOnp6YnqBM4Ge8y/E44zLtj7XFh8b/AJvd+qs/dmeYNbwMrw/R60Dy3c2p/YOljbfzQf8AjPT/ABv+b3fqrP3ZlZeC+BDW+Gl0/wBcm5qz7WLe5X8z0P2Ey8GfSW/ef9LEr+FniH5ZoEZjm2r5mz3yoG1vxUqfvzNT8X+IO6UcLoPzussVTj0rVgSfuzj8FaV98HOP/JdcaLDtS8ctgxxtsUnZn2+sp+8SbeAx/CPFNVxVutVX8X02e2MYLD8Mn/qn2jPj6Z3L1PMJdxV1miWji60J9GvV1oPuW5RLh+OP9Ft+tq/1SqOL/wBON/fl/wBwstf44/0W362r/VNeS75ONJ7af/h8/Qav9an7uV9xk/y439+X/dLLB/4fP0Gr/Wp+7lc+I9OLOM21NnbZrOWcd8NqApx+BnWH8bMvxF9+M/E2m0ultayxCxRlStWUu7FSAAPv9fSU38FeB226+vUBTytOGLWY8pY1lFQH1PmJ+wD7RNj45+EvyWttTomaxEyz1OFNiqO7KVA3AexGfvk4+EfiyrV6fkbK6rqQN1dShUZT0FiqOg69x6H7xMZZhxXp538r7T8SAfGPirppa9FT1u1jilQO+zI3n8yq/tSfGUnxLXazW8ZfU6GhNQuhxWgtYCsE7gX+kMndu9fqiY8OO8t/yWol468PPwvWIKmONtd1VnX6SBd3X7HXOPZhPQ/hri66vTU6lOgsQNjp0P1l/A5H4Sn/AIiabjGq04t1miprTT7rDZS4LBdvmBHMbI7Ht6TYfATj36bQOe3z9Y+zIFg/Pa34mejllz4plfmJPFXHERPE6IiICIiAiIgIiIHBE85cc8LcUSzU6etLno0/NcbMhGqtfcdv9cnHVep8p6T0dK3+IPhzXC88S0WtFBSvbYtz7awig5YZDLjHcEdxmb8GfXL1/dLED8blToeD6lLBalaNSbCpwWQ1kKyZz9RwRn0MssaNbgqody2nlrZgefCkW24HRa0Tcla9tzZ69Ca34Fom1fBNZpwAzaO7no6dd2QS4Hv034+8SXfD3ix1OgXzDnKE4egU+ZVIy1v38vzf9ETTln0/0t/dIifH/GS6a59N8ipsqVzbUbLLgxVyXRzhsMcN0PfHeS7wq/ymhdY1Ypsss2tt3lUDsBp7UDE+XcArDI3b7MyP+NeOHS3nU1Ct6zc9Laa+rTmtlpXYNpK8xQAMdCRnHXussTQcIIrQqK0qt04RtKxKhAw3bUsUZwpZwOnTd7AATk10l1rZPlWXxZUE6XTIALGd1akDLVMCihFfuaibCyAjoCcYBwHj3hep1HEbk0Jew6fT112crcoQImeXuz5iT1wPsHpMrhm/iXHkLlXTRqA1lfVW5JODnA72N/4nHSajw9pdfxK/WLptVXQuotay+ouRZjf0OwDcVGQvRgD2M1x+mT7T/aLL+EfDNRXprdRqt3O1VnNIsGGwFCqSPQnqcfaJPJg8F0HIoqo3s/LRU32HLNgYyT7zOnizy7ZWu2Dxv+b3fqrP3ZkR+CP9EUf/AGu/fvJxqGUKxfG0Alt3bbjrke2Jg8P1OlTTi6g1Jp9psDVhVq29SW6dPcxMvpuKKF+Lnh46fiJatfLqvnEC/wDyE4dB9u4g/ty8PBvAhotHTphjKLlyPWxurn8yfwxOzWa/QslN1rUsrkNQzhWJJG4GsEZJwM+X2na3H9KKTqOfXylO1rA3RW3Bdpx2bcQMHrmaZ8uWeMxvok0888YP8uN/fl/3Cy2Pjif5Lb9bV/qki0icNutbZXpmuGLGBrrFwyejkMN3cfS+yG43w/U15Z67qsF8uharCAktkrt6AGdZc28sbr9KSIJ/w+foNX+tT93K/wCLn+XG/v6/7pZ6L4Rp9MKw+mSpa7AHBpRVVgR0bygZ6TA1FXDRftevSi8srZZKt+5jlSWx0YkdMnJ9JZz6zyy18mm9YZnnzjSHgvGxbWMUk8wL2HJsOLE/ZOcfcsvPW8d01T8uy5FfG8oT5gv9YgfRX+0ek6HGh1VhRl099laqxDLW5VbBlSCQehxkYmfFn03ublW+WB468RrpOH26pGGWTbU3oXsGEP3DO77hNf8ACHgnybhyMw+cvPPfPfzDyA/sgfiTN3dqOH2affZ8nbToxQGxUNSsp2bQGGAc+XA+6Z3DeJUW7lpsVimAyL0ZMjoCndenbI9Jz21h1kGTqaFdWRgCrAqynsQRgj8p5kzZwjinr/F7ftG+o/55RvzE9GL4i0hfljUVlt3L6MMb842bu2/PTbnM+LtLob73reqi25FVnD1ozhWzsJLDt0OPunfFydNyzcpZtstNerorocqwDKw7EEZB/Kds+KKVRQiKFVRgKoAUAdgAOgE+5ipERAREQEREBERATUeLeFtqtHqNMjbWtrZAx7AkdM/ZnoZt5r7ON6ZW2G+vcCFK71yGJGAQOx6jv7yy6u4Kt+HWl4rpLa9CdAEpNjvqNQ/mDqVwNrA46YwO+c+nWa3iNL8A4nzxWX0dxYqB6ZByo9N65OPdSR7y8xNdx7gtOrpei9N6N+BB9GU+jD0M2nPvLdni/KaVL8ROC126fhl9TB+dZXU7pgqzWKuWz+yc/wD7M34ncW0+jFujopRrrxUV2qC1ZBxn33nbXtHqTn79FxfwdxbQMKdLv1FBtW2soqsUsXO1mQ9EbqRu+ifXHTE0+H/w4+Tv8t1zc7Vk7hkllRj3bcfpv/a9PT3mtuGMlt3J8IweB+HtdwvhnN0lK26210e1GG4isZxWoBGSM9ev1mnz8MPCuqTXX8RvoOlSzmBNOWyc2WBj+yMdM4PXt0lrzF1nEaqsc2xU3ZxuOM474mH52Vl+66ZYidGj1ldq76nV17bq2DDI79RO+ZKweOfza/8AVWfuzKxq0ltVOq4TsPyda21iv12/J2qZxVn35wAx/VDS2yJ88sfZ2x2Hb2nWOWhVvhZxTfw7U6ghaG4bXTVa/REu3BnUk9FZlxgnvtImB4rBdeLams/xWx9CFcfQexLqxY6ns2OgLfZ9kuA0jG3Ax7YGPynJqGNpAx7EDH5Tr8zztNINxfUJqOJ8POldbHq5rXWVEMFparAV3Xp1bGFJ9MzR+DNWv8AvUdRWWOm1AXT+QWL0sJ+tuPTr2EtVKgOwA+4AT4GlT+ov/aJO/jRpHvA3E6DotJULqi/IqHLDpvyKxkbc5zND4nvbTat9Vpb1Ls1KX8PvX9N1UJZT67gD3GR5T7GT9dMg6hVB9wBmfZrBIJAyOxwMiTt52IH4e1yabXcRGsdarLbVtre4hQ9HKCrtY9DjBBA7GfPA0eziuubT2CpTToyA1WfKUfaNpKlfuI/KT5qgcZAOO2QDArGScdT3Pqfxl7/JpUHBkK1aDUW9aKddrDa2PKrNbYtdjD0UMe/1c5m/4kH1XEWfQuGC6K6qy6ths5jn5lN46FgfN/ZH3iWAKgBgAY9sDE5SsAYAAHsBLc/OzSqzqqTwEaED+NcoUDS/84ajdj6HcHf5t3bHXPrNvwXWJRxXVDUWojfJdGCbHVcsBZuwWPXrJ4KhnOBn3wM/nPltOp6lVJ9yAZO/yPqm1XUMrBlPUMpBBHuCO8+5wqgDA6AegnM4UiIgIiICIiAiIgdd/wBFvuP+Uiaai1dHXQ1HmCVeap6BXjcuGxY6sucdsd+mT3kusXII9wR/hIjdwkEpzdJczoqDdQ9JqYowYHzOD3APmAx6e8sGyHGLHO1ORWC3LDWWb234J28tABnAJ+n6TW2cZBY1NqbjYCwK1pVUgKuVOS4Yr2yDnqGXHcTv0vBTgBNMiDO7OptLENkneK68ru/tbgcDGZsU4TYSS14Uk5PIppUHPU55gcnr9svgR4cTVmQD5T53CgtqLF2ja5y4A8h8nQeue/SZx1aLXTdz9SotQ2YD12YxVvKnep69x+Bm5PCmPfU3/nUP8knzZwliMfKbcdejLpmHUdQd1Wf8Y3BrBxh0ZkN9TMp28m9dlmcKccyosv107IfpRZxJ2ups5O7argim3Tt+kFewje6kg49QO4nbZwSxQNq0Pg5G0PQ4ztyRZWWGcIg+iPogTFPDQpXGk1C7CpU0vp2RSDWfLvYEj5tB5h6emY8DM4QbDrdQzoKw1WnKpkFvp6gFmI6bj0GBnoo6n0kE1HCdM/OsvZOWHStBWxUv5XtZmbaSoybOwJ7fbibeShERIEREBERAREQEREBERAREQEREBERAREQEREBERATjE5iAiIgIiICcYnMQGIiICIiAiIgIiICIiAiIgIiICIiAiIgIiICIiAiIgIiICIiAiIgIiICIiAiIgIiICIiAiIgIiICIiAiIgIiICIiAiIgIiICIiAiIgIiICIiAiIgIiICIiAiIgIiICIiAiIgIiICIiAiIgIiICIiAiIgIiICIiAiIgIiICIiAiIgIiICIiAiIgIiICIiAiIgIiICIiAiIgIiICIiB/9k=" width="55" style="border-radius:10px; vertical-align:middle; margin-right:8px;">
-      MAQS: Mira Advanced Query System.
+        <img src="{{ logo_url }}" width="55" style="border-radius:10px; vertical-align:middle; margin-right:8px;">
+      {{ heading }}
       </div>
 
       <div class="desc">
-        
-        Contact info :Phone
-
-Landline: 011-25508486, 25500489
-
-Mobile: 9311125072
-
-office@miramodelschooldelhi.edu.in
-administrator@miramodelschooldelhi.edu.in
-fees@miramodelschooldelhi.edu.in
-
-​
+        {{ contact }}
       </div>
 
       <div class="quick" id="quick-area"></div>
@@ -424,10 +555,17 @@ fees@miramodelschooldelhi.edu.in
   </div>
 
 <script>
-const QUICK = {{ quick|tojson }};
+let QUICK = {{ quick|tojson }};
+let SUGGEST_VERSION = {{ suggest_version|tojson }};
+// true only where the server can hold a stream open per visit (see STREAMING)
+const STREAMING = {{ streaming|tojson }};
+const BUSY = "The assistant is busy right now. Please try again in a moment.";
+// "/t/<school>" when the page was served under a school's path prefix (see tenants.py)
+const BASE = location.pathname.endsWith('/') ? location.pathname.slice(0, -1) : location.pathname;
 
 function addQuickChips(){
   const q = document.getElementById('quick-area');
+  q.replaceChildren();
   QUICK.forEach(t=>{
     const el=document.createElement('div');
     el.className='chip';
@@ -464,6 +602,91 @@ function clientGreeting(){
   showMessage(g + " I'm your school assistant. Ask me anything!");
 }
 
+// Conversation id, so the server can answer "yes" or "class 7" to its own
+// follow-up questions; lastIntent covers a server that has forgotten it.
+const CONVERSATION=sessionStorage.getItem('conversation')||
+  (crypto.randomUUID?crypto.randomUUID():String(Math.random()).slice(2)+String(Date.now()));
+sessionStorage.setItem('conversation',CONVERSATION);
+let lastIntent=null;
+
+// One Server-Sent Events stream for the whole visit; replies arrive on it.
+// Without it (or while it reconnects) messages go to /chat instead.
+let streamSession=null;
+
+function openStream(){
+  if(!STREAMING||!window.EventSource) return;
+  const es=new EventSource(BASE+'/chat/stream');
+  es.addEventListener('session',e=>{ streamSession=JSON.parse(e.data).session; });
+  es.addEventListener('reply',e=>{
+    const r=JSON.parse(e.data);
+    if(r.intent) lastIntent=r.intent;
+    showMessage(r.text,'bot');
+  });
+  es.onerror=()=>{ streamSession=null; };
+}
+
+// Intent bundle: the keyword table and static replies, so common questions
+// are answered here with no round trip. Anything it isn't sure about goes to
+// the server; a reply from a server with a newer bundle replaces this one.
+let bundle=null;
+
+async function loadBundle(){
+  try{
+    const res=await fetch(BASE+'/chat/bundle');
+    if(res.ok) bundle=await res.json();
+  }catch(e){}
+}
+
+function checkBundle(res){
+  const version=res.headers.get('X-Intent-Bundle');
+  if(bundle&&version&&version!==bundle.version){ bundle=null; loadBundle(); }
+}
+
+function answerLocally(text){
+  // printable ASCII only, so \\w and toLowerCase() normalize exactly as the server does
+  if(!bundle||!/^[ -~]*$/.test(text)) return null;
+  const norm=(text.toLowerCase().match(/\\w+/g)||[]).join(' ');
+  // the server asked something after lastIntent and this may be the answer
+  if(lastIntent&&bundle.follow_ups.includes(lastIntent)&&
+     (bundle.answer_words.includes(norm)||new RegExp('^(?:'+bundle.answer_pattern+')$').test(norm))) return null;
+  if(new RegExp(bundle.slot_pattern).test(norm)) return null;
+  // the server's pick: longest keyword, then the earliest listed
+  const hits=[];
+  let best=-1;
+  bundle.keywords.forEach((kw,i)=>{
+    if(!norm.includes(kw)) return;
+    hits.push(i);
+    if(best<0||kw.length>bundle.keywords[best].length) best=i;
+  });
+  if(best<0) return null;
+  // another intent's keyword outside the winning one ("fees for the exam"): ask the server
+  const top=bundle.keywords[best];
+  if(hits.some(i=>bundle.intent_of[i]!==bundle.intent_of[best]&&!top.includes(bundle.keywords[i]))) return null;
+  const intent=bundle.intents[bundle.intent_of[best]];
+  const replies=bundle.replies[intent];
+  return replies?{intent,replies}:null;
+}
+
+async function sendViaStream(text){
+  if(!streamSession) return false;
+  try{
+    const res=await fetch(BASE+'/chat/send',{
+      method:'POST',
+      headers:{'Content-Type':'application/json'},
+      body:JSON.stringify({session:streamSession,message:text,conversation:CONVERSATION,last_intent:lastIntent})
+    });
+    checkBundle(res);
+    // turned away by admission: /chat would be too, so don't send it again
+    if(res.status===429||res.status===503){
+      showMessage(BUSY,'bot');
+      return true;
+    }
+    return res.ok;
+  }catch(e){
+    return false;
+  }
+}
+
 async function sendMessage(){
   const inp=document.getElementById('message');
   const text=inp.value.trim();
@@ -472,74 +695,697 @@ async function sendMessage(){
   showMessage(text,'user');
   inp.value='';
 
-  const res=await fetch('/chat',{
+  const local=answerLocally(text);
+  if(local){
+    lastIntent=local.intent;
+    local.replies.forEach(r=>showMessage(r,'bot'));
+    return;
+  }
+  if(await sendViaStream(text)) return;
+
+  const res=await fetch(BASE+'/chat',{
     method:'POST',
-    headers:{'Content-Type':'application/json'},
-    body:JSON.stringify({message:text})
+    headers:{'Content-Type':'application/json','X-Chat-Format':'compact'},
+    body:JSON.stringify({message:text,conversation:CONVERSATION,last_intent:lastIntent})
   });
 
+  checkBundle(res);
+  if(!res.ok){
+    showMessage(BUSY,'bot');
+    return;
+  }
   const data=await res.json();
+  if(data.intent) lastIntent=data.intent;
   data.replies.forEach(r=>showMessage(r,'bot'));
+  // compact replies carry the suggestions' version only
+  if(data.suggest&&data.suggest!==SUGGEST_VERSION) loadSuggestions();
+}
+
+async function loadSuggestions(){
+  try{
+    const res=await fetch(BASE+'/chat/suggestions');
+    if(!res.ok) return;
+    const data=await res.json();
+    QUICK=data.suggest;
+    SUGGEST_VERSION=data.version;
+    addQuickChips();
+  }catch(e){}
 }
 
 addQuickChips();
 clientGreeting();
+openStream();
+loadBundle();
 </script>
 
 </body>
 </html>
 """
 
+# ======= Pre-rendered assets (built once at startup, see assets.py) =======
+STATIC_DIR = os.path.join(BASE_DIR, "static")
+
+def load_static_asset(filename, content_type):
+    with open(os.path.join(STATIC_DIR, filename), "rb") as f:
+        return StaticAsset(f.read(), content_type, cache_control=IMMUTABLE, compress=False)
+
+LOGO = load_static_asset("logo.jpg", "image/jpeg")
+LOGO_URL = f"/assets/logo.{LOGO.fingerprint}.jpg"
+
+# fingerprinted name -> asset
+ASSETS = {LOGO_URL.rsplit("/", 1)[1]: LOGO}
+
+def suggestions_version(quick):
+    # what compact /chat replies send in place of the list (see "Request handling")
+    return StaticAsset(json.dumps(quick).encode("utf-8"), "application/json", compress=False).fingerprint
+
+# Replies over one SSE stream per visit (see channels.py). An open stream holds
+# its worker, so it is off unless the server can afford that: aserver.py turns
+# it on, and STREAMING=1 does under gunicorn with one gthread or async worker.
+# Without it the page never opens a stream and /chat/stream isn't routed.
+STREAMING = os.environ.get("STREAMING") == "1"
+
+def render_index(quick=QUICK_SUGGESTIONS, heading=SCHOOL_HEADING, contact=SCHOOL_CONTACT):
+    # Render the HTML template string with quick suggestions
+    with app.app_context():
+        html = render_template_string(INDEX_HTML, quick=quick, suggest_version=suggestions_version(quick),
+                                      heading=heading, contact=contact, logo_url=LOGO_URL,
+                                      streaming=STREAMING)
+    return StaticAsset(html.encode("utf-8"), "text/html; charset=utf-8")
+
+INDEX_PAGE = render_index()
+
+# ======= Tenants: other schools served by this process (see tenants.py) =======
+# Set TENANTS_DIR to serve every school directory in it, by path (/t/<name>/)
+# or, with TENANT_DOMAIN, by host (<name>.<TENANT_DOMAIN>). The school above
+# (KB_PATH, FACTS_DIR) answers every other request.
+DEFAULT_TENANT = Tenant("", KB_STORE, FACTS, QUICK_SUGGESTIONS, INDEX_PAGE)
+
+def load_tenant(name, directory):
+    # compiled like the default school, with the KB settings above; snapshots
+    # go to a directory per tenant so pruning one school's never drops another's
+    settings = read_settings(directory)
+    cache_dir = KB_STORE.cache_dir and os.path.join(KB_STORE.cache_dir, "tenants", name)
+    kb_store = KnowledgeBaseStore(
+        os.path.join(directory, "knowledge_base.csv"), DYNAMIC_REPLIES, poll_interval=0,
+        max_edit_distance=KB_STORE.max_edit_distance, rank_threshold=KB_STORE.rank_threshold,
+        cache_dir=cache_dir
+    )
+    facts = FactStore(os.path.join(directory, "facts"), FACT_TABLES, poll_interval=0)
+    quick = settings.get("quick", QUICK_SUGGESTIONS)
+    page = render_index(quick, settings.get("heading", SCHOOL_HEADING), settings.get("contact", ""))
+    tenant = Tenant(name, kb_store, facts, quick, page)
+    current_envelopes(tenant)
+    # reloads run on the sweeper thread (see tenants.py), which rebuilds these too
+    kb_store.on_swap(lambda old, new: current_envelopes(tenant))
+    return tenant
+
+TENANTS_DIR = os.environ.get("TENANTS_DIR")
+TENANT_DOMAIN = (os.environ.get("TENANT_DOMAIN") or "").lower() or None
+TENANTS = TenantCache(
+    TENANTS_DIR, load_tenant,
+    max_tenants=int(os.environ.get("TENANT_CACHE_SIZE", 64)),
+    max_bytes=int(os.environ.get("TENANT_CACHE_MB", 256)) * 1024 * 1024,
+    # seconds unused before a tenant is dropped; 0 keeps it until the LRU evicts it
+    idle_ttl=float(os.environ.get("TENANT_IDLE_TTL", 3600)),
+    poll_interval=KB_STORE.poll_interval
+) if TENANTS_DIR else None
+if TENANTS is not None:
+    TENANTS.start_sweeper()
+
+def find_tenant(name):
+    # the default school for None; None for a name with no tenant directory
+    if name is None:
+        return DEFAULT_TENANT
+    return TENANTS.get(name) if TENANTS is not None else None
+
+def request_tenant():
+    tenant = find_tenant(request.environ.get(TENANT_KEY))
+    if tenant is None:
+        abort(404)
+    return tenant
+
+def asset_response(asset):
+    status, headers, body = asset.negotiate(
+        request.headers.get("Accept-Encoding", ""),
+        request.headers.get("If-None-Match", "")
+    )
+    return Response(body, status=status, headers=headers)
+
 @app.route("/")
 def index():
-    # Render the HTML template string with quick suggestions
-    return render_template_string(INDEX_HTML, quick=QUICK_SUGGESTIONS)
+    return asset_response(request_tenant().index_page)
+
+@app.route("/assets/<name>")
+def asset(name):
+    found = ASSETS.get(name)
+    if found is None:
+        abort(404)
+    return asset_response(found)
+
+# ======= Request handling shared by the Flask routes and aserver.py =======
+# Each handler takes the decoded JSON body and returns ready-to-send bytes.
+
+# Serialized /chat responses keyed by (tenant, KB version, fact tables version, normalized message, compact)
+RESPONSE_CACHE = ResponseCache(maxsize=int(os.environ.get("RESPONSE_CACHE_SIZE", 4096)))
+# the limit above counts entries: longer messages are rarely asked twice and
+# would let each entry's key grow without bound, so they are never cached
+CACHE_MAX_MESSAGE = int(os.environ.get("RESPONSE_CACHE_MAX_MESSAGE", 256))
+# an evicted tenant's bodies would only wait for the LRU to push them out
+if TENANTS is not None:
+    TENANTS.on_evict(lambda tenant: RESPONSE_CACHE.discard_where(lambda key: key[0] == tenant.name))
+KB_STORE.on_swap(lambda old, new: RESPONSE_CACHE.clear())
+FACTS.on_swap(lambda old, new: RESPONSE_CACHE.clear())
+
+def to_json_bytes(obj):
+    # same bytes jsonify() sends outside debug mode
+    return (app.json.dumps(obj, separators=(",", ":")) + "\n").encode("utf-8")
+
+# /chat replies come in two formats. The full one lists the quick suggestions
+# in "suggest"; the compact one (request header "X-Chat-Format: compact") sends
+# their version instead, and the client fetches /chat/suggestions only when it
+# changes. Replies that don't change per request (no fact row, no greeting)
+# are prebuilt in both formats whenever a KB is swapped in.
+FORMAT_HEADER = "X-Chat-Format"
+COMPACT = "compact"
+
+def chat_body(intent, replies, tenant, compact):
+    suggest = current_suggestions(tenant)[0] if compact else tenant.quick
+    return to_json_bytes({"intent": intent, "replies": replies, "suggest": suggest})
+
+def build_envelopes(kb, tenant):
+    # intent -> (full body, compact body) for every intent with a static reply
+    return {intent: (chat_body(intent, build_replies(intent, kb), tenant, False),
+                     chat_body(intent, build_replies(intent, kb), tenant, True))
+            for intent in kb.entries if not kb.is_dynamic(intent)}
+
+def current_envelopes(tenant=DEFAULT_TENANT):
+    # -> {intent: (full body, compact body)} for the tenant's KB in use
+    kb = tenant.kb_store.current
+    envelopes = tenant.envelopes
+    if envelopes[0] is not kb:
+        envelopes = tenant.envelopes = (kb, build_envelopes(kb, tenant))
+    return envelopes[1]
+
+# built on the watcher thread, before the first request after a reload needs them
+KB_STORE.on_swap(lambda old, new: current_envelopes(DEFAULT_TENANT))
+
+def current_suggestions(tenant=DEFAULT_TENANT):
+    # -> (version, StaticAsset of {"version", "suggest"}); fixed for as long as a tenant is loaded
+    if tenant.suggestions is None:
+        version = suggestions_version(tenant.quick)
+        tenant.suggestions = (version, StaticAsset(
+            to_json_bytes({"version": version, "suggest": tenant.quick}), "application/json"))
+    return tenant.suggestions
+
+def handle_chat(data, tenant=DEFAULT_TENANT, compact=False):
+    # -> (status, body, intent or None, stages)
+    data = data if isinstance(data, dict) else {}
+    msg = data.get("message")
+    if msg is not None and not isinstance(msg, str):
+        return 400, to_json_bytes({"error": "'message' must be a string."}), None, ()
+    msg = (msg or "").strip()
+    if not msg:
+        return 200, to_json_bytes({"reply": EMPTY_MESSAGE_REPLY}), None, ()
+
+    clock = time.perf_counter_ns
+    t0 = clock()
+    norm = normalize_message(msg)
+    conversation, state = recall(data, tenant)
+    kb = tenant.kb_store.current
+    facts = tenant.facts.current
+    follow_up = answer_follow_up(state, norm, kb, facts)
+    if follow_up is not None:
+        intent, replies, pending = follow_up
+        remember(conversation, intent, pending)
+        body = chat_body(intent, replies, tenant, compact)
+        log_query(norm, intent, clock() - t0)
+        return 200, body, intent, (("session", clock() - t0),)
+
+    t1 = clock()
+    key = (tenant.name, kb.version, facts.version, norm, compact) if len(norm) <= CACHE_MAX_MESSAGE else None
+    cached = RESPONSE_CACHE.get(key) if key is not None else None
+    t2 = clock()
+    if cached is not None:
+        intent, body, pending = cached
+        remember(conversation, intent, pending)
+        log_query(norm, intent, clock() - t0)
+        return 200, body, intent, (("session", (t1 - t0) + (clock() - t2)), ("cache", t2 - t1))
+
+    intent = kb.detect(norm)
+    t3 = clock()
+    # read the clock before building, so a reply built across a boundary expires at once
+    now = datetime.now()
+
+    # a static reply's body is prebuilt; fact rows and the greeting are built here
+    envelope = current_envelopes(tenant).get(intent)
+    if envelope is not None and facts.answer(intent, norm) is None:
+        pending = PENDING_FOLLOW_UPS.get(intent)
+        t4 = clock()
+        body = envelope[compact]
+    else:
+        intent, replies, pending = reply_for(intent, norm, kb, facts)
+        t4 = clock()
+        body = chat_body(intent, replies, tenant, compact)
+
+    # callable replies depend on the clock: keep them only until the next change
+    expires_at = None
+    if kb.is_dynamic(intent):
+        expires_at = next_greeting_change(now).timestamp()
+    if key is not None:
+        RESPONSE_CACHE.put(key, (intent, body, pending), expires_at)
+    t5 = clock()
+    remember(conversation, intent, pending)
+    t6 = clock()
+    log_query(norm, intent, t6 - t0)
+    stages = (("session", (t1 - t0) + (t6 - t5)), ("cache", t2 - t1), ("detect", t3 - t2),
+              ("reply", t4 - t3), ("serialize", t5 - t4))
+    return 200, body, intent, stages
+
+def handle_rank(data, tenant=DEFAULT_TENANT):
+    # {"message": ..., "k": 3} -> top-k intents with scores
+    data = data if isinstance(data, dict) else {}
+    msg = data.get("message")
+    if not isinstance(msg, str) or not msg.strip():
+        return 400, to_json_bytes({"error": "'message' must be a non-empty string."})
+    try:
+        k = max(1, min(int(data.get("k", 3)), 20))
+    except (TypeError, ValueError):
+        return 400, to_json_bytes({"error": "'k' must be an integer."})
+    kb = tenant.kb_store.current
+    ranking = rank_intents(msg, k, kb)
+    return 200, to_json_bytes({
+        "intent": detect_intent(msg, kb),
+        "ranking": [{"intent": i, "score": score} for i, score in ranking]
+    })
+
+def handle_batch(data, tenant=DEFAULT_TENANT, compact=False):
+    # {"messages": [...]} -> one result per message, in the same order
+    data = data if isinstance(data, dict) else {}
+    messages = data.get("messages")
+    if not isinstance(messages, list):
+        return 400, to_json_bytes({"error": "'messages' must be a list of strings."})
+    if len(messages) > BATCH_LIMIT:
+        return 413, to_json_bytes({"error": f"At most {BATCH_LIMIT} messages per batch."})
+
+    results = answer_batch(messages, tenant.kb_store.current, tenant.facts.current)
+    for intent, count in Counter(r["intent"] for r in results if r["intent"]).items():
+        METRICS.inc("chatbot_intent_total", (("intent", intent),), count)
+    return 200, to_json_bytes({
+        "results": results,
+        "suggest": current_suggestions(tenant)[0] if compact else tenant.quick
+    })
+
+def handle_send(data, hub, tenant=DEFAULT_TENANT):
+    # {"session": ..., "message": ...}: the replies go down that session's stream
+    data = data if isinstance(data, dict) else {}
+    channel = hub.get(data.get("session"))
+    if channel is None:
+        return 404, to_json_bytes({"error": "Unknown or closed stream session."}), None
+    msg = data.get("message")
+    if msg is not None and not isinstance(msg, str):
+        return 400, to_json_bytes({"error": "'message' must be a string."}), None
+    msg = (msg or "").strip()
+    if not msg:
+        channel.queue.put_nowait(sse_event(
+            "reply", {"intent": None, "text": EMPTY_MESSAGE_REPLY, "index": 0, "last": True}))
+        return 202, to_json_bytes({"intent": None, "queued": 1}), None
+
+    t0 = time.perf_counter_ns()
+    norm = normalize_message(msg)
+    conversation, state = recall(data, tenant)
+    kb = tenant.kb_store.current
+    facts = tenant.facts.current
+    follow_up = answer_follow_up(state, norm, kb, facts)
+    if follow_up is not None:
+        intent, replies, pending = follow_up
+    else:
+        intent, replies, pending = reply_for(kb.detect(norm), norm, kb, facts)
+    remember(conversation, intent, pending)
+    log_query(norm, intent, time.perf_counter_ns() - t0)
+    # main answer first, then the follow-ups, each as its own event
+    for i, text in enumerate(replies):
+        channel.queue.put_nowait(sse_event(
+            "reply", {"intent": intent, "text": text, "index": i, "last": i == len(replies) - 1}))
+    return 202, to_json_bytes({"intent": intent, "queued": len(replies)}), intent
+
+def json_response(status, body):
+    return Response(body, status=status, mimetype="application/json")
 
 @app.route("/chat", methods=["POST"])
 def chat():
+    tenant = request_tenant()
+    compact = request.headers.get(FORMAT_HEADER) == COMPACT
+    t0 = time.perf_counter_ns()
     data = request.get_json() or {}
-    msg = (data.get("message") or "").strip()
-    if not msg:
-        return jsonify({"reply": "Please type a question or choose a suggestion."})
+    parse_ns = time.perf_counter_ns() - t0
+    status, body, g.intent, stages = handle_chat(data, tenant, compact)
+    g.stages = (("parse", parse_ns),) + stages
+    response = json_response(status, body)
+    response.headers[BUNDLE_HEADER] = current_bundle(tenant)[0]
+    if compact:
+        response.headers[FORMAT_HEADER] = COMPACT
+    return response
+
+@app.route("/chat/rank", methods=["POST"])
+def chat_rank():
+    return json_response(*handle_rank(request.get_json(silent=True), request_tenant()))
+
+@app.route("/chat/batch", methods=["POST"])
+def chat_batch():
+    compact = request.headers.get(FORMAT_HEADER) == COMPACT
+    response = json_response(*handle_batch(request.get_json(silent=True), request_tenant(), compact))
+    if compact:
+        response.headers[FORMAT_HEADER] = COMPACT
+    return response
+
+# Open SSE streams of this process (see channels.py), only routed with
+# STREAMING. The session lives in the worker holding the stream, so a
+# /chat/send that lands on another worker gets a 404 and the page falls back
+# to /chat for that message: run one worker, or use aserver.py.
+CHANNELS = ChannelHub(queue.SimpleQueue, max_channels=int(os.environ.get("STREAM_MAX_CHANNELS", 1000)))
+
+def chat_stream():
+    channel = CHANNELS.open()
+    if channel is None:
+        response = json_response(503, to_json_bytes({"error": "Too many open streams."}))
+        response.headers["Retry-After"] = "5"
+        return response
+
+    def events():
+        try:
+            while True:
+                try:
+                    yield channel.queue.get(timeout=HEARTBEAT)
+                except queue.Empty:
+                    yield SSE_HEARTBEAT
+        finally:
+            CHANNELS.close(channel.id)
+
+    return Response(events(), headers=SSE_HEADERS)
+
+def chat_send():
+    tenant = request_tenant()
+    status, body, g.intent = handle_send(request.get_json(silent=True), CHANNELS, tenant)
+    response = json_response(status, body)
+    response.headers[BUNDLE_HEADER] = current_bundle(tenant)[0]
+    return response
+
+if STREAMING:
+    app.add_url_rule("/chat/stream", view_func=chat_stream)
+    app.add_url_rule("/chat/send", view_func=chat_send, methods=["POST"])
+
+@app.route("/chat/suggestions")
+def chat_suggestions():
+    return asset_response(current_suggestions(request_tenant())[1])
+
+@app.route("/cache/stats")
+def cache_stats():
+    return jsonify(RESPONSE_CACHE.stats())
+
+@app.route("/sessions/stats")
+def sessions_stats():
+    return jsonify(SESSIONS.stats())
+
+# ======= Client-side intent bundle (questions answered in the page) =======
+# The compiled keyword table and every static reply, so the page can answer
+# common questions without a round trip. Keyword hits alone decide the intent
+# on the server as well, so the page answers only when the winning keyword
+# (longest, then earliest) is the only intent in the message apart from words
+# inside it ("exam schedule" over "schedule"), the replies don't depend on the time
+# (adaptive_greeting), the message names no class or route (fact tables) and
+# isn't an answer ("yes", "class 7") to a follow-up question the server asked;
+# anything else goes to /chat. /chat replies carry the server's bundle version
+# in X-Intent-Bundle, and the page refetches a bundle that no longer matches.
+BUNDLE_HEADER = "X-Intent-Bundle"
+
+def build_intent_bundle(kb):
+    # -> (version, StaticAsset of the bundle JSON)
+    intents = sorted(set(kb.matcher.intents))
+    index = {intent: i for i, intent in enumerate(intents)}
+    bundle = {
+        "intents": intents,
+        # priority order, as the matcher has them; intent_of[i] indexes intents
+        "keywords": kb.matcher.keywords,
+        "intent_of": [index[intent] for intent in kb.matcher.intents],
+        "replies": {intent: build_replies(intent, kb) for intent in intents if not kb.is_dynamic(intent)},
+        # after these intents, a message like these may answer the server's question
+        "follow_ups": sorted(PENDING_FOLLOW_UPS),
+        "answer_words": sorted(YES_WORDS | NO_WORDS),
+        "answer_pattern": CLASS_ANSWER.pattern,
+        # a class or route number means a fact table row (see facts.py)
+        "slot_pattern": SLOT_PATTERN,
+    }
+    version = StaticAsset(to_json_bytes(bundle), "application/json").fingerprint
+    bundle["version"] = version
+    return version, StaticAsset(to_json_bytes(bundle), "application/json")
+
+def current_bundle(tenant=DEFAULT_TENANT):
+    # -> (version, StaticAsset) for the tenant's KB in use, rebuilt once after a reload
+    kb = tenant.kb_store.current
+    bundle = tenant.bundle
+    if bundle[0] is not kb:
+        bundle = tenant.bundle = (kb,) + build_intent_bundle(kb)
+    return bundle[1], bundle[2]
+
+@app.route("/chat/bundle")
+def chat_bundle():
+    return asset_response(current_bundle(request_tenant())[1])
+
+# ======= Metrics (see metrics.py) =======
+# Set METRICS_DIR to a directory shared by all gunicorn workers (emptied on
+# deploy) to get totals across workers; without it /metrics is per process.
+METRICS = Registry()
+METRICS_EXPORTER = Exporter(
+    METRICS, os.environ.get("METRICS_DIR") or None,
+    flush_interval=float(os.environ.get("METRICS_FLUSH_INTERVAL", 1.0))
+)
+
+def response_cache_counters():
+    stats = RESPONSE_CACHE.stats()
+    return {
+        ("chatbot_response_cache_hits_total", ()): stats["hits"],
+        ("chatbot_response_cache_misses_total", ()): stats["misses"],
+    }
 
-    intent = detect_intent(msg)
-    kb_entry = KB.get(intent, KB["default"])
+METRICS.add_collector(response_cache_counters)
 
-    # kb_entry['reply'] may be string or callable (adaptive greeting)
-    reply_obj = kb_entry["reply"]
-    reply_text = reply_obj() if callable(reply_obj) else reply_obj
+@app.before_request
+def start_request_timer():
+    g.started_ns = time.perf_counter_ns()
+
+def record_request(status):
+    # once per request, from whichever of the two hooks below gets there first
+    started = g.pop("started_ns", None)
+    if started is not None:
+        rule = request.url_rule
+        METRICS.record_request(
+            rule.rule if rule is not None else "unmatched", status,
+            time.perf_counter_ns() - started, g.get("intent"), g.get("stages", ())
+        )
+
+@app.after_request
+def record_request_metrics(response):
+    record_request(response.status_code)
+    return response
+
+@app.teardown_request
+def record_failed_request(exc):
+    # after_request is skipped when an exception propagates (debug mode,
+    # PROPAGATE_EXCEPTIONS, a failing error handler): count it as the 500 it is
+    if exc is not None:
+        record_request(500)
+
+@app.route("/metrics")
+def metrics():
+    return Response(METRICS_EXPORTER.collect(), mimetype="text/plain; version=0.0.4")
+
+# ======= Query log (see querylog.py) =======
+# Set QUERY_LOG_DIR to keep every /chat question with its intent for offline
+# gap analysis (python querylog.py $QUERY_LOG_DIR). Off when unset.
+QUERY_LOG_DIR = os.environ.get("QUERY_LOG_DIR")
+QUERY_LOG = QueryLog(
+    QUERY_LOG_DIR,
+    capacity=int(os.environ.get("QUERY_LOG_BUFFER", 65536)),
+    flush_interval=float(os.environ.get("QUERY_LOG_FLUSH_INTERVAL", 1.0)),
+    segment_bytes=int(os.environ.get("QUERY_LOG_SEGMENT_MB", 16)) * 1024 * 1024,
+    keep=int(os.environ.get("QUERY_LOG_KEEP", 168))
+) if QUERY_LOG_DIR else None
+
+def log_query(norm, intent, latency_ns):
+    if QUERY_LOG is not None:
+        QUERY_LOG.record(norm, intent, latency_ns)
+
+def query_log_counters():
+    stats = QUERY_LOG.stats()
+    return {
+        ("chatbot_query_log_records_total", ()): stats["recorded"],
+        ("chatbot_query_log_dropped_total", ()): stats["dropped"],
+    }
 
-    # Create bank-helper style additional replies / clarifications
-    additional = []
-    if intent == "fees":
-        additional = [
-            "Would you like a fee breakdown (tuition / activity / transport)?",
-            "Need to download invoice or see payment history?"
-        ]
-    elif intent == "admission":
-        additional = [
-            "Want the admission form link?",
-            "Would you like available seat count by grade?"
-        ]
-    elif intent == "exam_schedule":
-        additional = [
-            "I can email the full term calendar or show the dates for a specific class.",
-            "Which class/grade's exam schedule would you like?"
-        ]
-    elif intent == "default":
-        additional = [
-            "Try: 'Timings', 'Fees', 'Admission', 'Exam schedule', 'Staff info'.",
-            "Or type 'help' to see more suggestions."
-        ]
-    
-
-    # Build response payload with a main reply and quick suggestions
-    payload = {
-        "intent": intent,
-        "replies": [reply_text] + additional[:2],
-        "suggest": QUICK_SUGGESTIONS
+if QUERY_LOG is not None:
+    METRICS.add_collector(query_log_counters)
+
+@app.route("/querylog/stats")
+def query_log_stats():
+    return jsonify(QUERY_LOG.stats() if QUERY_LOG is not None else {"enabled": False})
+
+# ======= Profiling (see profiling.py) =======
+# Send "X-Profile: $PROFILE_TOKEN" to profile one request, or set PROFILE_SAMPLE=N
+# to profile every Nth. The reply's X-Profile-Id names the files; list and fetch
+# them with "Authorization: Bearer $PROFILE_TOKEN" at /admin/profiles.
+PROFILE_TOKEN = os.environ.get("PROFILE_TOKEN") or None
+PROFILER = Profiler(
+    os.environ.get("PROFILE_DIR", os.path.join(tempfile.gettempdir(), "chatbot-profiles")),
+    token=PROFILE_TOKEN,
+    sample_every=int(os.environ.get("PROFILE_SAMPLE", 0)),
+    keep=int(os.environ.get("PROFILE_KEEP", 50))
+)
+app.wsgi_app = ProfilingMiddleware(app.wsgi_app, PROFILER)
+
+def require_admin():
+    auth = request.headers.get("Authorization", "")
+    if not PROFILE_TOKEN or not token_matches(auth, "Bearer " + PROFILE_TOKEN):
+        abort(404)
+
+@app.route("/admin/profiles")
+def list_profiles():
+    require_admin()
+    return jsonify({"profiles": [
+        {"id": name, "collapsed": f"/admin/profiles/{name}.collapsed", "pstats": f"/admin/profiles/{name}.pstats"}
+        for name in PROFILER.list()
+    ]})
+
+@app.route("/admin/profiles/<filename>")
+def download_profile(filename):
+    require_admin()
+    path = PROFILER.path(filename)
+    if path is None:
+        abort(404)
+    mimetype = "text/plain" if filename.endswith(".collapsed") else "application/octet-stream"
+    return send_file(path, mimetype=mimetype, as_attachment=True, max_age=0)
+
+# ======= Admission control (see admission.py) =======
+# Runs as WSGI middleware in front of Flask, so refusals skip the framework;
+# they show up in /metrics as chatbot_admission_rejected_total.
+ADMISSION = AdmissionController(
+    # per client: sustained requests/s and burst; 0 (the default) turns the rate limit off.
+    # Behind a proxy set ADMISSION_CLIENT_HEADER too, or every parent shares the proxy's bucket
+    rate=float(os.environ.get("ADMISSION_RATE", 0)),
+    burst=int(os.environ.get("ADMISSION_BURST", 30)),
+    # per process: requests handled at once, and how many may wait how long for a slot
+    max_concurrent=int(os.environ.get("ADMISSION_MAX_CONCURRENT", 16)),
+    max_queue=int(os.environ.get("ADMISSION_MAX_QUEUE", 64)),
+    queue_timeout=float(os.environ.get("ADMISSION_QUEUE_TIMEOUT", 0.25)),
+    cheap_reserve=int(os.environ.get("ADMISSION_CHEAP_RESERVE", 8)),
+    # shed requests older than this per X-Request-Start (set by the proxy); 0 = off
+    max_wait=float(os.environ.get("ADMISSION_MAX_WAIT", 0)),
+    retry_after=int(os.environ.get("ADMISSION_RETRY_AFTER", 1))
+)
+# Header holding the real client address behind a proxy (e.g. X-Forwarded-For);
+# unset means the socket's peer address
+ADMISSION_CLIENT_HEADER = (os.environ.get("ADMISSION_CLIENT_HEADER") or "").lower()
+if ADMISSION.rate > 0 and not ADMISSION_CLIENT_HEADER:
+    app.logger.warning("ADMISSION_RATE is per socket peer: behind a proxy, set ADMISSION_CLIENT_HEADER")
+ADMISSION_EXEMPT = {"/metrics", "/cache/stats", "/sessions/stats", "/admission/stats", "/querylog/stats",
+                    "/tenants/stats"}
+
+def client_key(forwarded, peer):
+    # first address in the proxy's header, else the peer
+    return forwarded.split(",")[0].strip() if forwarded else peer
+
+def is_static(method, path):
+    # the page and what it loads with it: not charged to the client's rate bucket
+    return method in ("GET", "HEAD") and (path in ("/", "/chat/bundle", "/chat/suggestions")
+                                          or path.startswith("/assets/"))
+
+def is_cheap(method, path, data, tenant=DEFAULT_TENANT, compact=False):
+    # answered from memory without matching: pre-rendered pages and bundle, cached /chat replies;
+    # tenant is None for a school that isn't compiled yet
+    if method in ("GET", "HEAD"):
+        return path.startswith("/assets/") or (tenant is not None and is_static(method, path))
+    if path == "/chat" and tenant is not None and isinstance(data, dict):
+        msg = data.get("message")
+        if isinstance(msg, str):
+            norm = normalize_message(msg.strip())
+            key = (tenant.name, tenant.kb_store.current.version, tenant.facts.current.version, norm, compact)
+            return len(norm) <= CACHE_MAX_MESSAGE and key in RESPONSE_CACHE
+    return False
+
+def resident_tenant(name):
+    # like find_tenant(), but never compiles one
+    return DEFAULT_TENANT if name is None else TENANTS.peek(name)
+
+def classify_request(environ):
+    path = environ.get("PATH_INFO", "")
+    if path in ADMISSION_EXEMPT:
+        return None
+    method = environ.get("REQUEST_METHOD", "GET")
+    data = None
+    if method == "POST" and path == "/chat":
+        body = read_body(environ)
+        try:
+            data = json.loads(body) if body else None
+        except ValueError:
+            pass
+    forwarded = None
+    if ADMISSION_CLIENT_HEADER:
+        forwarded = environ.get("HTTP_" + ADMISSION_CLIENT_HEADER.upper().replace("-", "_"))
+    tenant = resident_tenant(environ.get(TENANT_KEY))
+    compact = environ.get("HTTP_X_CHAT_FORMAT") == COMPACT
+    client = None if is_static(method, path) else client_key(forwarded, environ.get("REMOTE_ADDR"))
+    return client, is_cheap(method, path, data, tenant, compact)
+
+def rejection_body(status):
+    if status == 429:
+        return to_json_bytes({"error": "Too many requests, please retry shortly."})
+    return to_json_bytes({"error": "The assistant is busy, please retry shortly."})
+
+def admission_counters():
+    return {("chatbot_admission_rejected_total", (("reason", reason),)): count
+            for reason, count in ADMISSION.rejected.items()}
+
+METRICS.add_collector(admission_counters)
+app.wsgi_app = AdmissionMiddleware(app.wsgi_app, ADMISSION, classify_request, rejection_body)
+
+@app.route("/admission/stats")
+def admission_stats():
+    return jsonify(ADMISSION.stats())
+
+# ======= Tenant routing (see tenants.py) =======
+# In front of admission, so everything behind it sees /chat rather than
+# /t/<name>/chat; a cold tenant is compiled only once its request is admitted.
+def tenant_counters():
+    stats = TENANTS.stats()
+    return {
+        ("chatbot_tenant_loads_total", ()): stats["loads"],
+        ("chatbot_tenant_evictions_total", ()): stats["evictions"],
+        ("chatbot_tenant_expirations_total", ()): stats["expirations"],
     }
-    return jsonify(payload)
+
+if TENANTS is not None:
+    METRICS.add_collector(tenant_counters)
+    app.wsgi_app = TenantMiddleware(app.wsgi_app, TENANT_DOMAIN)
+
+@app.route("/tenants/stats")
+def tenants_stats():
+    return jsonify(TENANTS.stats() if TENANTS is not None else {"enabled": False})
+
+# ======= App factory =======
+# gunicorn --preload -w 4 "test:create_app()"
+# Everything above is built once in the gunicorn master and forked into the
+# workers. The KB's big arrays are mapped from its snapshot file, so they sit in
+# the page cache; gc.freeze() keeps the collector from writing to the rest of
+# the startup objects, which would copy their pages into every worker.
+def create_app():
+    # warm what the first request would otherwise build in each worker
+    app.url_map.bind("localhost").match("/chat", "POST")
+    detect_intent("hello")
+    current_bundle()
+    current_envelopes()
+    gc.collect()
+    gc.freeze()
+    return app
 
 if __name__ == "__main__":
     app.run(debug=True, port=5000)